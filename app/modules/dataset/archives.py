@@ -0,0 +1,295 @@
+import fcntl
+import glob
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator, Optional, Union
+from zipfile import ZipFile, ZipInfo
+
+from flask import Response, current_app
+
+from core.caches.BaseDiskCache import BaseDiskCache
+from core.configuration.configuration import cache_folder_path
+from core.helpers.http import attachment_options
+
+CHUNK_SIZE = 64 * 1024
+
+
+class _ChunkBuffer:
+    """Write-only file object collecting what ZipFile writes until it is drained."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> Iterator[bytes]:
+        if self._chunks:
+            data = b"".join(self._chunks)
+            self._chunks = []
+            yield data
+
+
+def stream_zip(entries: Iterable[tuple[Union[str, bytes], str]], chunk_size=CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Yields the bytes of a ZIP archive of the given (path, arcname) entries as
+    it is written. The files are read chunk by chunk and nothing is written to
+    disk, so memory stays bounded by the chunk size whatever the archive size.
+    An entry whose path is bytes is added with those bytes as its content.
+    """
+    buffer = _ChunkBuffer()
+    # ZipFile falls back to data descriptors when the output cannot seek
+    with ZipFile(buffer, "w") as zipf:
+        for path, arcname in entries:
+            if isinstance(path, bytes):
+                zipf.writestr(ZipInfo(arcname, time.localtime()[:6]), path)
+                yield from buffer.drain()
+                continue
+            with open(path, "rb") as source, zipf.open(
+                ZipInfo.from_file(path, arcname), "w"
+            ) as target:
+                while chunk := source.read(chunk_size):
+                    target.write(chunk)
+                    yield from buffer.drain()
+            yield from buffer.drain()
+    yield from buffer.drain()
+
+
+def directory_entries(directory: str, root_name: str) -> Iterator[tuple[str, str]]:
+    """(path, arcname) of every file below a directory, placed under root_name."""
+    for subdir, dirs, files in os.walk(directory):
+        dirs.sort()
+        for file in sorted(files):
+            full_path = os.path.join(subdir, file)
+            relative_path = os.path.relpath(full_path, directory)
+            yield full_path, os.path.join(root_name, relative_path)
+
+
+def zip_response(chunks: Iterable[bytes], filename: str) -> Response:
+    """Chunked download of the bytes of a ZIP archive."""
+    response = Response(chunks, mimetype="application/zip")
+    response.headers.set("Content-Disposition", "attachment", **attachment_options(filename))
+    return response
+
+
+class ArchiveCache(BaseDiskCache):
+    """
+    Dataset archives kept on disk in the cache folder, so the workers share
+    them and a repeated download is served with sendfile instead of zipping.
+
+    Entries are named after the dataset id and a digest of everything that
+    ends up in the archive (file names, checksums and archive name), so an
+    edited file or a renamed dataset simply misses. The least recently used
+    archives are evicted once the folder exceeds ARCHIVE_CACHE_MAX_BYTES.
+    """
+
+    folder = "archives"
+    max_bytes_setting = "ARCHIVE_CACHE_MAX_BYTES"
+    suffixes = (".zip",)
+
+    @staticmethod
+    def make_key(dataset_id: int, archive_name: str, files: Iterable[tuple[str, str]]) -> str:
+        digest = hashlib.sha256(archive_name.encode())
+        for name, checksum in sorted(files):
+            digest.update(f"\0{name}\0{checksum}".encode())
+        return f"dataset_{dataset_id}_{digest.hexdigest()[:32]}"
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.zip")
+
+    def lookup(self, key: str) -> Optional[str]:
+        return self._touch(self.path(key))
+
+    def store(self, key: str, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """
+        Passes the chunks of an archive through while writing them to the cache.
+        The entry only appears once the archive is complete, and is dropped if
+        the download is interrupted.
+        """
+        # Resolved now, the response is streamed outside of the app context
+        return self._store(key, chunks, self.max_bytes)
+
+    def _store(self, key, chunks, max_bytes):
+        partial = self._partial_path(self.path(key))
+        completed = False
+        try:
+            with open(partial, "wb") as file:
+                for chunk in chunks:
+                    file.write(chunk)
+                    yield chunk
+            os.replace(partial, self.path(key))
+            completed = True
+        finally:
+            if not completed and os.path.exists(partial):
+                os.remove(partial)
+
+        self.evict(max_bytes)
+
+    def invalidate(self, dataset_id: int):
+        for path in glob.glob(os.path.join(self.directory, f"dataset_{dataset_id}_*.zip")):
+            self._remove(path)
+
+
+archive_cache = ArchiveCache()
+
+
+def listing_digest(rows: Iterable[tuple]) -> str:
+    """Digest of a listing of files, changing whenever a file is added, removed or edited."""
+    digest = hashlib.sha256()
+    for row in rows:
+        digest.update(json.dumps(list(row), default=str).encode())
+    return digest.hexdigest()
+
+
+class ArchiveSnapshot:
+    """
+    Prebuilt archive of a listing of files whose first column is the dataset
+    id, with a manifest of the listing it was built from. It is only served
+    while the listing digest still matches, so a stale snapshot is never sent.
+
+    A refresh after a dataset is published copies the previous snapshot and
+    appends the new datasets to it. Any other change to the listing (an edited
+    file, a removed dataset) rebuilds it from scratch.
+    """
+
+    def __init__(self, name: str, directory=None):
+        self.name = name
+        self._directory = directory
+
+    @property
+    def directory(self) -> str:
+        return os.path.abspath(self._directory or cache_folder_path("snapshots"))
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.directory, f"{self.name}.zip")
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.directory, f"{self.name}.json")
+
+    def lookup(self, digest: str) -> Optional[str]:
+        manifest = self._read_manifest()
+        if manifest and manifest["digest"] == digest and os.path.exists(self.path):
+            return self.path
+        return None
+
+    def refresh(self, rows: list[tuple], entries: Callable[[list[tuple]], Iterable[tuple[str, str]]]):
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock():
+            manifest = self._read_manifest()
+            included = set(manifest["datasets"]) if manifest else set()
+            kept = [row for row in rows if row[0] in included]
+            added = [row for row in rows if row[0] not in included]
+            if not added and manifest and manifest["digest"] == listing_digest(rows):
+                return
+
+            partial = f"{self.path}.{uuid.uuid4().hex}.partial"
+            try:
+                incremental = bool(kept) and manifest["digest"] == listing_digest(kept)
+                if incremental and os.path.exists(self.path):
+                    shutil.copyfile(self.path, partial)
+                    with ZipFile(partial, "a") as zipf:
+                        for path, arcname in entries(added):
+                            zipf.write(path, arcname)
+                else:
+                    with ZipFile(partial, "w") as zipf:
+                        for path, arcname in entries(rows):
+                            zipf.write(path, arcname)
+                os.replace(partial, self.path)
+            finally:
+                if os.path.exists(partial):
+                    os.remove(partial)
+
+            # Written after the archive, a matching manifest implies a matching archive
+            self._write_manifest(
+                {
+                    "digest": listing_digest(rows),
+                    "datasets": sorted({row[0] for row in rows}),
+                }
+            )
+
+    def _read_manifest(self) -> Optional[dict]:
+        try:
+            with open(self.manifest_path) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def _write_manifest(self, manifest: dict):
+        partial = f"{self.manifest_path}.{uuid.uuid4().hex}.partial"
+        with open(partial, "w") as file:
+            json.dump(manifest, file)
+        os.replace(partial, self.manifest_path)
+
+    @contextmanager
+    def _lock(self):
+        # Serializes the refreshes of every worker
+        with open(os.path.join(self.directory, f"{self.name}.lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+datasets_snapshot = ArchiveSnapshot("all_datasets")
+
+
+class SnapshotRefresher:
+    """
+    Brings the download-all snapshot up to date from a background thread of
+    each worker, so that an upload does not wait for the whole archive to be
+    copied and appended to. Requests made while a refresh runs are coalesced
+    into a single following one.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._requested = False
+        self._app = None
+        self._thread = None
+        self._pid = None
+
+    def request(self):
+        if not current_app.config["DATASETS_SNAPSHOT"]:
+            return
+
+        with self._lock:
+            self._start(current_app._get_current_object())
+            self._requested = True
+            self._wakeup.notify()
+
+    def _start(self, app):
+        # Called with the lock held, a forked worker starts its own thread
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        self._pid = os.getpid()
+        self._app = app
+        self._thread = threading.Thread(target=self._run, name="datasets-snapshot", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        from app.modules.dataset.services import DataSetService
+
+        while True:
+            with self._lock:
+                while not self._requested:
+                    self._wakeup.wait()
+                self._requested = False
+            with self._app.app_context():
+                DataSetService().refresh_all_datasets_snapshot()
+
+
+snapshot_refresher = SnapshotRefresher()
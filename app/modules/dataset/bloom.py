@@ -0,0 +1,243 @@
+import fcntl
+import hashlib
+import math
+import mmap
+import os
+import struct
+import threading
+import uuid
+from typing import Iterable, Optional
+
+from core.configuration.configuration import cache_folder_path
+
+MAGIC = b"CHBLOOM1"
+
+# Magic, number of bits and number of hashes, followed by the bit array
+HEADER = struct.Struct("<8sQI")
+
+
+def optimal_parameters(capacity: int, error_rate: float) -> tuple[int, int]:
+    """Number of bits and of hash functions giving error_rate once capacity keys are added."""
+    capacity = max(capacity, 1)
+    bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+    hashes = max(1, round(bits / capacity * math.log(2)))
+    return bits, hashes
+
+
+class BloomFilter:
+    """
+    Bloom filter stored in a memory-mapped file, so that every worker on the
+    host shares the same bits and sees the keys added by the others as soon
+    as they are set. The kernel writes the pages back to the file, flush()
+    forces it.
+
+    A missing file means the filter has not been built yet: might_contain
+    then answers True for every key, so callers fall back to their exact
+    check until build() has been run.
+
+    While build() runs, the keys added by any worker are also appended to a
+    journal, and replayed into the new filter before it is swapped in.
+
+    The file is local to the host, the workers of another host keep their
+    own filter, so a miss is only a hint and callers still need an exact
+    guard such as a unique key.
+    """
+
+    def __init__(self, name: str, directory=None):
+        self.name = name
+        self._directory = directory
+        self._lock = threading.Lock()
+        self._file = None
+        self._map = None
+        self._identity = None
+        self.checks = 0
+        self.definite_misses = 0
+        self.false_positives = 0
+
+    @property
+    def directory(self) -> str:
+        return os.path.abspath(self._directory or cache_folder_path("filters"))
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.directory, f"{self.name}.bloom")
+
+    @property
+    def journal_path(self) -> str:
+        return f"{self.path}.journal"
+
+    def build(self, keys: Iterable[bytes], capacity: int, error_rate: float) -> int:
+        """
+        Builds a new filter holding the given keys, and those added while it
+        runs, and swaps it in, the workers map it on their next check.
+        Returns the number of keys.
+        """
+        bits, hashes = optimal_parameters(capacity, error_rate)
+        array = bytearray((bits + 7) // 8)
+        count = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+        partial = f"{self.path}.{uuid.uuid4().hex}.partial"
+        with open(self.journal_path, "ab") as journal:
+            try:
+                for key in keys:
+                    self._set(array, 0, key, bits, hashes)
+                    count += 1
+
+                # Held until the new file is in place, later adds go to it
+                fcntl.flock(journal, fcntl.LOCK_EX)
+                with open(self.journal_path, "rb") as added:
+                    for line in added:
+                        self._set(array, 0, bytes.fromhex(line.decode()), bits, hashes)
+                        count += 1
+                with open(partial, "wb") as file:
+                    file.write(HEADER.pack(MAGIC, bits, hashes))
+                    file.write(array)
+                os.replace(partial, self.path)
+            finally:
+                if os.path.exists(self.journal_path):
+                    os.remove(self.journal_path)
+                if os.path.exists(partial):
+                    os.remove(partial)
+        return count
+
+    @property
+    def ready(self) -> bool:
+        with self._lock:
+            return self._mapping() is not None
+
+    def might_contain(self, key: bytes) -> bool:
+        with self._lock:
+            mapping = self._mapping()
+            if mapping is None:
+                return True
+
+            present = all(
+                self._map[HEADER.size + position // 8] & (1 << position % 8)
+                for position in self._positions(key, *mapping)
+            )
+            self.checks += 1
+            if not present:
+                self.definite_misses += 1
+            return present
+
+    def add(self, keys: Iterable[bytes]) -> int:
+        keys = list(keys)
+        with self._lock:
+            journal = self._open_journal()
+            try:
+                if journal is not None:
+                    journal.write(b"".join(key.hex().encode() + b"\n" for key in keys))
+                mapping = self._mapping()
+                if mapping is None:
+                    return 0
+
+                # Setting a bit rewrites its whole byte, the flock keeps workers from undoing each other
+                fcntl.flock(self._file, fcntl.LOCK_EX)
+                try:
+                    for key in keys:
+                        self._set(self._map, HEADER.size, key, *mapping)
+                finally:
+                    fcntl.flock(self._file, fcntl.LOCK_UN)
+                return len(keys)
+            finally:
+                if journal is not None:
+                    journal.close()
+
+    def record_false_positives(self, count: int):
+        with self._lock:
+            self.false_positives += count
+
+    def flush(self):
+        with self._lock:
+            if self._map is not None:
+                self._map.flush()
+
+    def close(self):
+        with self._lock:
+            self._unmap()
+
+    def stats(self) -> dict:
+        with self._lock:
+            mapping = self._mapping()
+            maybe_present = self.checks - self.definite_misses
+            stats = {
+                "ready": mapping is not None,
+                "checks": self.checks,
+                "definite_misses": self.definite_misses,
+                "false_positives": self.false_positives,
+                # Share of the keys reported as present that were not
+                "false_positive_rate": round(self.false_positives / maybe_present, 4) if maybe_present else 0.0,
+            }
+            if mapping is not None:
+                bits, hashes = mapping
+                set_bits = int.from_bytes(self._map[HEADER.size:], "little").bit_count()
+                stats.update(
+                    {
+                        "bits": bits,
+                        "hashes": hashes,
+                        "fill_ratio": round(set_bits / bits, 4),
+                        "expected_false_positive_rate": round((set_bits / bits) ** hashes, 6),
+                    }
+                )
+        return stats
+
+    @classmethod
+    def _set(cls, array, offset: int, key: bytes, bits: int, hashes: int):
+        for position in cls._positions(key, bits, hashes):
+            array[offset + position // 8] |= 1 << position % 8
+
+    def _open_journal(self):
+        """
+        Called with the lock held. Opens the journal of the running build, if
+        any, locked so that the build does not swap the filter in meanwhile.
+        """
+        try:
+            # Never created here, a journal left behind would grow forever
+            journal = os.fdopen(os.open(self.journal_path, os.O_WRONLY | os.O_APPEND), "ab", buffering=0)
+        except FileNotFoundError:
+            return None
+
+        fcntl.flock(journal, fcntl.LOCK_EX)
+        # Removed while waiting, the new filter is in place already
+        if os.fstat(journal.fileno()).st_nlink == 0:
+            journal.close()
+            return None
+        return journal
+
+    @staticmethod
+    def _positions(key: bytes, bits: int, hashes: int) -> list[int]:
+        digest = hashlib.sha256(key).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:16], "little") | 1
+        return [(first + i * second) % bits for i in range(hashes)]
+
+    def _mapping(self) -> Optional[tuple[int, int]]:
+        """
+        Called with the lock held. Maps the file, again if a rebuild replaced
+        it, and returns its number of bits and of hashes.
+        """
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self._unmap()
+            return None
+
+        # A forked worker opens its own descriptor, flocks on an inherited one would be shared
+        identity = (stat.st_dev, stat.st_ino, os.getpid())
+        if self._identity != identity:
+            self._unmap()
+            self._file = open(self.path, "r+b")
+            self._map = mmap.mmap(self._file.fileno(), 0)
+            self._identity = identity
+
+        magic, bits, hashes = HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            return None
+        return bits, hashes
+
+    def _unmap(self):
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+        self._map = self._file = self._identity = None
@@ -0,0 +1,68 @@
+import fcntl
+import hashlib
+import os
+from typing import Optional
+
+from flask import current_app
+
+from core.configuration.configuration import cache_folder_path
+
+
+class DownloadSlot:
+    """Locks held for the duration of one download, released when it ends."""
+
+    def __init__(self, files):
+        self._files = files
+
+    def release(self):
+        for file in self._files:
+            # Closing the descriptor drops its lock
+            file.close()
+        self._files = []
+
+
+class DownloadSlots:
+    """
+    Bounds how many expensive downloads run at once, across every worker.
+
+    Each running download holds an flock on one of BULK_DOWNLOAD_CONCURRENCY
+    slot files plus one on a per-client file, so the whole site and every
+    single client are limited. The kernel drops the locks of a dead worker.
+    """
+
+    def __init__(self, name: str, directory=None):
+        self.name = name
+        self._directory = directory
+
+    @property
+    def directory(self) -> str:
+        return os.path.abspath(self._directory or cache_folder_path("locks"))
+
+    def acquire(self, client: str) -> Optional[DownloadSlot]:
+        os.makedirs(self.directory, exist_ok=True)
+
+        # Clients share a bounded set of lock files, a rare collision only delays one
+        bucket = hashlib.sha1(client.encode()).hexdigest()[:3]
+        client_lock = self._try_lock(f"{self.name}_client_{bucket}.lock")
+        if client_lock is None:
+            return None
+
+        for slot in range(current_app.config["BULK_DOWNLOAD_CONCURRENCY"]):
+            slot_lock = self._try_lock(f"{self.name}_slot_{slot}.lock")
+            if slot_lock is not None:
+                return DownloadSlot([slot_lock, client_lock])
+
+        client_lock.close()
+        return None
+
+    def _try_lock(self, filename: str):
+        file = open(os.path.join(self.directory, filename), "a")
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            file.close()
+            return None
+        return file
+
+
+bulk_download_slots = DownloadSlots("bulk_download")
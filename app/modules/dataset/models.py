@@ -1,3 +1,4 @@
+import os
 from datetime import datetime
 from enum import Enum
 
@@ -43,8 +44,19 @@ class Author(db.Model):
 
 class DSMetrics(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    number_of_models = db.Column(db.String(120))
-    number_of_features = db.Column(db.String(120))
+    number_of_models = db.Column(db.Integer)
+    number_of_features = db.Column(db.Integer, index=True)
+    number_of_constraints = db.Column(db.Integer)
+    max_tree_depth = db.Column(db.Integer)
+    computed_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {
+            "number_of_models": self.number_of_models,
+            "number_of_features": self.number_of_features,
+            "number_of_constraints": self.number_of_constraints,
+            "max_tree_depth": self.max_tree_depth,
+        }
 
     def __repr__(self):
         return f"DSMetrics<models={self.number_of_models}, features={self.number_of_features}>"
@@ -59,6 +71,9 @@ class DSMetaData(db.Model):
     publication_doi = db.Column(db.String(120))
     dataset_doi = db.Column(db.String(120))
     tags = db.Column(db.String(120))
+    author_count = db.Column(
+        db.Integer, nullable=False, default=0, server_default="0", index=True
+    )
     ds_metrics_id = db.Column(db.Integer, db.ForeignKey("ds_metrics.id"))
     ds_metrics = db.relationship(
         "DSMetrics", uselist=False, backref="ds_meta_data", cascade="all, delete"
@@ -94,6 +109,17 @@ class DataSet(db.Model):
 
     community_id = db.Column(db.Integer, db.ForeignKey("community.id"), nullable=True)
 
+    # Denormalized counters of DSViewRecord/DSDownloadRecord rows, used by the explore sorts
+    view_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    download_count = db.Column(
+        db.Integer, nullable=False, default=0, server_default="0"
+    )
+
+    __table_args__ = (
+        db.Index("ix_data_set_view_count", "view_count", "id"),
+        db.Index("ix_data_set_download_count", "download_count", "id"),
+    )
+
     def share_with_community(self, community):
         """Asociar el dataset con una comunidad"""
         self.community_id = community.id
@@ -136,9 +162,8 @@ class DataSet(db.Model):
         return SizeService().get_human_readable_size(self.get_file_total_size())
 
     def get_uvlhub_doi(self):
-        from app.modules.dataset.services import DataSetService
-
-        return DataSetService().get_uvlhub_doi(self)
+        domain = os.getenv("DOMAIN", "localhost")
+        return f"http://{domain}/doi/{self.ds_meta_data.dataset_doi}"
 
     def to_dict(self):
         return {
@@ -161,6 +186,7 @@ class DataSet(db.Model):
             "files_count": self.get_files_count(),
             "total_size_in_bytes": self.get_file_total_size(),
             "total_size_in_human_format": self.get_file_total_size_for_human(),
+            "metrics": self.ds_meta_data.ds_metrics.to_dict() if self.ds_meta_data.ds_metrics else None,
         }
 
     def __repr__(self):
@@ -173,6 +199,8 @@ class DSDownloadRecord(db.Model):
     dataset_id = db.Column(db.Integer, db.ForeignKey("data_set.id"))
     download_date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     download_cookie = db.Column(db.String(36), nullable=False)  # Assuming UUID4 strings
+    # Hash of the (user, dataset, cookie) tracked, one record each whichever host writes it
+    record_key = db.Column(db.String(64), unique=True)
 
     def __repr__(self):
         return (
@@ -189,6 +217,8 @@ class DSViewRecord(db.Model):
     dataset_id = db.Column(db.Integer, db.ForeignKey("data_set.id"))
     view_date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     view_cookie = db.Column(db.String(36), nullable=False)  # Assuming UUID4 strings
+    # Hash of the (user, dataset, cookie) tracked, one record each whichever host writes it
+    record_key = db.Column(db.String(64), unique=True)
 
     def __repr__(self):
         return f"<View id={self.id} dataset_id={self.dataset_id} date={self.view_date} cookie={self.view_cookie}>"
@@ -3,16 +3,20 @@ import logging
 from flask_login import current_user
 from typing import Optional
 
-from sqlalchemy import desc, func
+from sqlalchemy import desc, func, select, update
+from sqlalchemy.orm import selectinload
 
 from app.modules.dataset.models import (
     Author,
     DOIMapping,
     DSDownloadRecord,
     DSMetaData,
+    DSMetrics,
     DSViewRecord,
     DataSet,
 )
+from app.modules.featuremodel.models import FMMetaData, FeatureModel
+from app.modules.hubfile.models import Hubfile
 from core.repositories.BaseRepository import BaseRepository
 
 logger = logging.getLogger(__name__)
@@ -27,6 +31,13 @@ class DSDownloadRecordRepository(BaseRepository):
     def __init__(self):
         super().__init__(DSDownloadRecord)
 
+    def create(self, commit: bool = True, **kwargs) -> DSDownloadRecord:
+        record = super().create(commit=False, **kwargs)
+        DataSetRepository().increment_counter(record.dataset_id, "download_count")
+        if commit:
+            self.session.commit()
+        return record
+
     def total_dataset_downloads(self) -> int:
         max_id = self.model.query.with_entities(func.max(self.model.id)).scalar()
         return max_id if max_id is not None else 0
@@ -39,11 +50,38 @@ class DSMetaDataRepository(BaseRepository):
     def filter_by_doi(self, doi: str) -> Optional[DSMetaData]:
         return self.model.query.filter_by(dataset_doi=doi).first()
 
+    def recount_authors(self) -> int:
+        """Rebuilds the author_count of every dataset metadata from the author table."""
+        authors = (
+            select(func.count(Author.id))
+            .where(Author.ds_meta_data_id == self.model.id)
+            .scalar_subquery()
+        )
+        result = self.session.execute(
+            update(self.model)
+            .values(author_count=authors)
+            .execution_options(synchronize_session=False)
+        )
+        self.session.commit()
+        return result.rowcount
+
+
+class DSMetricsRepository(BaseRepository):
+    def __init__(self):
+        super().__init__(DSMetrics)
+
 
 class DSViewRecordRepository(BaseRepository):
     def __init__(self):
         super().__init__(DSViewRecord)
 
+    def create(self, commit: bool = True, **kwargs) -> DSViewRecord:
+        record = super().create(commit=False, **kwargs)
+        DataSetRepository().increment_counter(record.dataset_id, "view_count")
+        if commit:
+            self.session.commit()
+        return record
+
     def total_dataset_views(self) -> int:
         max_id = self.model.query.with_entities(func.max(self.model.id)).scalar()
         return max_id if max_id is not None else 0
@@ -68,6 +106,100 @@ class DataSetRepository(BaseRepository):
     def __init__(self):
         super().__init__(DataSet)
 
+    @staticmethod
+    def serialization_options():
+        """Loader options that fetch everything DataSet.to_dict needs in a fixed number of queries."""
+        return (
+            selectinload(DataSet.ds_meta_data).selectinload(DSMetaData.authors),
+            selectinload(DataSet.ds_meta_data).selectinload(DSMetaData.ds_metrics),
+            selectinload(DataSet.feature_models).selectinload(FeatureModel.files),
+        )
+
+    def load_for_serialization(self, datasets: list[DataSet]):
+        """
+        Loads the metadata, authors, metrics, feature models and files of already fetched
+        datasets with one query per relationship instead of several per dataset.
+        """
+        dataset_ids = [dataset.id for dataset in datasets]
+        if dataset_ids:
+            (
+                self.model.query.options(*self.serialization_options())
+                .filter(self.model.id.in_(dataset_ids))
+                .all()
+            )
+
+    def get_file_checksums(self, dataset_id: int) -> list[tuple[str, str]]:
+        return [
+            tuple(row)
+            for row in self.session.query(Hubfile.name, Hubfile.checksum)
+            .join(FeatureModel, Hubfile.feature_model_id == FeatureModel.id)
+            .filter(FeatureModel.data_set_id == dataset_id)
+            .all()
+        ]
+
+    def get_synchronized_files(self, dataset_ids=None) -> list[tuple[int, int, str, str, str]]:
+        """(dataset id, owner id, title, file name, checksum) of every synchronized file."""
+        query = (
+            self.session.query(
+                self.model.id,
+                self.model.user_id,
+                DSMetaData.title,
+                Hubfile.name,
+                Hubfile.checksum,
+            )
+            .join(DSMetaData, self.model.ds_meta_data_id == DSMetaData.id)
+            .join(FeatureModel, FeatureModel.data_set_id == self.model.id)
+            .join(Hubfile, Hubfile.feature_model_id == FeatureModel.id)
+            .filter(DSMetaData.dataset_doi.isnot(None))
+        )
+        if dataset_ids is not None:
+            query = query.filter(self.model.id.in_(dataset_ids))
+
+        return [tuple(row) for row in query.order_by(self.model.id, Hubfile.name)]
+
+    def increment_counter(self, dataset_id: int, counter: str, amount: int = 1):
+        column = getattr(self.model, counter)
+        self.session.execute(
+            update(self.model)
+            .where(self.model.id == dataset_id)
+            .values({counter: column + amount})
+            .execution_options(synchronize_session=False)
+        )
+
+    def reconcile_counters(self) -> int:
+        """Rebuilds the view and download counters of every dataset from the record tables."""
+        views = (
+            select(func.count(DSViewRecord.id))
+            .where(DSViewRecord.dataset_id == self.model.id)
+            .scalar_subquery()
+        )
+        downloads = (
+            select(func.count(DSDownloadRecord.id))
+            .where(DSDownloadRecord.dataset_id == self.model.id)
+            .scalar_subquery()
+        )
+        result = self.session.execute(
+            update(self.model)
+            .values(view_count=views, download_count=downloads)
+            .execution_options(synchronize_session=False)
+        )
+        self.session.commit()
+        return result.rowcount
+
+    def get_ids_without_metrics(self) -> list[int]:
+        """Datasets whose metrics were never computed, or are missing for some of their feature models."""
+        return [
+            dataset_id
+            for (dataset_id,) in self.session.query(self.model.id)
+            .join(DSMetaData, self.model.ds_meta_data_id == DSMetaData.id)
+            .outerjoin(DSMetrics, DSMetaData.ds_metrics_id == DSMetrics.id)
+            .filter(
+                (DSMetrics.computed_at.is_(None))
+                | self.model.feature_models.any(FeatureModel.fm_meta_data.has(FMMetaData.fm_metrics_id.is_(None)))
+            )
+            .order_by(self.model.id)
+        ]
+
     def get_dataset_name(self, dataset_id: int) -> str:
         dataset = self.model.query.get(dataset_id)
         return dataset.ds_meta_data.title if dataset else f"dataset:{dataset_id}"
@@ -87,6 +219,7 @@ class DataSetRepository(BaseRepository):
     def get_synchronized(self, current_user_id: int) -> DataSet:
         return (
             self.model.query.join(DSMetaData)
+            .options(*self.serialization_options())
             .filter(
                 DataSet.user_id == current_user_id, DSMetaData.dataset_doi.isnot(None)
             )
@@ -97,6 +230,7 @@ class DataSetRepository(BaseRepository):
     def get_unsynchronized(self, current_user_id: int) -> DataSet:
         return (
             self.model.query.join(DSMetaData)
+            .options(*self.serialization_options())
             .filter(
                 DataSet.user_id == current_user_id, DSMetaData.dataset_doi.is_(None)
             )
@@ -134,12 +268,35 @@ class DataSetRepository(BaseRepository):
     def latest_synchronized(self):
         return (
             self.model.query.join(DSMetaData)
+            .options(*self.serialization_options())
             .filter(DSMetaData.dataset_doi.isnot(None))
             .order_by(desc(self.model.id))
             .limit(5)
             .all()
         )
 
+    def latest_synchronized_ids(self, limit: int = 5) -> list[int]:
+        return [
+            dataset_id
+            for (dataset_id,) in self.session.query(self.model.id)
+            .join(DSMetaData)
+            .filter(DSMetaData.dataset_doi.isnot(None))
+            .order_by(desc(self.model.id))
+            .limit(limit)
+        ]
+
+    def get_by_ids(self, dataset_ids: list[int]) -> list[DataSet]:
+        """Datasets in the order of the given ids, skipping those that no longer exist."""
+        if not dataset_ids:
+            return []
+        datasets = {
+            dataset.id: dataset
+            for dataset in self.model.query.options(*self.serialization_options()).filter(
+                self.model.id.in_(dataset_ids)
+            )
+        }
+        return [datasets[dataset_id] for dataset_id in dataset_ids if dataset_id in datasets]
+
 
 class DOIMappingRepository(BaseRepository):
     def __init__(self):
@@ -2,30 +2,30 @@ import logging
 import os
 import json
 import shutil
-import tempfile
 import uuid
-from datetime import datetime, timezone
-from zipfile import ZipFile
+from datetime import datetime
 from sqlalchemy import or_
 
 
 from flask import (
+    current_app,
     redirect,
     render_template,
     request,
     jsonify,
-    send_from_directory,
     make_response,
     abort,
     url_for,
     flash,
-    send_file,
 )
 from flask_login import login_required, current_user
 
+from app.modules.dataset.archives import archive_cache, snapshot_refresher, stream_zip, zip_response
+from app.modules.dataset.download_slots import bulk_download_slots
 from app.modules.dataset.forms import DataSetForm
-from app.modules.dataset.models import DSDownloadRecord, DataSet, DatasetReview
+from app.modules.dataset.models import DataSet, DatasetReview
 from app.modules.dataset import dataset_bp
+from app.modules.dataset.tracking import tracking_buffer, tracking_filter
 from app.modules.dataset.services import (
     AuthorService,
     DSDownloadRecordService,
@@ -39,6 +39,9 @@ from app import db
 from app.modules.community.services import CommunityService
 
 from app.modules.fakenodo.services import FakeNodoService
+from app.modules.flamapy.metrics import metrics_queue
+from app.modules.explore.services import ExploreService
+from core.helpers.http import not_modified, send_download
 
 logger = logging.getLogger(__name__)
 
@@ -97,6 +100,7 @@ def create_dataset():
             )
             logger.info(f"Created dataset: {dataset}")
             dataset_service.move_feature_models(dataset)
+            metrics_queue.enqueue(dataset.id)
 
         except Exception as exc:
             logger.exception(f"Exception while create dataset data in local {exc}")
@@ -123,6 +127,8 @@ def create_dataset():
                 deposition_id=deposition_id,
                 dataset_doi=deposition_doi,
             )
+            # Appended to the download-all snapshot outside the request
+            snapshot_refresher.request()
 
         except Exception as exc:
             logger.exception(f"Exception while simulating deposition creation: {exc}")
@@ -264,26 +270,34 @@ def delete():
 @dataset_bp.route("/dataset/download/<int:dataset_id>", methods=["GET"])
 def download_dataset(dataset_id):
     dataset = dataset_service.get_or_404(dataset_id)
-    dataset_title = dataset.ds_meta_data.title
-
-    file_path = f"uploads/user_{dataset.user_id}/dataset_{dataset.id}/"
-
-    temp_dir = tempfile.mkdtemp()
-    zip_path = os.path.join(temp_dir, f"{dataset_title}_uvl.zip")
-
-    with ZipFile(zip_path, "w") as zipf:
-        for subdir, dirs, files in os.walk(file_path):
-            for file in files:
-                full_path = os.path.join(subdir, file)
-
-                relative_path = os.path.relpath(full_path, file_path)
-
-                zipf.write(
-                    full_path,
-                    arcname=os.path.join(
-                        os.path.basename(zip_path[:-4]), relative_path
-                    ),
-                )
+    archive_filename = f"{dataset_service.get_archive_name(dataset)}.zip"
+    # The cached archive is exactly the streamed one, so its key is a strong ETag
+    archive_key = dataset_service.get_archive_key(dataset)
+
+    unchanged = not_modified(archive_key)
+    if unchanged:
+        return unchanged
+
+    cached_archive = archive_cache.lookup(archive_key)
+    if not cached_archive and request.range:
+        # Resuming a download needs the archive on disk to serve byte ranges
+        for _ in archive_cache.store(archive_key, dataset_service.stream_archive(dataset)):
+            pass
+        cached_archive = archive_cache.lookup(archive_key)
+
+    if cached_archive:
+        resp = send_download(
+            cached_archive, archive_filename, mimetype="application/zip", etag=archive_key
+        )
+    else:
+        # First download since the files changed, zip it while caching it
+        resp = zip_response(
+            archive_cache.store(archive_key, dataset_service.stream_archive(dataset)),
+            archive_filename,
+        )
+        resp.set_etag(archive_key)
+        resp.headers["Accept-Ranges"] = "bytes"
+    resp.cache_control.no_cache = True
 
     user_cookie = request.cookies.get("download_cookie")
     if not user_cookie:
@@ -291,38 +305,14 @@ def download_dataset(dataset_id):
             uuid.uuid4()
         )  # Generate a new unique identifier if it does not exist
         # Save the cookie to the user's browser
-        resp = make_response(
-            send_from_directory(
-                temp_dir,
-                f"{dataset_title}_uvl.zip",
-                as_attachment=True,
-                mimetype="application/zip",
-            )
-        )
         resp.set_cookie("download_cookie", user_cookie)
-    else:
-        resp = send_from_directory(
-            temp_dir,
-            f"{dataset_title}_uvl.zip",
-            as_attachment=True,
-            mimetype="application/zip",
-        )
 
-    # Check if the download record already exists for this cookie
-    existing_record = DSDownloadRecord.query.filter_by(
-        user_id=current_user.id if current_user.is_authenticated else None,
-        dataset_id=dataset_id,
-        download_cookie=user_cookie,
-    ).first()
-
-    if not existing_record:
-        # Record the download in your database
-        DSDownloadRecordService().create(
-            user_id=current_user.id if current_user.is_authenticated else None,
-            dataset_id=dataset_id,
-            download_date=datetime.now(timezone.utc),
-            download_cookie=user_cookie,
-        )
+    # Record the download, a download already recorded for this cookie is skipped
+    DSDownloadRecordService().record_download(
+        dataset_id,
+        current_user.id if current_user.is_authenticated else None,
+        user_cookie,
+    )
 
     return resp
 
@@ -369,8 +359,89 @@ def get_unsynchronized_dataset(dataset_id):
 @dataset_bp.route("/dataset/download/all", methods=["GET"])
 def download_all_dataset():
 
-    zip_path, zip_filename = dataset_service.generate_datasets_and_name_zip()
-    return send_file(zip_path, as_attachment=True, download_name=zip_filename)
+    files = dataset_service.get_synchronized_files()
+    archive_filename = dataset_service.get_all_datasets_archive_name()
+
+    snapshot = dataset_service.get_all_datasets_snapshot(files)
+    if snapshot:
+        path, digest = snapshot
+        return send_download(path, archive_filename, mimetype="application/zip", etag=digest)
+
+    # Streamed this time, the snapshot is brought up to date for the next download
+    snapshot_refresher.request()
+    return zip_response(
+        stream_zip(dataset_service.get_synchronized_file_entries(files)),
+        archive_filename,
+    )
+
+
+def _bulk_download_selection():
+    """Dataset ids or explore criteria, sent as JSON or by the explore page form."""
+    if request.is_json:
+        payload = request.get_json()
+        return payload.get("dataset_ids"), payload.get("criteria")
+
+    criteria = request.form.get("criteria")
+    return request.form.getlist("dataset_ids"), json.loads(criteria) if criteria else None
+
+
+@dataset_bp.route("/dataset/download/bulk", methods=["POST"])
+def download_bulk():
+    max_datasets = current_app.config["BULK_DOWNLOAD_MAX_DATASETS"]
+
+    try:
+        dataset_ids, criteria = _bulk_download_selection()
+        if criteria:
+            dataset_ids = ExploreService().filter_ids(criteria, limit=max_datasets + 1)
+        dataset_ids = list(dict.fromkeys(int(dataset_id) for dataset_id in dataset_ids or []))
+    except (AttributeError, TypeError, ValueError):
+        return jsonify({"error": "Invalid dataset selection"}), 400
+
+    if not dataset_ids:
+        return jsonify({"error": "No datasets selected"}), 400
+    if len(dataset_ids) > max_datasets:
+        return (
+            jsonify({"error": f"At most {max_datasets} datasets can be downloaded at once"}),
+            400,
+        )
+
+    files = dataset_service.get_synchronized_files(dataset_ids)
+    if not files:
+        return jsonify({"error": "None of the selected datasets can be downloaded"}), 404
+
+    user_id = current_user.id if current_user.is_authenticated else None
+    slot = bulk_download_slots.acquire(str(user_id or request.remote_addr))
+    if slot is None:
+        response = jsonify({"error": "Too many downloads in progress, try again later"})
+        response.headers["Retry-After"] = "30"
+        return response, 429
+
+    try:
+        resp = zip_response(
+            stream_zip(dataset_service.get_bulk_file_entries(files)),
+            f"chocohub2_selection_from_{datetime.now().strftime('%d_%m_%Y')}.zip",
+        )
+        resp.call_on_close(slot.release)
+
+        user_cookie = request.cookies.get("download_cookie")
+        if not user_cookie:
+            user_cookie = str(uuid.uuid4())
+            resp.set_cookie("download_cookie", user_cookie)
+
+        DSDownloadRecordService().record_downloads(
+            list(dict.fromkeys(file[0] for file in files)), user_id, user_cookie
+        )
+    except Exception:
+        slot.release()
+        raise
+
+    return resp
+
+
+@dataset_bp.route("/dataset/tracking/stats", methods=["GET"])
+@login_required
+def tracking_stats():
+    return jsonify({"pending": tracking_buffer.pending(), "filter": tracking_filter.stats()})
 
 
 @dataset_bp.route("/dataset/update_community", methods=["POST"])
@@ -2,13 +2,13 @@ import os
 import shutil
 from app.modules.auth.models import User
 from app.modules.featuremodel.models import FMMetaData, FeatureModel
+from app.modules.flamapy.services import FlamapyService
 from app.modules.hubfile.models import Hubfile
 from core.seeders.BaseSeeder import BaseSeeder
 from app.modules.dataset.models import (
     DataSet,
     DSMetaData,
     PublicationType,
-    DSMetrics,
     Author,
 )
 from datetime import datetime, timezone
@@ -27,10 +27,6 @@ class DataSetSeeder(BaseSeeder):
         if not user1 or not user2:
             raise Exception("Users not found. Please seed users first.")
 
-        # Create DSMetrics instance
-        ds_metrics = DSMetrics(number_of_models="5", number_of_features="50")
-        seeded_ds_metrics = self.seed([ds_metrics])[0]
-
         # Create DSMetaData instances
         ds_meta_data_list = [
             DSMetaData(
@@ -41,7 +37,7 @@ class DataSetSeeder(BaseSeeder):
                 publication_doi=f"10.1234/dataset{i+1}",
                 dataset_doi=f"10.1234/dataset{i+1}",
                 tags="tag1, tag2",
-                ds_metrics_id=seeded_ds_metrics.id,
+                author_count=1,
             )
             for i in range(4)
         ]
@@ -135,3 +131,7 @@ class DataSetSeeder(BaseSeeder):
                 feature_model_id=feature_model.id,
             )
             self.seed([uvl_file])
+
+        # Metrics of the copied UVL files, as an upload would compute them
+        for dataset in seeded_datasets:
+            FlamapyService().compute_dataset_metrics(dataset)
@@ -2,13 +2,19 @@ import logging
 import os
 import hashlib
 import shutil
-from typing import Optional
+from typing import Iterator, Optional
 import uuid
-import tempfile
 
-from flask import request
+from flask import current_app, request
 
 from app.modules.auth.services import AuthenticationService
+from app.modules.dataset.archives import (
+    ArchiveCache,
+    datasets_snapshot,
+    directory_entries,
+    listing_digest,
+    stream_zip,
+)
 from app.modules.dataset.models import DSViewRecord, DataSet, DSMetaData
 from app.modules.dataset.repositories import (
     AuthorRepository,
@@ -27,10 +33,9 @@ from app.modules.hubfile.repositories import (
     HubfileRepository,
     HubfileViewRecordRepository,
 )
+from app.modules.dataset.tracking import tracking_buffer
 from core.services.BaseService import BaseService
-from zipfile import ZipFile
 from datetime import datetime
-from pathlib import Path
 
 logger = logging.getLogger(__name__)
 
@@ -85,6 +90,12 @@ class DataSetService(BaseService):
     def latest_synchronized(self):
         return self.repository.latest_synchronized()
 
+    def latest_synchronized_ids(self) -> list[int]:
+        return self.repository.latest_synchronized_ids()
+
+    def get_by_ids(self, dataset_ids: list[int]) -> list[DataSet]:
+        return self.repository.get_by_ids(dataset_ids)
+
     def count_synchronized_datasets(self):
         return self.repository.count_synchronized_datasets()
 
@@ -125,6 +136,7 @@ class DataSetService(BaseService):
                         commit=False, ds_meta_data_id=dsmetadata.id, **author_data
                     )
                     dsmetadata.authors.append(author)
+            dsmetadata.author_count = len(dsmetadata.authors)
 
             dataset = self.create(
                 commit=False, user_id=current_user.id, ds_meta_data_id=dsmetadata.id, is_anonymous=is_anonymous
@@ -172,38 +184,75 @@ class DataSetService(BaseService):
         return self.dsmetadata_repository.update(id, **kwargs)
 
     def get_uvlhub_doi(self, dataset: DataSet) -> str:
-        domain = os.getenv("DOMAIN", "localhost")
-        return f"http://{domain}/doi/{dataset.ds_meta_data.dataset_doi}"
-
-    def get_synchronized_datasets(self) -> list[tuple[str, str]]:
-        datasets = []
-        for user_dir in Path("uploads").glob("user_*"):
-            for dataset_dir in user_dir.glob("dataset_*"):
-                dataset_id = int(dataset_dir.name.split("_")[1])
-                if self.is_synchronized(dataset_id):
-                    dataset_name = self.get_dataset_name(dataset_id)
-                    datasets.append((dataset_name, str(dataset_dir)))
-        return datasets
-
-    def generate_datasets_and_name_zip(self) -> tuple[str, str]:
-        temp_dir = Path(tempfile.mkdtemp())
-        zip_filename = (
-            f"chocohub2_datasets_from_{datetime.now().strftime('%d_%m_%Y')}.zip"
+        return dataset.get_uvlhub_doi()
+
+    def to_dicts(self, datasets: list[DataSet]) -> list[dict]:
+        self.repository.load_for_serialization(datasets)
+        return [dataset.to_dict() for dataset in datasets]
+
+    def get_archive_name(self, dataset: DataSet) -> str:
+        return f"{dataset.ds_meta_data.title}_uvl"
+
+    def get_archive_key(self, dataset: DataSet) -> str:
+        return ArchiveCache.make_key(
+            dataset.id,
+            self.get_archive_name(dataset),
+            self.repository.get_file_checksums(dataset.id),
         )
-        zip_path = temp_dir / zip_filename
-
-        with ZipFile(zip_path, "w") as zipf:
-            for dataset_info in self.get_synchronized_datasets():
-                dataset_name, dataset_path = dataset_info
-                for file_path in Path(dataset_path).rglob("*"):
-                    if file_path.is_file():
-                        relative_path = file_path.relative_to(dataset_path)
-                        zipf.write(
-                            file_path, arcname=Path(dataset_name) / relative_path
-                        )
 
-        return str(zip_path), zip_filename
-    
+    def stream_archive(self, dataset: DataSet):
+        directory = f"uploads/user_{dataset.user_id}/dataset_{dataset.id}/"
+        return stream_zip(directory_entries(directory, self.get_archive_name(dataset)))
+
+    def get_synchronized_files(self, dataset_ids=None) -> list[tuple[int, int, str, str, str]]:
+        return self.repository.get_synchronized_files(dataset_ids)
+
+    @staticmethod
+    def get_synchronized_file_entries(files) -> Iterator[tuple[str, str]]:
+        for dataset_id, user_id, title, name, _ in files:
+            path = os.path.join("uploads", f"user_{user_id}", f"dataset_{dataset_id}", name)
+            if os.path.isfile(path):
+                yield path, os.path.join(title, name)
+
+    @staticmethod
+    def get_bulk_file_entries(files) -> Iterator[tuple[str, str]]:
+        """Entries of a multi-dataset archive, one <title>_uvl folder per dataset as in single downloads."""
+        folders = {}
+        for dataset_id, user_id, title, name, _ in files:
+            if dataset_id not in folders:
+                folder = f"{title}_uvl"
+                if folder in folders.values():
+                    folder = f"{title}_{dataset_id}_uvl"
+                folders[dataset_id] = folder
+
+            path = os.path.join("uploads", f"user_{user_id}", f"dataset_{dataset_id}", name)
+            if os.path.isfile(path):
+                yield path, os.path.join(folders[dataset_id], name)
+
+    def get_all_datasets_archive_name(self) -> str:
+        return f"chocohub2_datasets_from_{datetime.now().strftime('%d_%m_%Y')}.zip"
+
+    def get_all_datasets_snapshot(self, files) -> Optional[tuple[str, str]]:
+        """Path and digest of the download-all snapshot, if it matches the files."""
+        if not current_app.config["DATASETS_SNAPSHOT"]:
+            return None
+        digest = listing_digest(files)
+        path = datasets_snapshot.lookup(digest)
+        return (path, digest) if path else None
+
+    def refresh_all_datasets_snapshot(self) -> bool:
+        """Brings the download-all snapshot up to date, appending new datasets to it."""
+        if not current_app.config["DATASETS_SNAPSHOT"]:
+            return False
+        try:
+            datasets_snapshot.refresh(
+                self.get_synchronized_files(), self.get_synchronized_file_entries
+            )
+        except Exception as exc:
+            logger.exception(f"Exception refreshing the datasets snapshot: {exc}")
+            return False
+        return True
+
     def toggle_anonymity(self, dataset_id: int, current_user) -> DataSet:
         dataset = self.repository.get_or_404(dataset_id)
         if dataset.user_id != current_user.id:
@@ -219,8 +268,9 @@ class DataSetService(BaseService):
                 "orcid": current_user.profile.orcid,
             }
             # Eliminar autores anónimos existentes
-            for author in dataset.ds_meta_data.authors:
-                self.author_repository.delete(author)
+            for author in list(dataset.ds_meta_data.authors):
+                self.author_repository.session.delete(author)
+                dataset.ds_meta_data.authors.remove(author)
             # Agregar el autor principal
             author = self.author_repository.create(
                 commit=False, ds_meta_data_id=dataset.ds_meta_data.id, **main_author
@@ -229,8 +279,10 @@ class DataSetService(BaseService):
         else:
             # Anonimizar el user_id y eliminar los autores si se hace anónimo
             dataset.user_id = None
-            for author in dataset.ds_meta_data.authors:
-                self.author_repository.delete(author)
+            for author in list(dataset.ds_meta_data.authors):
+                self.author_repository.session.delete(author)
+                dataset.ds_meta_data.authors.remove(author)
+        dataset.ds_meta_data.author_count = len(dataset.ds_meta_data.authors)
 
         self.repository.session.commit()
         return dataset
@@ -245,6 +297,13 @@ class DSDownloadRecordService(BaseService):
     def __init__(self):
         super().__init__(DSDownloadRecordRepository())
 
+    def record_download(self, dataset_id, user_id, download_cookie):
+        tracking_buffer.track("dataset_download", dataset_id, user_id, download_cookie)
+
+    def record_downloads(self, dataset_ids, user_id, download_cookie):
+        for dataset_id in dataset_ids:
+            self.record_download(dataset_id, user_id, download_cookie)
+
 
 class DSMetaDataService(BaseService):
     def __init__(self):
@@ -273,12 +332,9 @@ class DSViewRecordService(BaseService):
         if not user_cookie:
             user_cookie = str(uuid.uuid4())
 
-        existing_record = self.the_record_exists(
-            dataset=dataset, user_cookie=user_cookie
-        )
-
-        if not existing_record:
-            self.create_new_record(dataset=dataset, user_cookie=user_cookie)
+        # Written in the background, duplicates of a cookie are dropped there
+        user = AuthenticationService().get_authenticated_user()
+        tracking_buffer.track("dataset_view", dataset.id, user.id if user else None, user_cookie)
 
         return user_cookie
 
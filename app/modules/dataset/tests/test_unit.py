@@ -1,17 +1,45 @@
+import io
+import os
 from unittest.mock import MagicMock, patch
 from app.modules.auth.models import User
 from app.modules.profile.models import UserProfile
 import pytest
 from app import create_app
+from app.modules.dataset.archives import (
+    ArchiveCache,
+    ArchiveSnapshot,
+    SnapshotRefresher,
+    archive_cache,
+    listing_digest,
+    stream_zip,
+)
 from app.modules.dataset.forms import AuthorForm, DataSetForm, FeatureModelForm
-from app.modules.dataset.models import DSMetaData, DataSet, DatasetReview, PublicationType
+from app.modules.dataset.download_slots import bulk_download_slots
+from app.modules.dataset.models import (
+    DSDownloadRecord,
+    DSMetaData,
+    DSMetrics,
+    DSViewRecord,
+    DataSet,
+    DatasetReview,
+    PublicationType,
+)
 
 from app.modules.dataset.services import DataSetService
-from pathlib import Path
+from app.modules.dataset.bloom import BloomFilter
+from app.modules.dataset.tracking import (
+    TrackingBuffer,
+    filter_key,
+    rebuild_tracking_filter,
+    tracking_filter,
+    write_records,
+)
 import zipfile
-from datetime import datetime
+from datetime import datetime, timezone
 from app import db
+from sqlalchemy import event
 from app.modules.featuremodel.models import FMMetaData, FeatureModel
+from app.modules.hubfile.models import Hubfile
 from app.modules.profile.models import UserProfile
 from app.modules.auth.models import User
 
@@ -164,42 +192,76 @@ def test_total_dataset_downloads(dataset_service):
     assert isinstance(total_downloads, int)
 
 
-def test_get_synchronized_datasets(dataset_service):
-    datasets = dataset_service.get_synchronized_datasets()
-    assert datasets is not None
+def test_get_synchronized_files(dataset_service):
+    files = dataset_service.get_synchronized_files()
+    assert files is not None
 
 
-def test_generate_datasets_and_name_zip(dataset_service, test_client):
-    temp_dataset_path = Path("/tmp/Test_Dataset")
-    temp_dataset_path.mkdir(parents=True, exist_ok=True)
+def test_stream_all_datasets_archive(dataset_service, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    dataset_dir = tmp_path / "uploads" / "user_1" / "dataset_1"
+    dataset_dir.mkdir(parents=True)
+    (dataset_dir / "file7.uvl").write_text("Contenido del archivo UVL de prueba")
 
-    temp_file = temp_dataset_path / "file7.uvl"
-    temp_file.write_text("Contenido del archivo UVL de prueba")
+    files = [
+        (1, 1, "Test Dataset", "file7.uvl", "checksum7"),
+        (1, 1, "Test Dataset", "missing.uvl", "checksum8"),
+    ]
+    archive = b"".join(stream_zip(dataset_service.get_synchronized_file_entries(files)))
 
-    dataset_service.get_synchronized_datasets = MagicMock(
-        return_value=[("Test Dataset", str(temp_dataset_path))]
-    )
-
-    zip_path, zip_filename = dataset_service.generate_datasets_and_name_zip()
-
-    with zipfile.ZipFile(zip_path, "r") as zipf:
+    with zipfile.ZipFile(io.BytesIO(archive), "r") as zipf:
         zip_content = zipf.namelist()
 
     today_date = datetime.now().strftime("%d_%m_%Y")
     expected_filename = f"chocohub2_datasets_from_{today_date}.zip"
-    assert zip_filename == expected_filename, (
-        f"El nombre del archivo es incorrecto. "
-        f"Esperado: {expected_filename}, Encontrado: {zip_filename}"
-    )
+    assert dataset_service.get_all_datasets_archive_name() == expected_filename
+    assert zip_content == ["Test Dataset/file7.uvl"]
+
+
+def test_datasets_snapshot_appends_published_datasets(tmp_path):
+    for name in ("a.uvl", "b.uvl"):
+        (tmp_path / name).write_text(name)
+
+    def entries(rows):
+        return [(str(tmp_path / row[3]), f"{row[2]}/{row[3]}") for row in rows]
+
+    snapshot = ArchiveSnapshot("all", directory=str(tmp_path / "snapshots"))
+    first = [(1, 1, "One", "a.uvl", "ca")]
+    snapshot.refresh(first, entries)
+    assert snapshot.lookup(listing_digest(first)) == snapshot.path
+
+    second = first + [(2, 1, "Two", "b.uvl", "cb")]
+    assert snapshot.lookup(listing_digest(second)) is None
+    snapshot.refresh(second, lambda rows: entries(rows) if len(rows) == 1 else pytest.fail())
+    with zipfile.ZipFile(snapshot.path) as zipf:
+        assert zipf.namelist() == ["One/a.uvl", "Two/b.uvl"]
+
+    edited = [(1, 1, "One", "a.uvl", "ca2"), (2, 1, "Two", "b.uvl", "cb")]
+    snapshot.refresh(edited, entries)
+    assert snapshot.lookup(listing_digest(edited)) == snapshot.path
+
+
+def test_datasets_snapshot_is_refreshed_outside_the_request(test_client, monkeypatch):
+    import threading
+
+    refreshed = threading.Event()
+    threads = []
 
-    assert Path(zip_path).exists()
-    assert zip_filename.endswith(".zip")
-    assert len(zip_content) == 1
-    assert zip_content[0] == "Test Dataset/file7.uvl"
+    def refresh(self):
+        threads.append(threading.current_thread().name)
+        refreshed.set()
+        return True
 
-    Path(zip_path).unlink()
-    temp_file.unlink()
-    temp_dataset_path.rmdir()
+    monkeypatch.setattr(DataSetService, "refresh_all_datasets_snapshot", refresh)
+    refresher = SnapshotRefresher()
+    with test_client.application.app_context():
+        refresher.request()
+        assert not refreshed.is_set()
+
+        monkeypatch.setitem(test_client.application.config, "DATASETS_SNAPSHOT", True)
+        refresher.request()
+        assert refreshed.wait(5)
+    assert threads == ["datasets-snapshot"]
 
 
 def test_like_dataset_success(test_client):
@@ -275,3 +337,338 @@ def test_like_dataset_invalid_input(test_client):
         data = response.get_json()
         assert "error" in data
         assert data["error"] == "Invalid data"
+
+
+def test_to_dicts_loads_relationships_in_constant_queries(test_client, dataset_service, bulk_datasets):
+    # The bulk datasets have a metadata row each, unlike datasets 1 and 2
+    for dataset_id in bulk_datasets:
+        db.session.get(DataSet, dataset_id).ds_meta_data.ds_metrics = DSMetrics(
+            number_of_models=1, number_of_features=dataset_id
+        )
+    for dataset_id in (1, 2):
+        feature_model = FeatureModel(data_set_id=dataset_id)
+        db.session.add(feature_model)
+        db.session.flush()
+        for i in range(2):
+            db.session.add(
+                Hubfile(
+                    name=f"model{i}.uvl",
+                    checksum=f"checksum{i}",
+                    size=100 * (i + 1),
+                    feature_model_id=feature_model.id,
+                )
+            )
+    db.session.commit()
+
+    db.session.expire_all()
+    datasets = DataSet.query.all()
+    with test_client.application.test_request_context():
+        expected = [dataset.to_dict() for dataset in datasets]
+
+    db.session.expire_all()
+    datasets = DataSet.query.all()
+    statements = []
+
+    def record_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", record_statement)
+    try:
+        with test_client.application.test_request_context():
+            serialized = dataset_service.to_dicts(datasets)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record_statement)
+
+    assert serialized == expected
+    assert sum(d["files_count"] for d in serialized) >= 4
+    assert sum(d["metrics"] is not None for d in serialized) >= len(bulk_datasets)
+    # datasets, metadata, authors, metrics, feature models and files
+    assert len(statements) <= 6
+
+
+def test_toggle_anonymity_keeps_author_count(test_client, dataset_service):
+    owner = MagicMock(id=1)
+    owner.profile.configure_mock(name="Name", surname="Surname", affiliation="", orcid="")
+
+    dataset = dataset_service.toggle_anonymity(2, owner)
+    assert dataset.is_anonymous is False
+    assert dataset.ds_meta_data.author_count == len(dataset.ds_meta_data.authors) == 1
+
+
+def test_stream_zip_yields_a_valid_archive_in_chunks(tmp_path):
+    source = tmp_path / "model.uvl"
+    source.write_text("features\n    Root\n")
+
+    chunks = list(stream_zip([(str(source), "dataset_uvl/model.uvl")], chunk_size=4))
+    assert len(chunks) > 2
+
+    with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as zipf:
+        assert zipf.testzip() is None
+        assert zipf.read("dataset_uvl/model.uvl") == source.read_bytes()
+
+
+def test_download_dataset_streams_the_archive(test_client, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    dataset_dir = tmp_path / "uploads" / "user_1" / "dataset_1"
+    dataset_dir.mkdir(parents=True)
+    (dataset_dir / "model.uvl").write_text("features\n    Root\n")
+
+    response = test_client.get("/dataset/download/1")
+
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.headers["Content-Disposition"] == 'attachment; filename="Test Dataset 7_uvl.zip"'
+    with zipfile.ZipFile(io.BytesIO(response.data)) as zipf:
+        assert zipf.namelist() == ["Test Dataset 7_uvl/model.uvl"]
+
+
+def test_download_dataset_is_served_from_the_archive_cache(test_client, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    dataset_dir = tmp_path / "uploads" / "user_1" / "dataset_1"
+    dataset_dir.mkdir(parents=True)
+    (dataset_dir / "model.uvl").write_text("features\n    Root\n")
+
+    archive_key = DataSetService().get_archive_key(db.session.get(DataSet, 1))
+    assert archive_cache.lookup(archive_key) is None
+
+    first = test_client.get("/dataset/download/1")
+    streamed_archive = first.data
+    assert archive_cache.lookup(archive_key) is not None
+
+    second = test_client.get("/dataset/download/1")
+    assert second.data == streamed_archive
+    assert first.headers["ETag"] == second.headers["ETag"] == f'"{archive_key}"'
+
+    response = test_client.get("/dataset/download/1", headers={"If-None-Match": first.headers["ETag"]})
+    assert response.status_code == 304
+
+    response = test_client.get("/dataset/download/1", headers={"Range": "bytes=0-3"})
+    assert response.status_code == 206
+    assert response.data == streamed_archive[:4]
+    assert second.headers["Content-Disposition"] == first.headers["Content-Disposition"]
+
+
+def test_archive_cache_evicts_least_recently_used(tmp_path):
+    cache = ArchiveCache(directory=str(tmp_path), max_bytes=10)
+    for key in ("dataset_1_a", "dataset_2_b"):
+        assert b"".join(cache.store(key, [b"123456"])) == b"123456"
+        os.utime(cache.path(key), (1, 1) if key == "dataset_1_a" else None)
+
+    assert cache.lookup("dataset_1_a") is None
+    assert cache.lookup("dataset_2_b") == cache.path("dataset_2_b")
+
+    cache.invalidate(2)
+    assert cache.lookup("dataset_2_b") is None
+
+
+def test_download_dataset_hands_cached_archives_over_to_nginx(test_client, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setitem(test_client.application.config, "X_ACCEL_REDIRECT", True)
+    dataset_dir = tmp_path / "uploads" / "user_1" / "dataset_1"
+    dataset_dir.mkdir(parents=True)
+    (dataset_dir / "model.uvl").write_text("features\n    Root\n")
+    archive_key = DataSetService().get_archive_key(db.session.get(DataSet, 1))
+
+    # Nothing to hand over until the archive has been built once
+    first = test_client.get("/dataset/download/1")
+    assert "X-Accel-Redirect" not in first.headers
+    assert first.data
+
+    response = test_client.get("/dataset/download/1")
+    assert response.headers["X-Accel-Redirect"] == f"/internal/cache/archives/{archive_key}.zip"
+    assert response.headers["Content-Disposition"] == first.headers["Content-Disposition"]
+    assert response.mimetype == "application/zip"
+    assert response.data == b""
+
+
+def test_tracking_buffer_writes_deduplicated_batches(test_client, monkeypatch):
+    monkeypatch.setitem(test_client.application.config, "TRACKING_WRITE_BEHIND", True)
+    monkeypatch.setitem(test_client.application.config, "TRACKING_FLUSH_INTERVAL", 3600)
+    buffer = TrackingBuffer()
+    views = db.session.get(DataSet, 1).view_count
+    records = DSViewRecord.query.count()
+
+    with test_client.application.test_request_context():
+        for _ in range(3):
+            buffer.track("dataset_view", 1, None, "buffered-view-cookie")
+        buffer.track("dataset_view", 2, None, "buffered-view-cookie")
+
+    assert buffer.pending() == 2
+    assert DSViewRecord.query.count() == records
+
+    assert buffer.flush() == 2
+    assert buffer.pending() == 0
+    assert DSViewRecord.query.count() == records + 2
+
+    # Already in the database, the next batch skips it
+    with test_client.application.test_request_context():
+        buffer.track("dataset_view", 1, None, "buffered-view-cookie")
+    buffer.close()
+    assert buffer.pending() == 0
+    assert DSViewRecord.query.count() == records + 2
+
+    db.session.expire_all()
+    assert db.session.get(DataSet, 1).view_count == views + 1
+
+
+def test_bloom_filter_has_no_false_negatives(tmp_path):
+    bloom = BloomFilter("test", directory=str(tmp_path))
+    assert not bloom.ready
+    assert bloom.might_contain(b"anything")
+
+    assert bloom.build((f"key-{i}".encode() for i in range(1000)), capacity=1000, error_rate=0.01) == 1000
+    assert bloom.add([b"late-key"]) == 1
+    assert all(bloom.might_contain(f"key-{i}".encode()) for i in range(1000))
+    assert bloom.might_contain(b"late-key")
+
+    false_positives = sum(bloom.might_contain(f"other-{i}".encode()) for i in range(1000))
+    assert false_positives < 50
+    stats = bloom.stats()
+    assert stats["ready"] and stats["checks"] == 2001
+    assert stats["definite_misses"] == 1000 - false_positives
+    bloom.close()
+
+
+def test_tracking_filter_skips_the_lookup_of_new_events(test_client, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    assert not tracking_filter.ready
+    rebuild_tracking_filter()
+    assert tracking_filter.might_contain(filter_key("dataset_view", (None, 1, "buffered-view-cookie")))
+
+    misses = tracking_filter.definite_misses
+    event = {"dataset_view": {(None, 1, "filtered-view-cookie"): datetime.now(timezone.utc)}}
+    assert write_records(event) == 1
+    assert tracking_filter.definite_misses == misses + 1
+
+    # Added by the write, the second one is looked up and skipped
+    assert write_records(event) == 0
+    assert tracking_filter.definite_misses == misses + 1
+    assert tracking_filter.false_positives == 0
+    tracking_filter.close()
+
+
+def test_events_missed_by_the_filter_are_recorded_once(test_client, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    event = {"dataset_download": {(None, 1, "other-host-cookie"): datetime.now(timezone.utc)}}
+    assert write_records(event) == 1
+    downloads = db.session.get(DataSet, 1).download_count
+    records = DSDownloadRecord.query.count()
+
+    # The filter of another host never saw it, the unique key keeps it out
+    tracking_filter.build([], capacity=100, error_rate=0.01)
+    assert not tracking_filter.might_contain(filter_key("dataset_download", (None, 1, "other-host-cookie")))
+    other = {(None, 1, "another-host-cookie"): datetime.now(timezone.utc)}
+    assert write_records({"dataset_download": {**event["dataset_download"], **other}}) == 1
+    assert DSDownloadRecord.query.count() == records + 1
+
+    db.session.expire_all()
+    assert db.session.get(DataSet, 1).download_count == downloads + 1
+    tracking_filter.close()
+
+
+def test_bloom_filter_build_replays_the_keys_added_meanwhile(tmp_path):
+    bloom = BloomFilter("test", directory=str(tmp_path))
+    worker = BloomFilter("test", directory=str(tmp_path))
+    bloom.build([b"old-key"], capacity=100, error_rate=0.01)
+
+    def keys():
+        yield b"built-key"
+        # Set on the file being replaced, only the journal keeps it
+        assert worker.add([b"added-key"]) == 1
+
+    assert bloom.build(keys(), capacity=100, error_rate=0.01) == 2
+    assert not os.path.exists(bloom.journal_path)
+    assert worker.might_contain(b"built-key")
+    assert worker.might_contain(b"added-key")
+    bloom.close()
+    worker.close()
+
+
+# TEST OF THE BULK DOWNLOAD
+
+
+@pytest.fixture(scope="module")
+def bulk_datasets(test_client):
+    """Three published datasets with a feature model and three files each, findable by "bulk"."""
+    with test_client.application.app_context():
+        for dataset_id in range(601, 604):
+            db.session.add(
+                DSMetaData(
+                    id=dataset_id,
+                    title=f"Bulk dataset {dataset_id}",
+                    description="Dataset downloaded with others",
+                    publication_type=PublicationType.JOURNAL_ARTICLE,
+                    dataset_doi=f"10.1234/bulk{dataset_id}",
+                )
+            )
+            db.session.add(DataSet(id=dataset_id, user_id=1, ds_meta_data_id=dataset_id))
+            db.session.add(
+                FMMetaData(
+                    id=dataset_id,
+                    uvl_filename="model0.uvl",
+                    title="Bulk model",
+                    description="Feature model",
+                    publication_type=PublicationType.JOURNAL_ARTICLE,
+                )
+            )
+            db.session.add(FeatureModel(id=dataset_id, data_set_id=dataset_id, fm_meta_data_id=dataset_id))
+            for i in range(3):
+                db.session.add(
+                    Hubfile(name=f"model{i}.uvl", checksum=f"bulk{dataset_id}_{i}", size=1, feature_model_id=dataset_id)
+                )
+        db.session.commit()
+    return range(601, 604)
+
+
+@pytest.fixture
+def bulk_uploads(bulk_datasets, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for dataset_id in bulk_datasets:
+        dataset_dir = tmp_path / "uploads" / "user_1" / f"dataset_{dataset_id}"
+        dataset_dir.mkdir(parents=True)
+        for i in range(3):
+            (dataset_dir / f"model{i}.uvl").write_text("features\n    Root\n")
+    return bulk_datasets
+
+
+def test_bulk_download_by_criteria_streams_one_archive(test_client, bulk_uploads):
+    response = test_client.post("/dataset/download/bulk", json={"criteria": {"title": "bulk"}})
+
+    assert response.status_code == 200
+    with zipfile.ZipFile(io.BytesIO(response.data)) as zipf:
+        names = zipf.namelist()
+    # Releases the download slot, as the WSGI server does once the body is sent
+    response.close()
+    assert len(names) == 9
+    assert {name.split("/")[0] for name in names} == {f"Bulk dataset {i}_uvl" for i in bulk_uploads}
+
+
+def test_bulk_download_by_form_ids(test_client, bulk_uploads):
+    downloads = DSDownloadRecord.query.filter_by(dataset_id=601).count()
+    test_client.delete_cookie("download_cookie")
+    response = test_client.post("/dataset/download/bulk", data={"dataset_ids": [601, 601]})
+
+    assert response.status_code == 200
+    assert DSDownloadRecord.query.filter_by(dataset_id=601).count() == downloads + 1
+    with zipfile.ZipFile(io.BytesIO(response.data)) as zipf:
+        assert all(name.startswith("Bulk dataset 601_uvl/") for name in zipf.namelist())
+    response.close()
+
+
+def test_bulk_download_is_capped(test_client, bulk_uploads, monkeypatch):
+    monkeypatch.setitem(test_client.application.config, "BULK_DOWNLOAD_MAX_DATASETS", 2)
+    response = test_client.post("/dataset/download/bulk", json={"criteria": {"title": "bulk"}})
+    assert response.status_code == 400
+
+    response = test_client.post("/dataset/download/bulk", json={"dataset_ids": []})
+    assert response.status_code == 400
+
+
+def test_bulk_download_limits_concurrent_downloads(test_client, bulk_uploads):
+    slot = bulk_download_slots.acquire("127.0.0.1")
+    try:
+        response = test_client.post("/dataset/download/bulk", json={"criteria": {"title": "bulk"}})
+    finally:
+        slot.release()
+    assert response.status_code == 429
+    assert response.headers["Retry-After"]
@@ -0,0 +1,283 @@
+import atexit
+import fcntl
+import hashlib
+import logging
+import os
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Iterator, NamedTuple, Optional
+
+from flask import current_app
+from sqlalchemy import func, insert
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.modules.dataset.bloom import BloomFilter
+from app.modules.dataset.models import DSDownloadRecord, DSViewRecord
+from app.modules.dataset.repositories import DataSetRepository
+from app.modules.hubfile.models import HubfileDownloadRecord, HubfileViewRecord
+
+logger = logging.getLogger(__name__)
+
+REBUILD_BATCH_SIZE = 10000
+
+
+class TrackedRecord(NamedTuple):
+    model: type
+    target: str
+    cookie: str
+    date: str
+    # DataSet counter kept in step with the records, if any
+    counter: Optional[str] = None
+
+
+TRACKED_RECORDS = {
+    "dataset_view": TrackedRecord(DSViewRecord, "dataset_id", "view_cookie", "view_date", "view_count"),
+    "dataset_download": TrackedRecord(
+        DSDownloadRecord, "dataset_id", "download_cookie", "download_date", "download_count"
+    ),
+    "file_view": TrackedRecord(HubfileViewRecord, "file_id", "view_cookie", "view_date"),
+    "file_download": TrackedRecord(HubfileDownloadRecord, "file_id", "download_cookie", "download_date"),
+}
+
+
+# Every recorded (kind, target, user, cookie), shared by the workers of the host. Each
+# host keeps its own, the unique record_key of the tables is what rules out duplicates
+tracking_filter = BloomFilter("tracking")
+
+
+def filter_key(kind: str, key: tuple) -> bytes:
+    user_id, target_id, cookie = key
+    return f"{kind}\0{target_id}\0{user_id}\0{cookie}".encode()
+
+
+def record_key(kind: str, key: tuple) -> str:
+    return hashlib.sha256(filter_key(kind, key)).hexdigest()
+
+
+def _record_keys(condition_of) -> Iterator[bytes]:
+    for kind, tracked in TRACKED_RECORDS.items():
+        model = tracked.model
+        query = (
+            db.session.query(model.user_id, getattr(model, tracked.target), getattr(model, tracked.cookie))
+            .filter(condition_of(kind, model))
+            .yield_per(REBUILD_BATCH_SIZE)
+        )
+        for key in query:
+            yield filter_key(kind, tuple(key))
+
+
+def rebuild_tracking_filter() -> int:
+    """
+    Builds the tracking filter again from the record tables, sized for twice
+    the records there are now, then adds the records inserted meanwhile. The
+    keys the workers add while it runs are replayed by the build itself.
+    Returns the number of records in the filter.
+    """
+    last_ids = {
+        kind: db.session.query(func.max(tracked.model.id)).scalar() or 0
+        for kind, tracked in TRACKED_RECORDS.items()
+    }
+    records = sum(
+        db.session.query(func.count(tracked.model.id)).scalar() for tracked in TRACKED_RECORDS.values()
+    )
+    count = tracking_filter.build(
+        _record_keys(lambda kind, model: model.id <= last_ids[kind]),
+        max(current_app.config["TRACKING_FILTER_CAPACITY"], 2 * records),
+        current_app.config["TRACKING_FILTER_ERROR_RATE"],
+    )
+    count += tracking_filter.add(_record_keys(lambda kind, model: model.id > last_ids[kind]))
+    tracking_filter.flush()
+    return count
+
+
+def ensure_tracking_filter():
+    """Builds the tracking filter unless it exists, a single worker builds it."""
+    if tracking_filter.ready:
+        return
+    os.makedirs(tracking_filter.directory, exist_ok=True)
+    with open(f"{tracking_filter.path}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if not tracking_filter.ready:
+            rebuild_tracking_filter()
+
+
+def _insert_records(model, rows: list) -> list:
+    """
+    Inserts the rows in a single statement, or one by one if another host
+    recorded some of them meanwhile. Returns the rows inserted.
+    """
+    try:
+        with db.session.begin_nested():
+            db.session.execute(insert(model), rows)
+        return rows
+    except IntegrityError:
+        if len(rows) == 1:
+            return []
+    return [row for batch in ([row] for row in rows) for row in _insert_records(model, batch)]
+
+
+def write_records(batch: dict) -> int:
+    """
+    Inserts the tracked events of a batch, {kind: {(user_id, target_id, cookie): date}},
+    skipping those already recorded. The tracking filter rules out the events
+    never recorded on this host, one query per kind looks up the rest, the
+    missing ones go in a single multi-row insert, and the whole batch is
+    committed at once. The filter is only a hint, the unique record_key keeps
+    out the events another host recorded meanwhile.
+    Returns the number of records inserted.
+    """
+    inserted = 0
+    for kind, events in batch.items():
+        if not events:
+            continue
+        tracked = TRACKED_RECORDS[kind]
+        model = tracked.model
+
+        # Only the events the filter may have seen need looking up
+        maybe_recorded = {
+            record_key(kind, key): key for key in events if tracking_filter.might_contain(filter_key(kind, key))
+        }
+        existing = set()
+        if maybe_recorded:
+            existing = {
+                maybe_recorded[key]
+                for (key,) in db.session.query(model.record_key).filter(model.record_key.in_(maybe_recorded))
+            }
+            if tracking_filter.ready:
+                tracking_filter.record_false_positives(len(maybe_recorded) - len(existing))
+        rows = [
+            {
+                "user_id": user_id,
+                tracked.target: target_id,
+                tracked.cookie: user_cookie,
+                tracked.date: date,
+                "record_key": record_key(kind, (user_id, target_id, user_cookie)),
+            }
+            for (user_id, target_id, user_cookie), date in events.items()
+            if (user_id, target_id, user_cookie) not in existing
+        ]
+        if not rows:
+            continue
+
+        # Added before the commit, a failed commit only leaves false positives behind
+        tracking_filter.add(
+            filter_key(kind, (row["user_id"], row[tracked.target], row[tracked.cookie])) for row in rows
+        )
+        rows = _insert_records(model, rows)
+        if tracked.counter:
+            for target_id, amount in Counter(row[tracked.target] for row in rows).items():
+                DataSetRepository().increment_counter(target_id, tracked.counter, amount)
+        inserted += len(rows)
+
+    db.session.commit()
+    return inserted
+
+
+class TrackingBuffer:
+    """
+    Write-behind buffer of the view and download records.
+
+    Requests only enqueue their events, de-duplicated in memory, and a
+    background thread of each worker writes them in batches once
+    TRACKING_BATCH_SIZE events are pending or every TRACKING_FLUSH_INTERVAL
+    seconds. Whatever is pending is written when the worker exits. With
+    TRACKING_WRITE_BEHIND disabled the events are written within the request.
+
+    The thread also builds the tracking filter when it does not exist yet,
+    and writes its pages back to disk after every batch.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._pending = {}
+        self._size = 0
+        self._app = None
+        self._thread = None
+        self._pid = None
+        self._stopping = False
+
+    def track(self, kind: str, target_id: int, user_id: Optional[int], cookie: str):
+        key = (user_id, target_id, cookie)
+        date = datetime.now(timezone.utc)
+        if not current_app.config["TRACKING_WRITE_BEHIND"]:
+            write_records({kind: {key: date}})
+            return
+
+        with self._lock:
+            self._start(current_app._get_current_object())
+            events = self._pending.setdefault(kind, {})
+            if key not in events:
+                events[key] = date
+                self._size += 1
+            if self._size >= self._app.config["TRACKING_BATCH_SIZE"]:
+                self._wakeup.notify()
+
+    def pending(self) -> int:
+        with self._lock:
+            return self._size
+
+    def flush(self) -> int:
+        with self._lock:
+            batch, self._pending, self._size = self._pending, {}, 0
+        if not batch or self._app is None:
+            return 0
+
+        with self._app.app_context():
+            try:
+                inserted = write_records(batch)
+                tracking_filter.flush()
+                return inserted
+            except Exception:
+                db.session.rollback()
+                logger.exception(
+                    "Could not write %d tracking records", sum(len(events) for events in batch.values())
+                )
+                return 0
+
+    def close(self):
+        """Stops the background thread once everything pending is written."""
+        with self._lock:
+            thread = self._thread if self._pid == os.getpid() else None
+            self._stopping = True
+            self._wakeup.notify()
+        if thread is not None:
+            thread.join()
+        else:
+            self.flush()
+
+    def _start(self, app):
+        # Called with the lock held. A forked worker starts its own thread and
+        # drops what the parent had pending, the parent writes it
+        if self._pid != os.getpid():
+            self._pending, self._size = {}, 0
+            self._pid = os.getpid()
+            atexit.register(self.close)
+        elif self._thread is not None and self._thread.is_alive() and not self._stopping:
+            return
+        self._app = app
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="tracking-buffer", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        with self._app.app_context():
+            try:
+                ensure_tracking_filter()
+            except Exception:
+                db.session.rollback()
+                logger.exception("Could not build the tracking filter")
+
+        while True:
+            with self._lock:
+                if not self._stopping and self._size < self._app.config["TRACKING_BATCH_SIZE"]:
+                    self._wakeup.wait(self._app.config["TRACKING_FLUSH_INTERVAL"])
+                stopping = self._stopping
+            self.flush()
+            if stopping:
+                return
+
+
+tracking_buffer = TrackingBuffer()
@@ -1,3 +1,5 @@
 from core.blueprints.base_blueprint import BaseBlueprint
 
 explore_bp = BaseBlueprint("explore", __name__, template_folder="templates")
+
+from app.modules.explore import listeners  # noqa: E402,F401
@@ -2,6 +2,13 @@ document.addEventListener('DOMContentLoaded', () => {
   send_query(); // este es el que ya había, para buscar por cosas al clicar en los que están cargados
 });
 
+const PAGE_SIZE = 20;
+
+// State of the search currently shown: every new search resets it and each page appends to it
+let currentCriteria = null;
+let nextCursor = null;
+let searchSequence = 0;
+
 function send_query() {
 
 
@@ -14,7 +21,7 @@ function send_query() {
     filter.addEventListener('input', () => {
       const csrfToken = document.getElementById('csrf_token').value;
 
-      const searchCriteria = {
+      currentCriteria = {
         csrf_token: csrfToken,
         title: document.querySelector('#title').value,
         tags_str: document.querySelector('#tags_str').value,
@@ -22,144 +29,227 @@ function send_query() {
         sorting: document.querySelector('[name="sorting"]:checked').value,
         author_name: document.querySelector('#author_name').value,
         uvl_validation: document.querySelector('#uvl_validation').checked,
-        num_authors: document.querySelector('#num_authors').value
+        num_authors: document.querySelector('#num_authors').value,
+        min_features: document.querySelector('#min_features').value,
+        max_features: document.querySelector('#max_features').value
       };
+      nextCursor = null;
 
-      fetch('/explore', {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify(searchCriteria),
-      })
-        .then(response => {
-          return response.json()
-        })
-        .then(data => {
-
-          document.getElementById('results').innerHTML = '';
-
-          // results counter
-          const resultCount = data.length;
-          const resultText = resultCount === 1 ? 'dataset' : 'datasets';
-          document.getElementById('results_number').textContent = `${resultCount} ${resultText} found`;
-
-          if (resultCount === 0) {
-            document.getElementById("results_not_found").style.display = "block";
-          } else {
-            document.getElementById("results_not_found").style.display = "none";
-          }
-
-          const existingButtons = document.querySelectorAll('.btn-download-all');
-          existingButtons.forEach(button => button.remove());
-
-          const downloadButton = document.createElement('button');
-          downloadButton.className = 'btn btn-primary btn-sm btn-narrow text-white btn-download-all';
-          downloadButton.textContent = 'Download All Datasets';
-          downloadButton.addEventListener('click', () => {
-            // para descargar los datasets, se hace un fetch a la ruta de descarga de cada dataset, se crea un elemento html <a> con el link de descarga y se hace click en él, y finalmente se elimina el elemento
-            for (let i = 0; i < data.length; i++) {
-              const url = `/dataset/download/${data[i].id}`;
-              fetch(url).then(response => response.blob()).then(blob => {
-                const downloadUrl = URL.createObjectURL(blob);
-                const a = document.createElement('a');
-                a.href = downloadUrl;
-                a.download = data[i].title + '.zip';
-                document.body.appendChild(a);
-                a.click();
-                document.body.removeChild(a);
-                URL.revokeObjectURL(downloadUrl);
-              });
-            }
-          })
-          document.getElementById('results').insertAdjacentElement('beforebegin', downloadButton);
-
-
-          data.forEach(dataset => {
-            let card = document.createElement('div');
-            card.className = 'col-12';
-            card.innerHTML = `
-                            <div class="card">
-                                <div class="card-body">
-                                    <div class="d-flex align-items-center justify-content-between">
-                                        <h3><a href="${dataset.url}">${dataset.title}</a></h3>
-                                        <div>
-                                            <span class="badge bg-primary" style="cursor: pointer;" onclick="set_publication_type_as_query('${dataset.publication_type}')">${dataset.publication_type}</span>
-                                        </div>
-                                    </div>
-                                    <p class="text-secondary">${formatDate(dataset.created_at)}</p>
-
-                                    <div class="row mb-2">
-
-                                        <div class="col-md-4 col-12">
-                                            <span class=" text-secondary">
-                                                Description
-                                            </span>
-                                        </div>
-                                        <div class="col-md-8 col-12">
-                                            <p class="card-text">${dataset.description}</p>
-                                        </div>
-
-                                    </div>
-
-                                    <div class="row mb-2">
-
-                                      <div class="col-md-4 col-12">
-                                          <span class="text-secondary">
-                                              Authors
-                                          </span>
-                                      </div>
-                                      <div class="col-md-8 col-12">
-                                        ${dataset.is_anonymous ? `
-                                            <p class="p-0 m-0">Anónimo</p>
-                                        ` : dataset.authors && dataset.authors.length > 0 ? dataset.authors.map(author => `
-                                            <p class="p-0 m-0">${author.name}${author.affiliation ? ` (${author.affiliation})` : ''}${author.orcid ? ` (${author.orcid})` : ''}</p>
-                                        `).join('') : `
-                                            <p class="p-0 m-0">No authors available</p>
-                                        `}
-                                      </div>
-
-                                    </div>
-
-                                    <div class="row mb-2">
-
-                                        <div class="col-md-4 col-12">
-                                            <span class=" text-secondary">
-                                                Tags
-                                            </span>
-                                        </div>
-                                        <div class="col-md-8 col-12">
-                                            ${dataset.tags.map(tag => `<span class="badge bg-primary me-1" style="cursor: pointer;" onclick="set_tag_as_query('${tag}')">${tag}</span>`).join('')}
-                                        </div>
-
-                                    </div>
-
-                                    <div class="row">
-
-                                        <div class="col-md-4 col-12">
-
-                                        </div>
-                                        <div class="col-md-8 col-12">
-                                            <a href="${dataset.url}" class="btn btn-outline-primary btn-sm" id="search" style="border-radius: 5px;">
-                                                View dataset
-                                            </a>
-                                            <a href="/dataset/download/${dataset.id}" class="btn btn-outline-primary btn-sm" id="search" style="border-radius: 5px;">
-                                                Download (${dataset.total_size_in_human_format})
-                                            </a>
-                                        </div>
-
-
-                                    </div>
-
-                                </div>
-                            </div>
-                        `;
+      fetch_page(true);
+    });
+  });
+}
 
-            document.getElementById('results').appendChild(card);
-          });
-        });
+function fetch_page(isNewSearch) {
+  // Responses of searches superseded by a later keystroke are discarded
+  const sequence = isNewSearch ? ++searchSequence : searchSequence;
+
+  fetch('/explore', {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+    },
+    body: JSON.stringify({...currentCriteria, cursor: nextCursor, page_size: PAGE_SIZE}),
+  })
+    .then(response => {
+      return response.json()
+    })
+    .then(data => {
+
+      if (sequence !== searchSequence) {
+        return;
+      }
+
+      if (isNewSearch) {
+        document.getElementById('results').innerHTML = '';
+        render_summary(data.total);
+      }
+
+      nextCursor = data.next_cursor;
+
+      data.datasets.forEach(render_dataset);
+      render_load_more_button();
     });
+}
+
+function render_summary(resultCount) {
+
+  // results counter
+  const resultText = resultCount === 1 ? 'dataset' : 'datasets';
+  document.getElementById('results_number').textContent = `${resultCount} ${resultText} found`;
+
+  if (resultCount === 0) {
+    document.getElementById("results_not_found").style.display = "block";
+  } else {
+    document.getElementById("results_not_found").style.display = "none";
+  }
+
+  const existingButtons = document.querySelectorAll('.btn-download-all');
+  existingButtons.forEach(button => button.remove());
+
+  const downloadButton = document.createElement('button');
+  downloadButton.className = 'btn btn-primary btn-sm btn-narrow text-white btn-download-all';
+  downloadButton.textContent = 'Download All Datasets';
+  downloadButton.addEventListener('click', download_all_results);
+  document.getElementById('results').insertAdjacentElement('beforebegin', downloadButton);
+}
+
+function download_all_results() {
+  // A single archive of every result is streamed by the server. The form posts to a hidden
+  // iframe so the browser saves the attachment itself instead of buffering it as a blob.
+  let frame = document.getElementById('bulk_download_frame');
+  if (!frame) {
+    frame = document.createElement('iframe');
+    frame.id = 'bulk_download_frame';
+    frame.name = 'bulk_download_frame';
+    frame.style.display = 'none';
+    // Attachments do not load the frame, only error responses do
+    frame.addEventListener('load', () => {
+      try {
+        const error = JSON.parse(frame.contentDocument.body.textContent).error;
+        if (error) {
+          alert(error);
+        }
+      } catch (e) {
+        // not an error response
+      }
+    });
+    document.body.appendChild(frame);
+  }
+
+  const form = document.createElement('form');
+  form.method = 'POST';
+  form.action = '/dataset/download/bulk';
+  form.target = frame.name;
+
+  const criteria = document.createElement('input');
+  criteria.type = 'hidden';
+  criteria.name = 'criteria';
+  criteria.value = JSON.stringify(currentCriteria);
+  form.appendChild(criteria);
+
+  document.body.appendChild(form);
+  form.submit();
+  document.body.removeChild(form);
+}
+
+function render_load_more_button() {
+  const existingButton = document.getElementById('load_more');
+  if (existingButton) {
+    existingButton.remove();
+  }
+
+  if (!nextCursor) {
+    return;
+  }
+
+  const loadMoreButton = document.createElement('button');
+  loadMoreButton.id = 'load_more';
+  loadMoreButton.className = 'btn btn-outline-primary btn-sm mt-2 mb-3';
+  loadMoreButton.textContent = 'Load more datasets';
+  loadMoreButton.addEventListener('click', () => {
+    loadMoreButton.disabled = true;
+    fetch_page(false);
   });
+  document.getElementById('results').insertAdjacentElement('afterend', loadMoreButton);
+}
+
+function render_dataset(dataset) {
+  let card = document.createElement('div');
+  card.className = 'col-12';
+  card.innerHTML = `
+                  <div class="card">
+                      <div class="card-body">
+                          <div class="d-flex align-items-center justify-content-between">
+                              <h3><a href="${dataset.url}">${dataset.title}</a></h3>
+                              <div>
+                                  <span class="badge bg-primary" style="cursor: pointer;" onclick="set_publication_type_as_query('${dataset.publication_type}')">${dataset.publication_type}</span>
+                              </div>
+                          </div>
+                          <p class="text-secondary">${formatDate(dataset.created_at)}</p>
+
+                          <div class="row mb-2">
+
+                              <div class="col-md-4 col-12">
+                                  <span class=" text-secondary">
+                                      Description
+                                  </span>
+                              </div>
+                              <div class="col-md-8 col-12">
+                                  <p class="card-text">${dataset.description}</p>
+                              </div>
+
+                          </div>
+
+                          <div class="row mb-2">
+
+                            <div class="col-md-4 col-12">
+                                <span class="text-secondary">
+                                    Authors
+                                </span>
+                            </div>
+                            <div class="col-md-8 col-12">
+                              ${dataset.is_anonymous ? `
+                                  <p class="p-0 m-0">Anónimo</p>
+                              ` : dataset.authors && dataset.authors.length > 0 ? dataset.authors.map(author => `
+                                  <p class="p-0 m-0">${author.name}${author.affiliation ? ` (${author.affiliation})` : ''}${author.orcid ? ` (${author.orcid})` : ''}</p>
+                              `).join('') : `
+                                  <p class="p-0 m-0">No authors available</p>
+                              `}
+                            </div>
+
+                          </div>
+
+                          <div class="row mb-2">
+
+                              <div class="col-md-4 col-12">
+                                  <span class=" text-secondary">
+                                      Tags
+                                  </span>
+                              </div>
+                              <div class="col-md-8 col-12">
+                                  ${dataset.tags.map(tag => `<span class="badge bg-primary me-1" style="cursor: pointer;" onclick="set_tag_as_query('${tag}')">${tag}</span>`).join('')}
+                              </div>
+
+                          </div>
+
+                          ${dataset.metrics ? `
+                          <div class="row mb-2">
+
+                              <div class="col-md-4 col-12">
+                                  <span class=" text-secondary">
+                                      Metrics
+                                  </span>
+                              </div>
+                              <div class="col-md-8 col-12">
+                                  <p class="card-text">${dataset.metrics.number_of_models} models, ${dataset.metrics.number_of_features} features, ${dataset.metrics.number_of_constraints} constraints</p>
+                              </div>
+
+                          </div>
+                          ` : ''}
+
+                          <div class="row">
+
+                              <div class="col-md-4 col-12">
+
+                              </div>
+                              <div class="col-md-8 col-12">
+                                  <a href="${dataset.url}" class="btn btn-outline-primary btn-sm" id="search" style="border-radius: 5px;">
+                                      View dataset
+                                  </a>
+                                  <a href="/dataset/download/${dataset.id}" class="btn btn-outline-primary btn-sm" id="search" style="border-radius: 5px;">
+                                      Download (${dataset.total_size_in_human_format})
+                                  </a>
+                              </div>
+
+
+                          </div>
+
+                      </div>
+                  </div>
+              `;
+
+  document.getElementById('results').appendChild(card);
 }
 
 function formatDate(dateString) {
@@ -218,6 +308,10 @@ function clearFilters() {
     let numAuthorsInput = document.querySelector('#num_authors');
     numAuthorsInput.value = "any";
 
+    // Reset the number of features bounds
+    document.querySelector('#min_features').value = "";
+    document.querySelector('#max_features').value = "";
+
     // Perform a new search with the reset filters
     queryInput.dispatchEvent(new Event('input', {bubbles: true}));
 }
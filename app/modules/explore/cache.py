@@ -0,0 +1,130 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+from core.configuration.configuration import cache_folder_path
+
+# Touched on every invalidation so the other workers drop their entries too
+GENERATION_FILE = "explore.generation"
+
+
+def make_key(criteria: dict, *extra) -> str:
+    """Cache key of a search, from its criteria as normalize_criteria returns them."""
+    return json.dumps({"criteria": criteria, "extra": extra}, sort_keys=True, default=str)
+
+
+class ExploreCache:
+    """
+    In-process LRU cache of explore results with a time to live.
+
+    Every entry is dropped whenever a dataset is written (see listeners.py).
+    The invalidation is shared with the other workers through the modification
+    time of a generation file in the cache folder, so a worker never serves a
+    result older than the last dataset write it can see.
+    """
+
+    def __init__(self, ttl=None, maxsize=None, clock=time.monotonic):
+        self._ttl = ttl
+        self._maxsize = maxsize
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def ttl(self) -> int:
+        if self._ttl is not None:
+            return self._ttl
+        return current_app.config["EXPLORE_CACHE_TTL"]
+
+    @property
+    def maxsize(self) -> int:
+        if self._maxsize is not None:
+            return self._maxsize
+        return current_app.config["EXPLORE_CACHE_SIZE"]
+
+    def get(self, key):
+        generation = self._read_generation()
+        with self._lock:
+            if generation != self._generation:
+                self._entries.clear()
+                self._generation = generation
+
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= self._clock():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        if self.ttl <= 0 or self.maxsize <= 0:
+            return
+
+        generation = self._read_generation()
+        with self._lock:
+            # A dataset was written since the lookup, the value may be stale
+            if generation != self._generation:
+                self._entries.clear()
+                self._generation = generation
+                return
+
+            self._entries[key] = (self._clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+        path = cache_folder_path(GENERATION_FILE)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as file:
+                file.write(str(time.time_ns()))
+        except OSError:
+            current_app.logger.exception("Could not share the explore invalidation")
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    @staticmethod
+    def _read_generation():
+        try:
+            return os.stat(cache_folder_path(GENERATION_FILE)).st_mtime_ns
+        except OSError:
+            return None
+
+
+explore_cache = ExploreCache()
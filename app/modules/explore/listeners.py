@@ -0,0 +1,68 @@
+from itertools import chain
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.modules.dataset.models import Author, DataSet, DSMetaData
+
+PENDING_DATASETS = "search_index_pending_datasets"
+PENDING_DS_META_DATA = "search_index_pending_ds_meta_data"
+DATASETS_CHANGED = "explore_cache_datasets_changed"
+
+
+@event.listens_for(Session, "after_flush")
+def collect_changed_datasets(session, flush_context):
+    """
+    Remembers which datasets were touched by the flush so their search index
+    entries and tags are rebuilt on commit.
+    """
+    datasets = session.info.setdefault(PENDING_DATASETS, set())
+    ds_meta_data = session.info.setdefault(PENDING_DS_META_DATA, set())
+
+    for instance in chain(session.new, session.dirty, session.deleted):
+        if isinstance(instance, DataSet):
+            datasets.add(instance.id)
+        elif isinstance(instance, DSMetaData):
+            ds_meta_data.add(instance.id)
+        elif isinstance(instance, Author) and instance.ds_meta_data_id:
+            ds_meta_data.add(instance.ds_meta_data_id)
+
+
+@event.listens_for(Session, "before_commit")
+def reindex_changed_datasets(session):
+    from app.modules.explore.repositories import SearchIndexRepository, TagRepository
+
+    if session.new or session.dirty or session.deleted:
+        session.flush()
+
+    datasets = session.info.pop(PENDING_DATASETS, set())
+    ds_meta_data = session.info.pop(PENDING_DS_META_DATA, set())
+    if not datasets and not ds_meta_data:
+        return
+
+    repository = SearchIndexRepository()
+    repository.session = session
+    datasets.update(repository.get_dataset_ids_by_ds_meta_data(ds_meta_data))
+    repository.reindex(datasets)
+
+    tag_repository = TagRepository()
+    tag_repository.session = session
+    tag_repository.sync(datasets)
+
+    session.info[DATASETS_CHANGED] = True
+
+
+@event.listens_for(Session, "after_commit")
+def invalidate_explore_cache(session):
+    from app.modules.explore.cache import explore_cache
+
+    # Only once the data is visible, or a concurrent search could cache it stale
+    if session.info.pop(DATASETS_CHANGED, False):
+        explore_cache.invalidate()
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_changed_datasets(session):
+    session.info.pop(PENDING_DATASETS, None)
+    session.info.pop(PENDING_DS_META_DATA, None)
+    session.info.pop(DATASETS_CHANGED, None)
@@ -0,0 +1,45 @@
+from app import db
+
+
+class SearchIndexEntry(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    term = db.Column(db.String(64), nullable=False)
+    dataset_id = db.Column(
+        db.Integer,
+        db.ForeignKey("data_set.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
+    )
+    field = db.Column(db.String(16), nullable=False)
+    weight = db.Column(db.Integer, nullable=False, default=1)
+
+    __table_args__ = (db.Index("ix_search_index_entry_term", "term", "dataset_id"),)
+
+    def __repr__(self):
+        return f"SearchIndexEntry<{self.term}, dataset_id={self.dataset_id}>"
+
+
+dataset_tag = db.Table(
+    "dataset_tag",
+    db.Column(
+        "dataset_id",
+        db.Integer,
+        db.ForeignKey("data_set.id", ondelete="CASCADE"),
+        primary_key=True,
+    ),
+    db.Column(
+        "tag_id",
+        db.Integer,
+        db.ForeignKey("tag.id", ondelete="CASCADE"),
+        primary_key=True,
+        index=True,
+    ),
+)
+
+
+class Tag(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(120), nullable=False, unique=True)
+
+    def __repr__(self):
+        return f"Tag<{self.name}>"
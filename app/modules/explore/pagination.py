@@ -0,0 +1,45 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+class InvalidCursorError(ValueError):
+    pass
+
+
+def encode_cursor(sorting, last) -> str:
+    """Encodes the (sort key, dataset id) pair of the last dataset of a page as an opaque token."""
+    sort_key, dataset_id = last
+    if isinstance(sort_key, datetime):
+        sort_key = {"datetime": sort_key.isoformat()}
+    payload = json.dumps({"sorting": sorting, "key": sort_key, "id": dataset_id})
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(token: str, sorting):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token.encode()))
+        sort_key = payload["key"]
+        if isinstance(sort_key, dict):
+            sort_key = datetime.fromisoformat(sort_key["datetime"])
+        dataset_id = int(payload["id"])
+    except (binascii.Error, ValueError, KeyError, TypeError, AttributeError):
+        raise InvalidCursorError("Invalid cursor")
+
+    # A cursor only makes sense for the sorting it was produced with
+    if payload.get("sorting") != sorting:
+        raise InvalidCursorError("The cursor does not belong to this sorting")
+
+    return sort_key, dataset_id
+
+
+def parse_page_size(value) -> int:
+    try:
+        page_size = int(value)
+    except (TypeError, ValueError):
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(page_size, MAX_PAGE_SIZE))
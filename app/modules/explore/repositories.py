@@ -1,57 +1,393 @@
-import re
-from app import db
-from sqlalchemy import any_, func, or_
-import unidecode
+from sqlalchemy import and_, func, or_, select, union_all
 from app.modules.dataset.models import (
     Author,
     DSMetaData,
+    DSMetrics,
     DataSet,
     PublicationType,
-    DSViewRecord,
-    DSDownloadRecord,
 )
-from app.modules.featuremodel.models import FMMetaData, FeatureModel
+from app.modules.explore.models import SearchIndexEntry, Tag, dataset_tag
+from app.modules.explore.search import build_postings, escape_like, parse_count, parse_query, parse_tags
+from app.modules.featuremodel.models import FeatureModel
 from core.repositories.BaseRepository import BaseRepository
 
 
+class SearchIndexRepository(BaseRepository):
+    def __init__(self):
+        super().__init__(SearchIndexEntry)
+
+    def get_dataset_ids_by_ds_meta_data(self, ds_meta_data_ids) -> list[int]:
+        if not ds_meta_data_ids:
+            return []
+        rows = (
+            self.session.query(DataSet.id)
+            .filter(DataSet.ds_meta_data_id.in_(ds_meta_data_ids))
+            .all()
+        )
+        return [row.id for row in rows]
+
+    def reindex(self, dataset_ids):
+        """
+        Replaces the index entries of the given datasets. Datasets that no longer
+        exist simply lose their entries. It does not commit, so it can run inside
+        the transaction that modified the datasets.
+        """
+        dataset_ids = set(dataset_ids)
+        if not dataset_ids:
+            return
+
+        table = self.model.__table__
+        self.session.execute(table.delete().where(table.c.dataset_id.in_(dataset_ids)))
+
+        datasets = (
+            self.session.query(
+                DataSet.id,
+                DataSet.ds_meta_data_id,
+                DSMetaData.title,
+                DSMetaData.description,
+                DSMetaData.tags,
+            )
+            .join(DSMetaData, DataSet.ds_meta_data_id == DSMetaData.id)
+            .filter(DataSet.id.in_(dataset_ids))
+            .all()
+        )
+        if not datasets:
+            return
+
+        authors = {}
+        for ds_meta_data_id, name in (
+            self.session.query(Author.ds_meta_data_id, Author.name)
+            .filter(Author.ds_meta_data_id.in_([d.ds_meta_data_id for d in datasets]))
+            .all()
+        ):
+            authors.setdefault(ds_meta_data_id, []).append(name)
+
+        entries = []
+        for dataset in datasets:
+            postings = build_postings(
+                {
+                    "title": [dataset.title],
+                    "description": [dataset.description],
+                    "tags": [dataset.tags or ""],
+                    "author": authors.get(dataset.ds_meta_data_id, []),
+                }
+            )
+            for posting in postings:
+                posting["dataset_id"] = dataset.id
+            entries.extend(postings)
+
+        if entries:
+            self.session.execute(table.insert(), entries)
+
+    def rebuild(self) -> int:
+        self.session.execute(self.model.__table__.delete())
+        dataset_ids = [row.id for row in self.session.query(DataSet.id).all()]
+        self.reindex(dataset_ids)
+        self.session.commit()
+        return len(dataset_ids)
+
+    def term_scores(self, term: str):
+        # Prefix match, so partially typed words keep matching as the user types
+        return (
+            select(self.model.dataset_id.label("dataset_id"), func.sum(self.model.weight).label("score"))
+            .where(self.model.term.like(f"{escape_like(term)}%", escape="\\"))
+            .group_by(self.model.dataset_id)
+        )
+
+    def scores_query(self, query: str):
+        """
+        Subquery of the relevance score of every dataset matching a query, as
+        (dataset_id, score) rows, or None when the query has no terms. The
+        scores are summed in the database, so that the matches are ranked
+        and paginated there instead of being loaded.
+        """
+        groups = []
+        for group in parse_query(query):
+            terms = [self.term_scores(term).subquery() for term in group]
+            first = terms[0]
+            scores = select(
+                first.c.dataset_id.label("dataset_id"),
+                sum((term.c.score for term in terms[1:]), first.c.score).label("score"),
+            ).select_from(first)
+            # AND-ed terms must all match the dataset
+            for term in terms[1:]:
+                scores = scores.join(term, term.c.dataset_id == first.c.dataset_id)
+            groups.append(scores)
+        if not groups:
+            return None
+
+        matches = union_all(*groups).subquery() if len(groups) > 1 else groups[0].subquery()
+        return (
+            select(matches.c.dataset_id, func.sum(matches.c.score).label("score"))
+            .group_by(matches.c.dataset_id)
+            .subquery()
+        )
+
+    def search(self, query: str) -> dict[int, int]:
+        """
+        Evaluates a query against the index and returns the relevance score of
+        every matching dataset, keyed by dataset id.
+        """
+        scores = self.scores_query(query)
+        if scores is None:
+            return {}
+        return {dataset_id: int(score) for dataset_id, score in self.session.execute(select(scores))}
+
+
+class TagRepository(BaseRepository):
+    def __init__(self):
+        super().__init__(Tag)
+
+    def get_or_create_ids(self, names) -> dict[str, int]:
+        names = set(names)
+        if not names:
+            return {}
+
+        tag_ids = dict(
+            self.session.query(self.model.name, self.model.id)
+            .filter(self.model.name.in_(names))
+            .all()
+        )
+        missing = names - tag_ids.keys()
+        if missing:
+            # Runs while another commit is being flushed: a tag another worker
+            # has just created must not fail it, so duplicates are ignored
+            insert = (
+                self.model.__table__.insert()
+                .prefix_with("IGNORE", dialect="mysql")
+                .prefix_with("OR IGNORE", dialect="sqlite")
+            )
+            self.session.execute(insert, [{"name": name} for name in missing])
+            # A locking read sees the rows committed by the other worker meanwhile
+            tag_ids.update(
+                self.session.query(self.model.name, self.model.id)
+                .filter(self.model.name.in_(missing))
+                .with_for_update(read=True)
+                .all()
+            )
+        return tag_ids
+
+    def sync(self, dataset_ids):
+        """
+        Rebuilds the dataset_tag rows of the given datasets from their
+        DSMetaData.tags strings. Like the search index, it does not commit.
+        """
+        dataset_ids = set(dataset_ids)
+        if not dataset_ids:
+            return
+
+        self.session.execute(
+            dataset_tag.delete().where(dataset_tag.c.dataset_id.in_(dataset_ids))
+        )
+
+        datasets = (
+            self.session.query(DataSet.id, DSMetaData.tags)
+            .join(DSMetaData, DataSet.ds_meta_data_id == DSMetaData.id)
+            .filter(DataSet.id.in_(dataset_ids))
+            .all()
+        )
+        tags_by_dataset = {dataset_id: parse_tags(tags) for dataset_id, tags in datasets}
+        tag_ids = self.get_or_create_ids(
+            name for names in tags_by_dataset.values() for name in names
+        )
+
+        rows = [
+            {"dataset_id": dataset_id, "tag_id": tag_ids[name]}
+            for dataset_id, names in tags_by_dataset.items()
+            for name in names
+        ]
+        if rows:
+            self.session.execute(dataset_tag.insert(), rows)
+
+    def rebuild(self) -> int:
+        self.session.execute(dataset_tag.delete())
+        dataset_ids = [row.id for row in self.session.query(DataSet.id).all()]
+        self.sync(dataset_ids)
+        self.session.commit()
+        return len(dataset_ids)
+
+    def dataset_ids_query(self, tags):
+        """
+        Subquery of the ids of the datasets having any of the given tags. A tag
+        ending in "*" matches every tag starting with it; any other tag must match
+        exactly, so "tag1" no longer matches "tag10". None when no tag restricts
+        the datasets.
+        """
+        conditions = []
+        exact = []
+        for tag in tags:
+            if tag.endswith("*"):
+                prefix = tag.rstrip("*")
+                if prefix:
+                    conditions.append(self.model.name.like(f"{escape_like(prefix)}%", escape="\\"))
+            else:
+                exact.append(tag)
+        if exact:
+            conditions.append(self.model.name.in_(exact))
+
+        if not conditions:
+            # Only "*", which filters nothing, like an empty tags string
+            return None
+
+        return (
+            select(dataset_tag.c.dataset_id)
+            .join(self.model, self.model.id == dataset_tag.c.tag_id)
+            .where(or_(*conditions))
+        )
+
+    def count_by_tag(self, prefix: str = None, limit: int = 50) -> list[tuple[str, int]]:
+        """Number of synchronized datasets per tag, most used first."""
+        count = func.count(dataset_tag.c.dataset_id)
+        query = (
+            self.session.query(self.model.name, count)
+            .join(dataset_tag, dataset_tag.c.tag_id == self.model.id)
+            .join(DataSet, DataSet.id == dataset_tag.c.dataset_id)
+            .join(DSMetaData, DataSet.ds_meta_data_id == DSMetaData.id)
+            .filter(DSMetaData.dataset_doi.isnot(None))
+        )
+        if prefix:
+            query = query.filter(self.model.name.like(f"{escape_like(prefix)}%", escape="\\"))
+        return (
+            query.group_by(self.model.id, self.model.name)
+            .order_by(count.desc(), self.model.name.asc())
+            .limit(limit)
+            .all()
+        )
+
+
 class ExploreRepository(BaseRepository):
     def __init__(self):
         super().__init__(DataSet)
+        self.search_index_repository = SearchIndexRepository()
+        self.tag_repository = TagRepository()
 
     def filter(self, search_criteria, **kwargs):
+        datasets, scores = self.filtered_query(search_criteria)
+
+        sorting = search_criteria.get("sorting", None)
+        if scores is not None and sorting in (None, "relevance"):
+            return datasets.order_by(scores.c.score.desc(), self.model.id.desc()).all()
+
+        if sorting:
+            datasets, _, _ = self.sorted_query(datasets, sorting)
+        return datasets.all()
+
+    def filter_ids(self, search_criteria, limit=None) -> list[int]:
+        datasets, _ = self.filtered_query(search_criteria)
+
+        query = datasets.with_entities(self.model.id).order_by(self.model.id)
+        if limit is not None:
+            query = query.limit(limit)
+        return [dataset_id for (dataset_id,) in query]
+
+    def filter_page(self, search_criteria, after=None, page_size=20):
+        """
+        Returns one page of the datasets matching the criteria using keyset
+        pagination, together with the sort key of its last dataset and the total
+        number of matches. `after` is the (sort key, dataset id) pair of the last
+        dataset of the previous page.
+        """
+        datasets, scores = self.filtered_query(search_criteria)
+
+        total = datasets.order_by(None).with_entities(func.count(self.model.id)).scalar()
+
+        sorting = search_criteria.get("sorting", None)
+        if scores is not None and sorting in (None, "relevance"):
+            return self.relevance_page(datasets, scores, after, page_size) + (total,)
+
+        datasets, sort_key, descending = self.sorted_query(datasets, sorting)
+
+        if after is not None:
+            last_key, last_id = after
+            if descending:
+                datasets = datasets.filter(
+                    or_(
+                        sort_key < last_key,
+                        and_(sort_key == last_key, self.model.id < last_id),
+                    )
+                )
+            else:
+                datasets = datasets.filter(
+                    or_(
+                        sort_key > last_key,
+                        and_(sort_key == last_key, self.model.id > last_id),
+                    )
+                )
+
+        rows = datasets.add_columns(sort_key).limit(page_size + 1).all()
+        page = [dataset for dataset, _ in rows[:page_size]]
+        last = (rows[page_size - 1][1], page[-1].id) if len(rows) > page_size else None
+        return page, last, total
+
+    def relevance_page(self, datasets, scores, after, page_size):
+        score = scores.c.score
+        if after is not None:
+            last_score, last_id = after
+            datasets = datasets.filter(
+                or_(score < last_score, and_(score == last_score, self.model.id < last_id))
+            )
+
+        rows = datasets.add_columns(score).order_by(score.desc(), self.model.id.desc()).limit(page_size + 1).all()
+        page = [dataset for dataset, _ in rows[:page_size]]
+        last = (int(rows[page_size - 1][1]), page[-1].id) if len(rows) > page_size else None
+        return page, last
+
+    def sorted_query(self, datasets, sorting):
+        """Orders the query by the given sorting and returns it along with its sort key and direction."""
+        if sorting == "oldest":
+            sort_key = self.model.created_at
+            return (
+                datasets.order_by(sort_key.asc(), self.model.id.asc()),
+                sort_key,
+                False,
+            )
+
+        if sorting in ("most views", "most downloads"):
+            # Maintained counters, backed by (counter, id) indexes
+            if sorting == "most views":
+                sort_key = self.model.view_count
+            else:
+                sort_key = self.model.download_count
+            return datasets.order_by(sort_key.desc(), self.model.id.desc()), sort_key, True
+
+        sort_key = self.model.created_at
+        return datasets.order_by(sort_key.desc(), self.model.id.desc()), sort_key, True
+
+    def filtered_query(self, search_criteria):
+        """
+        Builds the unordered query of the datasets matching the criteria, with one
+        row per dataset, and the subquery of the relevance scores of the full-text
+        search, joined to it, if any. The criteria are expected as
+        normalize_criteria returns them, the same the explore cache key is built from.
+        """
         # we have to check existence of keys in the dictionary because in the tests not all of them will be present
         title = search_criteria.get("title", None)
         publication_type = search_criteria.get("publication_type", None)
-        sorting = search_criteria.get("sorting", None)
         uvl_validation = search_criteria.get("uvl_validation", None)
         num_authors = search_criteria.get("num_authors", None)
         tags_str = search_criteria.get("tags_str", None)
-        tags = [t.strip() for t in tags_str.split(",")] if tags_str else None
+        tags = parse_tags(tags_str)
         author_name = search_criteria.get("author_name", None)
+        min_features = parse_count(search_criteria.get("min_features", None))
+        max_features = parse_count(search_criteria.get("max_features", None))
 
-        # Normalize and remove unwanted characters
-        normalized_title = unidecode.unidecode(title).lower() if title else None
-        cleaned_title = (
-            re.sub(r'[,.":\'()\[\]^;!¡¿?]', "", normalized_title)
-            if normalized_title
-            else None
-        )
-        filters = []
-        if cleaned_title:
-            for word in cleaned_title.split():
-                filters.append(DSMetaData.title.ilike(f"%{word}%"))
+        # Full-text search over title, description, tags and authors
+        scores = self.search_index_repository.scores_query(title) if title else None
 
+        # Existence checks instead of joins keep a single row per dataset
         datasets = (
             self.model.query.join(DataSet.ds_meta_data)
-            .outerjoin(DSMetaData.authors)
-            .join(DataSet.feature_models)
-            .join(FeatureModel.fm_meta_data)
-            .filter(or_(*filters))
+            .filter(
+                DataSet.feature_models.any(FeatureModel.fm_meta_data_id.isnot(None))
+            )
             .filter(
                 DSMetaData.dataset_doi.isnot(None)
             )  # Exclude datasets with empty dataset_doi
         )
 
+        if scores is not None:
+            datasets = datasets.join(scores, scores.c.dataset_id == self.model.id)
+
         if publication_type and publication_type != "any":
             matching_type = None
             for member in PublicationType:
@@ -64,35 +400,9 @@ class ExploreRepository(BaseRepository):
                     DSMetaData.publication_type == matching_type.name
                 )
 
-        if tags:
-            tag_filters = []
-            for tag in tags:
-                tag_filters.append(DSMetaData.tags.ilike(f"%{tag}%"))
-                datasets = datasets.filter(or_(*tag_filters))
-
-        # Order by created_at
-        if sorting and sorting == "oldest":
-            datasets = datasets.order_by(self.model.created_at.asc())
-        elif sorting and sorting == "newest":
-            datasets = datasets.order_by(self.model.created_at.desc())
-        elif sorting == "most views":
-            datasets = (
-                datasets.outerjoin(
-                    DSViewRecord, DSViewRecord.dataset_id == self.model.id
-                )  # Relación con DSViewRecord
-                .group_by(self.model.id)  # Agrupar por dataset
-                .order_by((db.func.count(DSViewRecord.id)).desc())  # Ordenar por vistas
-            )
-        elif sorting == "most downloads":
-            datasets = (
-                datasets.outerjoin(
-                    DSDownloadRecord, DSDownloadRecord.dataset_id == self.model.id
-                )  # Relación con DSDownloadRecord
-                .group_by(self.model.id)  # Agrupar por dataset
-                .order_by(
-                    (db.func.count(DSDownloadRecord.id)).desc()
-                )  # Ordenar por descargas
-            )
+        tagged = self.tag_repository.dataset_ids_query(tags) if tags else None
+        if tagged is not None:
+            datasets = datasets.filter(self.model.id.in_(tagged))
 
         # Comprobar si todos los feature models de un dataset tienen uvl_valid = True
         if uvl_validation:
@@ -100,29 +410,26 @@ class ExploreRepository(BaseRepository):
                 ~DataSet.feature_models.any(FeatureModel.uvl_valid == False)
             )
 
-        if num_authors != "any":
-            author_count_subquery = (
-                db.session.query(
-                    DSMetaData.id, func.count(Author.id).label("author_count")
-                )
-                .outerjoin(DSMetaData.authors)
-                .group_by(DSMetaData.id)
-                .subquery()
-            )
+        if num_authors == "1":
+            datasets = datasets.filter(DSMetaData.author_count == 1)
+        elif num_authors == "2-3":
+            datasets = datasets.filter(DSMetaData.author_count.between(2, 3))
+        elif num_authors == "4+":
+            datasets = datasets.filter(DSMetaData.author_count >= 4)
 
-            datasets = datasets.join(
-                author_count_subquery, author_count_subquery.c.id == DSMetaData.id
+        if author_name:
+            datasets = datasets.filter(
+                DSMetaData.authors.any(Author.name.ilike(f"%{author_name}%"))
             )
 
-            if num_authors == "1":
-                datasets = datasets.filter(author_count_subquery.c.author_count == 1)
-            elif num_authors == "2-3":
-                datasets = datasets.filter(
-                    author_count_subquery.c.author_count.between(2, 3)
-                )
-            elif num_authors == "4+":
-                datasets = datasets.filter(author_count_subquery.c.author_count >= 4)
+        # Stored by the metrics pipeline, datasets still pending never match
+        if min_features is not None:
+            datasets = datasets.filter(
+                DSMetaData.ds_metrics.has(DSMetrics.number_of_features >= min_features)
+            )
+        if max_features is not None:
+            datasets = datasets.filter(
+                DSMetaData.ds_metrics.has(DSMetrics.number_of_features <= max_features)
+            )
 
-        if author_name:
-            datasets = datasets.filter(Author.name.ilike(f"%{author_name}%"))
-        return datasets.all()
+        return datasets, scores
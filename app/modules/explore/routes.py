@@ -1,7 +1,10 @@
 from flask import render_template, request, jsonify
+from flask_login import login_required
 
 from app.modules.explore import explore_bp
+from app.modules.explore.cache import explore_cache
 from app.modules.explore.forms import ExploreForm
+from app.modules.explore.pagination import InvalidCursorError
 from app.modules.explore.services import ExploreService
 
 
@@ -14,5 +17,29 @@ def index():
 
     if request.method == "POST":
         criteria = request.get_json()
-        datasets = ExploreService().filter(criteria)
-        return jsonify([dataset.to_dict() for dataset in datasets])
+        try:
+            page = ExploreService().cached_page(
+                criteria,
+                cursor=criteria.get("cursor"),
+                page_size=criteria.get("page_size"),
+                host_url=request.host_url,
+            )
+        except InvalidCursorError as e:
+            return jsonify({"error": str(e)}), 400
+
+        return jsonify(page)
+
+
+@explore_bp.route("/explore/tags", methods=["GET"])
+def tag_facets():
+    facets = ExploreService().tag_facets(
+        prefix=request.args.get("prefix", None),
+        limit=request.args.get("limit", 50, type=int),
+    )
+    return jsonify(facets)
+
+
+@explore_bp.route("/explore/cache/stats", methods=["GET"])
+@login_required
+def cache_stats():
+    return jsonify(explore_cache.stats())
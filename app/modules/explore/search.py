@@ -0,0 +1,137 @@
+import re
+from collections import Counter
+from typing import Optional
+
+import unidecode
+
+# Weight of a single occurrence of a term, by the field it was found in
+FIELD_WEIGHTS = {
+    "title": 5,
+    "tags": 3,
+    "author": 3,
+    "description": 1,
+}
+
+MAX_TERM_LENGTH = 64
+
+MAX_TAG_LENGTH = 120
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+NUM_AUTHORS = ("1", "2-3", "4+")
+
+
+def normalize(text: str) -> str:
+    return unidecode.unidecode(text).lower() if text else ""
+
+
+def tokenize(text: str) -> list[str]:
+    return [
+        token[:MAX_TERM_LENGTH] for token in TOKEN_PATTERN.findall(normalize(text))
+    ]
+
+
+def escape_like(value: str) -> str:
+    """Escapes the LIKE wildcards of user input, for patterns using "\\" as escape character."""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def parse_tags(tags_str: str) -> list[str]:
+    """Splits a comma separated tags string into unique, normalized tag names."""
+    tags = []
+    for tag in (tags_str or "").split(","):
+        tag = " ".join(tag.lower().split())[:MAX_TAG_LENGTH]
+        if tag and tag not in tags:
+            tags.append(tag)
+    return tags
+
+
+def parse_count(value) -> Optional[int]:
+    """A non-negative bound of a numeric filter, None when missing or not a number."""
+    try:
+        count = int(value)
+    except (TypeError, ValueError):
+        return None
+    return count if count >= 0 else None
+
+
+def parse_query(query: str) -> list[list[str]]:
+    """
+    Parses a search query into a list of OR-ed groups of AND-ed terms.
+
+    Terms are OR-ed by default, as the previous title search did, and an
+    uppercase AND between two terms requires both of them:
+
+        "sample AND model uvl" -> [["sample", "model"], ["uvl"]]
+    """
+    groups = []
+    current = []
+    pending_and = False
+
+    for word in (query or "").split():
+        if word == "AND":
+            pending_and = bool(current)
+            continue
+        if word == "OR":
+            pending_and = False
+            continue
+
+        terms = tokenize(word)
+        if not terms:
+            continue
+
+        if pending_and or not current:
+            current.extend(terms)
+        else:
+            groups.append(current)
+            current = list(terms)
+        pending_and = False
+
+    if current:
+        groups.append(current)
+
+    return groups
+
+
+def normalize_criteria(search_criteria: dict) -> dict:
+    """
+    Normalized explore criteria, which both the cache key and the query are
+    built from: searches which only differ in case, accents, punctuation,
+    spacing or the order of their tags are the same search. The keys are
+    those of the raw criteria, normalizing them again changes nothing.
+    """
+    author_name = " ".join((search_criteria.get("author_name") or "").lower().split())
+    publication_type = (search_criteria.get("publication_type") or "").lower()
+    num_authors = search_criteria.get("num_authors")
+    return {
+        "title": " ".join(" AND ".join(group) for group in parse_query(search_criteria.get("title"))),
+        "tags_str": ",".join(sorted(parse_tags(search_criteria.get("tags_str")))),
+        "author_name": author_name or None,
+        "publication_type": publication_type if publication_type not in ("", "any") else None,
+        "num_authors": num_authors if num_authors in NUM_AUTHORS else None,
+        "uvl_validation": bool(search_criteria.get("uvl_validation")),
+        "min_features": parse_count(search_criteria.get("min_features")),
+        "max_features": parse_count(search_criteria.get("max_features")),
+        "sorting": search_criteria.get("sorting") or None,
+    }
+
+
+def build_postings(fields: dict[str, list[str]]) -> list[dict]:
+    """
+    Builds the inverted index rows of one dataset from the text of its fields.
+    Each row carries the accumulated weight of a term in a field.
+    """
+    postings = []
+    for field, texts in fields.items():
+        counter = Counter()
+        for text in texts:
+            counter.update(tokenize(text))
+        for term, occurrences in counter.items():
+            postings.append(
+                {
+                    "term": term,
+                    "field": field,
+                    "weight": FIELD_WEIGHTS[field] * occurrences,
+                }
+            )
+    return postings
@@ -1,10 +1,57 @@
-from app.modules.explore.repositories import ExploreRepository
+from app.modules.dataset.services import DataSetService
+from app.modules.explore.cache import explore_cache, make_key
+from app.modules.explore.pagination import decode_cursor, encode_cursor, parse_page_size
+from app.modules.explore.repositories import ExploreRepository, TagRepository
+from app.modules.explore.search import normalize_criteria
 from core.services.BaseService import BaseService
 
 
 class ExploreService(BaseService):
     def __init__(self):
         super().__init__(ExploreRepository())
+        self.tag_repository = TagRepository()
+        self.dataset_service = DataSetService()
 
     def filter(self, search_criteria, **kwargs):
-        return self.repository.filter(search_criteria, **kwargs)
+        return self.repository.filter(normalize_criteria(search_criteria), **kwargs)
+
+    def filter_ids(self, search_criteria, limit=None) -> list[int]:
+        return self.repository.filter_ids(normalize_criteria(search_criteria), limit=limit)
+
+    def filter_page(self, search_criteria, cursor=None, page_size=None):
+        return self._page(normalize_criteria(search_criteria), cursor, page_size)
+
+    def cached_page(self, search_criteria, cursor=None, page_size=None, host_url=""):
+        """
+        Serialized page of results, served from the explore cache when the same
+        normalized search was answered since the last dataset write.
+        """
+        criteria = normalize_criteria(search_criteria)
+        key = make_key(criteria, cursor, parse_page_size(page_size), host_url)
+        page = explore_cache.get(key)
+        if page is None:
+            page = self._page(criteria, cursor, page_size)
+            page["datasets"] = self.dataset_service.to_dicts(page["datasets"])
+            explore_cache.set(key, page)
+        return page
+
+    def _page(self, criteria, cursor, page_size):
+        sorting = criteria["sorting"]
+        after = decode_cursor(cursor, sorting) if cursor else None
+
+        datasets, last, total = self.repository.filter_page(
+            criteria, after=after, page_size=parse_page_size(page_size)
+        )
+
+        return {
+            "datasets": datasets,
+            "next_cursor": encode_cursor(sorting, last) if last else None,
+            "total": total,
+        }
+
+    def tag_facets(self, prefix=None, limit=50) -> list[dict]:
+        counts = self.tag_repository.count_by_tag(
+            prefix=" ".join(prefix.lower().split()) if prefix else None,
+            limit=max(1, min(limit, 200)),
+        )
+        return [{"name": name, "count": count} for name, count in counts]
@@ -1,7 +1,18 @@
 import pytest
+from datetime import datetime, timezone
+from app import db
 from app.modules.dataset.models import DSDownloadRecord, DSViewRecord
+from app.modules.dataset.repositories import (
+    DataSetRepository,
+    DSMetaDataRepository,
+    DSViewRecordRepository,
+)
+from app.modules.conftest import login, logout
+from app.modules.explore.cache import ExploreCache, explore_cache, make_key
 from app.modules.explore.services import ExploreService
-from app.modules.explore.repositories import ExploreRepository
+from app.modules.explore.repositories import ExploreRepository, SearchIndexRepository
+from app.modules.explore.pagination import InvalidCursorError
+from app.modules.explore.search import normalize_criteria, parse_query, parse_tags
 from app.modules.dataset.seeders import DataSetSeeder
 from app.modules.auth.seeders import AuthSeeder
 
@@ -333,3 +344,308 @@ def test_combined_filter_sort_validation_and_num_authors_repository():
 
     # Este debe ser el resultado por como funciona la validación de los archivos UVL
     assert len(result) == 0
+
+
+# TEST OF THE FULL-TEXT SEARCH INDEX
+
+
+def test_parse_query_or_by_default():
+    assert parse_query("Sample  Dataset") == [["sample"], ["dataset"]]
+
+
+def test_parse_query_and_groups():
+    assert parse_query("sample AND módel uvl") == [["sample", "model"], ["uvl"]]
+
+
+def test_parse_query_ignores_punctuation():
+    assert parse_query('"¿?" OR ()') == []
+
+
+def test_search_by_title_prefix():
+    search_criteria = {"title": "samp"}
+    result = ExploreService().filter(search_criteria)
+    assert len(result) == 4
+
+
+def test_search_by_description_and_author():
+    assert len(ExploreService().filter({"title": "description"})) == 4
+    assert len(ExploreService().filter({"title": "author"})) == 4
+
+
+def test_search_and_operator():
+    result = ExploreService().filter({"title": "sample AND 3"})
+    assert len(result) == 1
+    assert result[0].ds_meta_data.title == "Sample dataset 3"
+
+    result = ExploreService().filter({"title": "sample AND abcd"})
+    assert len(result) == 0
+
+
+def test_search_results_ranked_by_relevance():
+    # "3" appears in the title, description and author of the third dataset only
+    result = ExploreService().filter({"title": "dataset OR 3", "sorting": "relevance"})
+    assert len(result) == 4
+    assert result[0].ds_meta_data.title == "Sample dataset 3"
+
+
+def test_relevance_pages_follow_the_scores_of_the_index():
+    # A one-letter prefix matches every dataset, pages are ranked and cut in the database
+    scores = SearchIndexRepository().search("s")
+    ranking = sorted(scores, key=lambda dataset_id: (-scores[dataset_id], -dataset_id))
+
+    explore_service = ExploreService()
+    first = explore_service.filter_page({"title": "s", "sorting": "relevance"}, page_size=3)
+    second = explore_service.filter_page(
+        {"title": "s", "sorting": "relevance"}, cursor=first["next_cursor"], page_size=3
+    )
+    assert [d.id for d in first["datasets"] + second["datasets"]] == ranking
+    assert second["next_cursor"] is None
+
+
+def test_search_index_follows_updates(test_client):
+    dataset = ExploreService().filter({"title": "sample AND 2"})[0]
+    dataset.ds_meta_data.title = "Renamed collection"
+    db.session.commit()
+
+    assert len(ExploreService().filter({"title": "renamed"})) == 1
+    assert len(ExploreService().filter({"title": "sample AND 2"})) == 0
+
+    dataset.ds_meta_data.title = "Sample dataset 2"
+    db.session.commit()
+    assert len(ExploreService().filter({"title": "sample"})) == 4
+
+
+# TEST OF THE KEYSET PAGINATION
+
+
+@pytest.mark.parametrize(
+    "sorting", ["newest", "oldest", "most views", "most downloads", "relevance"]
+)
+def test_filter_page_walks_every_dataset_once(sorting):
+    explore_service = ExploreService()
+    search_criteria = {"title": "sample", "sorting": sorting}
+
+    seen = []
+    cursor = None
+    while True:
+        page = explore_service.filter_page(search_criteria, cursor=cursor, page_size=3)
+        assert page["total"] == 4
+        seen.extend(dataset.id for dataset in page["datasets"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert len(seen) == 4
+    assert sorted(seen) == sorted(d.id for d in explore_service.filter(search_criteria))
+
+
+def test_filter_page_keeps_newest_order():
+    explore_service = ExploreService()
+    first = explore_service.filter_page({"sorting": "newest"}, page_size=2)
+    second = explore_service.filter_page(
+        {"sorting": "newest"}, cursor=first["next_cursor"], page_size=2
+    )
+
+    datasets = first["datasets"] + second["datasets"]
+    assert [d.id for d in datasets] == [
+        d.id for d in sorted(datasets, key=lambda d: (d.created_at, d.id), reverse=True)
+    ]
+    assert second["next_cursor"] is None
+
+
+def test_filter_page_rejects_foreign_cursor():
+    explore_service = ExploreService()
+    page = explore_service.filter_page({"sorting": "newest"}, page_size=1)
+
+    with pytest.raises(InvalidCursorError):
+        explore_service.filter_page({"sorting": "oldest"}, cursor=page["next_cursor"])
+    with pytest.raises(InvalidCursorError):
+        explore_service.filter_page({"sorting": "oldest"}, cursor="not-a-cursor")
+
+
+def test_explore_post_returns_page(test_client):
+    response = test_client.post(
+        "/explore", json={"title": "sample", "sorting": "newest", "page_size": 3}
+    )
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data["total"] == 4
+    assert len(data["datasets"]) == 3
+    assert data["next_cursor"] is not None
+
+    response = test_client.post(
+        "/explore", json={"sorting": "oldest", "cursor": data["next_cursor"]}
+    )
+    assert response.status_code == 400
+
+
+# TEST OF THE VIEW AND DOWNLOAD COUNTERS
+
+
+def test_sort_by_most_views_uses_counters():
+    dataset = ExploreService().filter({"title": "sample AND 4"})[0]
+    for i in range(2):
+        DSViewRecordRepository().create(
+            dataset_id=dataset.id, view_date=datetime.now(timezone.utc), view_cookie=f"cookie{i}"
+        )
+    db.session.refresh(dataset)
+
+    assert dataset.view_count == 2
+    result = ExploreService().filter({"sorting": "most views"})
+    assert result[0].id == dataset.id
+
+
+def test_reconcile_counters_rebuilds_from_records():
+    dataset = ExploreService().filter({"title": "sample AND 1"})[0]
+    db.session.add(
+        DSDownloadRecord(
+            dataset_id=dataset.id,
+            download_date=datetime.now(timezone.utc),
+            download_cookie="cookie",
+        )
+    )
+    dataset.view_count = 42
+    db.session.commit()
+
+    DataSetRepository().reconcile_counters()
+    db.session.refresh(dataset)
+
+    assert dataset.download_count == 1
+    assert dataset.view_count == DSViewRecord.query.filter_by(dataset_id=dataset.id).count()
+    assert ExploreService().filter({"sorting": "most downloads"})[0].id == dataset.id
+
+
+# TEST OF THE NORMALIZED TAGS
+
+
+def test_parse_tags():
+    assert parse_tags(" Tag1,  tag2 ,, TAG1, two  words") == ["tag1", "tag2", "two words"]
+
+
+def test_filter_by_tag_is_exact():
+    assert len(ExploreService().filter({"tags_str": "TAG2"})) == 4
+    assert len(ExploreService().filter({"tags_str": "tag"})) == 0
+    assert len(ExploreService().filter({"tags_str": "tag10"})) == 0
+
+
+def test_filter_by_tag_prefix():
+    assert len(ExploreService().filter({"tags_str": "ta*"})) == 4
+    assert len(ExploreService().filter({"tags_str": "x*, tag1"})) == 4
+    # A bare "*" filters nothing, and wildcards typed by the user are literal
+    assert len(ExploreService().filter({"tags_str": "*"})) == len(ExploreService().filter({}))
+    assert len(ExploreService().filter({"tags_str": "%*"})) == 0
+    assert len(ExploreService().filter({"tags_str": "t_g*"})) == 0
+
+
+def test_tags_follow_metadata_updates():
+    dataset = ExploreService().filter({"title": "sample AND 2"})[0]
+    dataset.ds_meta_data.tags = "tag1, tag10"
+    db.session.commit()
+
+    assert [d.id for d in ExploreService().filter({"tags_str": "tag10"})] == [dataset.id]
+    assert len(ExploreService().filter({"tags_str": "tag2"})) == 3
+
+    dataset.ds_meta_data.tags = "tag1, tag2"
+    db.session.commit()
+    assert len(ExploreService().filter({"tags_str": "tag2"})) == 4
+
+
+def test_tag_facets_endpoint(test_client):
+    response = test_client.get("/explore/tags")
+    assert response.status_code == 200
+    facets = {facet["name"]: facet["count"] for facet in response.get_json()}
+    assert facets["tag1"] == 4
+    assert facets["tag2"] == 4
+
+    response = test_client.get("/explore/tags?prefix=TAG2")
+    assert response.get_json() == [{"name": "tag2", "count": 4}]
+
+
+def test_recount_authors_rebuilds_author_count():
+    dataset = ExploreService().filter({"title": "sample AND 2"})[0]
+    dataset.ds_meta_data.author_count = 0
+    db.session.commit()
+    assert len(ExploreService().filter({"num_authors": "1"})) == 3
+
+    assert DSMetaDataRepository().recount_authors() == 4
+    db.session.expire_all()
+    assert dataset.ds_meta_data.author_count == 1
+    assert len(ExploreService().filter({"num_authors": "1"})) == 4
+
+
+# TEST OF THE EXPLORE CACHE
+
+
+def test_cache_key_is_normalized():
+    def key(criteria, *extra):
+        return make_key(normalize_criteria(criteria), *extra)
+
+    assert key({"title": "Sámple, MODEL!"}) == key({"title": "sample model"})
+    assert key({"title": "sample AND model uvl"}) != key({"title": "sample model uvl"})
+    assert key({"tags_str": "tag2, Tag1"}) == key({"tags_str": "tag1,tag2"})
+    assert key({"title": "sample"}) != key({"title": "sample"}, "cursor")
+    criteria = normalize_criteria({"title": "Sámple AND model uvl", "author_name": " Author  1 ", "min_features": "3"})
+    assert normalize_criteria(criteria) == criteria
+
+
+def test_searches_sharing_a_cache_key_find_the_same_datasets():
+    # Each pair shares a key, and so must its results
+    pairs = [
+        ({"publication_type": "Book"}, {"publication_type": "book"}),
+        ({"author_name": " "}, {}),
+        ({"author_name": "AUTHOR   1"}, {"author_name": "author 1"}),
+    ]
+    for first, second in pairs:
+        assert make_key(normalize_criteria(first)) == make_key(normalize_criteria(second))
+        assert [d.id for d in ExploreService().filter(first)] == [d.id for d in ExploreService().filter(second)]
+    assert ExploreService().filter({"author_name": " "})
+    assert ExploreService().filter({"author_name": "AUTHOR   1"})
+    assert not ExploreService().filter({"publication_type": "Book"})
+
+
+def test_cache_expires_and_evicts_least_recently_used(test_client):
+    now = [0]
+    cache = ExploreCache(ttl=10, maxsize=2, clock=lambda: now[0])
+    assert cache.get("a") is None
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+    now[0] = 10
+    assert cache.get("a") is None
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"]) == (2, 3, 1)
+
+
+def test_explore_post_is_cached_until_a_dataset_changes(test_client):
+    explore_cache.clear()
+    criteria = {"title": "sample", "sorting": "newest"}
+
+    assert test_client.post("/explore", json=criteria).get_json()["total"] == 4
+    assert test_client.post("/explore", json={**criteria, "title": "SAMPLE!"}).get_json()["total"] == 4
+    assert explore_cache.stats()["hits"] == 1
+
+    dataset = ExploreService().filter({"title": "sample AND 2"})[0]
+    dataset.ds_meta_data.title = "Renamed collection"
+    db.session.commit()
+    assert test_client.post("/explore", json=criteria).get_json()["total"] == 3
+
+    dataset.ds_meta_data.title = "Sample dataset 2"
+    db.session.commit()
+    assert test_client.post("/explore", json=criteria).get_json()["total"] == 4
+    assert explore_cache.stats()["invalidations"] == 2
+
+
+def test_cache_stats_endpoint(test_client):
+    assert test_client.get("/explore/cache/stats").status_code == 302
+
+    login(test_client, "user1@example.com", "1234")
+    response = test_client.get("/explore/cache/stats")
+    logout(test_client)
+
+    assert response.status_code == 200
+    assert {"hits", "misses", "hit_ratio", "size"} <= set(response.get_json())
@@ -37,7 +37,9 @@ class FMMetaData(db.Model):
     tags = db.Column(db.String(120))
     uvl_version = db.Column(db.String(120))
     fm_metrics_id = db.Column(db.Integer, db.ForeignKey("fm_metrics.id"))
-    fm_metrics = db.relationship("FMMetrics", uselist=False, backref="fm_meta_data")
+    fm_metrics = db.relationship(
+        "FMMetrics", uselist=False, backref="fm_meta_data", cascade="all, delete"
+    )
     authors = db.relationship(
         "Author",
         backref="fm_metadata",
@@ -54,6 +56,24 @@ class FMMetrics(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     solver = db.Column(db.Text)
     not_solver = db.Column(db.Text)
+    # Computed from the UVL file whose content has this checksum, see app.modules.flamapy.metrics
+    checksum = db.Column(db.String(120))
+    number_of_features = db.Column(db.Integer)
+    number_of_constraints = db.Column(db.Integer)
+    tree_depth = db.Column(db.Integer)
+    # Share of the features that appear in a cross-tree constraint
+    ctc_ratio = db.Column(db.Float)
+    # Why the metrics could not be computed, if they could not
+    error = db.Column(db.Text)
+    computed_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {
+            "number_of_features": self.number_of_features,
+            "number_of_constraints": self.number_of_constraints,
+            "tree_depth": self.tree_depth,
+            "ctc_ratio": self.ctc_ratio,
+        }
 
     def __repr__(self):
         return f"FMMetrics<solver={self.solver}, not_solver={self.not_solver}>"
@@ -1,5 +1,5 @@
-from sqlalchemy import func
-from app.modules.featuremodel.models import FMMetaData, FeatureModel
+from sqlalchemy import func, update
+from app.modules.featuremodel.models import FMMetaData, FMMetrics, FeatureModel
 from core.repositories.BaseRepository import BaseRepository
 
 
@@ -11,7 +11,19 @@ class FeatureModelRepository(BaseRepository):
         max_id = self.model.query.with_entities(func.max(self.model.id)).scalar()
         return max_id if max_id is not None else 0
 
+    def set_uvl_valid(self, results: dict[int, bool]):
+        """Writes the uvl_valid flag of the given feature models, one statement per value, without committing."""
+        for valid in (True, False):
+            ids = [feature_model_id for feature_model_id, value in results.items() if value is valid]
+            if ids:
+                self.session.execute(update(self.model).where(self.model.id.in_(ids)).values(uvl_valid=valid))
+
 
 class FMMetaDataRepository(BaseRepository):
     def __init__(self):
         super().__init__(FMMetaData)
+
+
+class FMMetricsRepository(BaseRepository):
+    def __init__(self):
+        super().__init__(FMMetrics)
@@ -0,0 +1,423 @@
+import glob
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from importlib import metadata
+from typing import NamedTuple
+
+from flamapy.core.models.ast import ASTOperation
+from flamapy.metamodels.bdd_metamodel.models import BDDModel
+from flamapy.metamodels.fm_metamodel.models import FeatureModel
+from flask import current_app
+
+from app.modules.flamapy.conversions import ConversionPool, process_models
+from app.modules.flamapy.parsing import slug
+from core.caches.BaseDiskCache import BaseDiskCache
+
+logger = logging.getLogger(__name__)
+
+
+def _bdd_version() -> str:
+    versions = []
+    for package in ("flamapy-fm", "flamapy-bdd", "dd"):
+        try:
+            versions.append(metadata.version(package))
+        except metadata.PackageNotFoundError:
+            versions.append("unknown")
+    return "-".join(versions)
+
+
+# Part of every key, the compiled BDDs and their variable order depend on these
+BDD_VERSION = _bdd_version()
+
+
+class BDDCompilationError(ValueError):
+    """The feature model cannot be compiled to a BDD."""
+
+
+class BDDBudgetExceeded(BDDCompilationError):
+    """Compiling the feature model would take more time or nodes than allowed."""
+
+
+class _Budget:
+    def __init__(self, bdd, max_seconds: float, max_nodes: int):
+        self.bdd = bdd
+        self.deadline = time.monotonic() + max_seconds
+        self.max_seconds = max_seconds
+        self.max_nodes = max_nodes
+
+    def check(self):
+        if time.monotonic() > self.deadline:
+            raise BDDBudgetExceeded(f"Compiling the BDD took more than {self.max_seconds:g} seconds")
+        if len(self.bdd) > self.max_nodes:
+            raise BDDBudgetExceeded(f"The BDD grew beyond {self.max_nodes} nodes")
+
+
+def _cardinality(bdd, children: list, low: int, high: int, budget: _Budget):
+    """Function true when between low and high of the children are selected."""
+    if low <= 0 and high >= len(children):
+        return bdd.true
+    if low == 1 and high >= len(children):
+        result = bdd.false
+        for child in children:
+            result |= child
+        return result
+
+    # counts[k]: exactly k of the children seen so far are selected. When high
+    # is below their number, the last one stands for more than high of them
+    top = min(high + 1, len(children))
+    saturated = top == high + 1
+    counts = [bdd.true] + [bdd.false] * top
+    for child in children:
+        following = [counts[0] & ~child]
+        for k in range(1, top + 1):
+            kept = counts[k] if saturated and k == top else counts[k] & ~child
+            following.append(kept | (counts[k - 1] & child))
+        counts = following
+        budget.check()
+
+    result = bdd.false
+    for k in range(max(low, 0), min(high, len(children)) + 1):
+        result |= counts[k]
+    return result
+
+
+BINARY_OPERATIONS = {
+    ASTOperation.AND,
+    ASTOperation.OR,
+    ASTOperation.IMPLIES,
+    ASTOperation.REQUIRES,
+    ASTOperation.EXCLUDES,
+    ASTOperation.EQUIVALENCE,
+    ASTOperation.XOR,
+}
+
+
+def _constraint(bdd, node, variables: dict):
+    if not node.is_op():
+        if node.data not in variables:
+            raise BDDCompilationError(f"A constraint refers to the undeclared feature {node.data}")
+        return variables[node.data]
+
+    operation = node.data
+    if operation == ASTOperation.NOT:
+        return ~_constraint(bdd, node.left, variables)
+    if operation not in BINARY_OPERATIONS:
+        # Arithmetic and attribute constraints have no boolean encoding
+        raise BDDCompilationError(f"Constraints using {operation.value} cannot be compiled to a BDD")
+
+    left = _constraint(bdd, node.left, variables)
+    right = _constraint(bdd, node.right, variables)
+    if operation == ASTOperation.AND:
+        return left & right
+    if operation == ASTOperation.OR:
+        return left | right
+    if operation in (ASTOperation.IMPLIES, ASTOperation.REQUIRES):
+        return ~left | right
+    if operation == ASTOperation.EXCLUDES:
+        return ~(left & right)
+    if operation == ASTOperation.EQUIVALENCE:
+        return left.equiv(right)
+    return ~left.equiv(right)
+
+
+def compile_bdd(model: FeatureModel, max_seconds: float, max_nodes: int) -> BDDModel:
+    """
+    BDD of the configurations of a feature model, built one relation and one
+    constraint at a time so the budget is checked between the operations:
+    past max_seconds, or max_nodes nodes, BDDBudgetExceeded is raised. A
+    single operation can run past the budget, BDDCache runs this in
+    compile_pool to stop it anyway.
+
+    flamapy's FmToBDD parses a single formula instead, which rejects quoted
+    feature names and cannot be interrupted.
+    """
+    if model.root is None:
+        raise BDDCompilationError("The feature model has no root feature")
+
+    bdd_model = BDDModel()
+    bdd = bdd_model.bdd
+    budget = _Budget(bdd, max_seconds, max_nodes)
+
+    # Declared depth first, related features end up close in the variable order
+    features = []
+    stack = [model.root]
+    while stack:
+        feature = stack.pop()
+        features.append(feature)
+        stack.extend(reversed(feature.get_children()))
+    bdd.declare(*(feature.name for feature in features))
+    variables = {feature.name: bdd.var(feature.name) for feature in features}
+
+    root = variables[model.root.name]
+    for feature in features:
+        for relation in feature.get_relations():
+            children = [variables[child.name] for child in relation.children]
+            parent = variables[relation.parent.name]
+            for child in children:
+                root &= ~child | parent
+            high = relation.card_max if relation.card_max >= 0 else len(children)
+            root &= ~parent | _cardinality(bdd, children, relation.card_min, high, budget)
+            budget.check()
+
+    for constraint in model.get_constraints():
+        root &= _constraint(bdd, constraint.ast.root, variables)
+        budget.check()
+
+    bdd_model.root = root
+    return bdd_model
+
+
+def _level(bdd, node, nvars: int) -> int:
+    return nvars if node == bdd.true or node == bdd.false else node.level
+
+
+def _assignments_below(bdd, function, nvars: int) -> dict:
+    """
+    Satisfying assignments of the variables from its level down, of every
+    regular node reachable from function, by node. A complemented node has
+    the rest of them. Iterative, in post order.
+    """
+    counts = {}
+    stack = [function]
+    while stack:
+        node = stack[-1]
+        regular = ~node if node.negated else node
+        if regular == bdd.true or int(regular) in counts:
+            stack.pop()
+            continue
+        _, low, high = bdd.succ(regular)
+        pending = [child for child in (low, high) if _count(bdd, child, counts, nvars) is None]
+        if pending:
+            stack.extend(pending)
+            continue
+        stack.pop()
+        counts[int(regular)] = sum(
+            _count(bdd, child, counts, nvars) * 2 ** (_level(bdd, child, nvars) - regular.level - 1)
+            for child in (low, high)
+        )
+    return counts
+
+
+def _count(bdd, node, counts: dict, nvars: int):
+    if node == bdd.false:
+        return 0
+    if node == bdd.true:
+        return 1
+    if node.negated:
+        below = counts.get(int(~node))
+        return None if below is None else 2 ** (nvars - node.level) - below
+    return counts.get(int(node))
+
+
+class FeatureCounts(NamedTuple):
+    configurations: int
+    # Configurations each feature is selected in
+    features: dict
+
+    def core_features(self) -> list[str]:
+        if not self.configurations:
+            return []
+        return sorted(name for name, count in self.features.items() if count == self.configurations)
+
+    def dead_features(self) -> list[str]:
+        return sorted(name for name, count in self.features.items() if count == 0)
+
+    def commonality(self) -> dict[str, float]:
+        if not self.configurations:
+            return {name: 0.0 for name in self.features}
+        return {name: count / self.configurations for name, count in sorted(self.features.items())}
+
+
+def feature_counts(bdd_model: BDDModel) -> FeatureCounts:
+    """
+    Configurations of the model and those each feature is selected in, in a
+    single pass over the BDD instead of a count per feature: the assignments
+    of the variables above each node leading to it are counted top down, and
+    multiplied by the assignments below its high child. An edge skipping the
+    level of a feature leaves it free, half of the assignments through it
+    select the feature.
+    """
+    bdd, root = bdd_model.bdd, bdd_model.root
+    nvars = len(bdd_model.variables)
+    counts = _assignments_below(bdd, root, nvars)
+
+    selected = [0] * (nvars + 1)
+    # Difference array of the assignments selecting the variables skipped by an edge
+    skipped = [0] * (nvars + 1)
+
+    # Assignments above leading to each function, a node and its complement apart
+    above = {}
+    heap = []
+
+    def follow(count: int, level: int, child):
+        # Edge from the given level, -1 from the top, down to child
+        child_level = _level(bdd, child, nvars)
+        count *= 2 ** (child_level - level - 1)
+        if child_level > level + 1:
+            through = count * _count(bdd, child, counts, nvars)
+            skipped[level + 1] += through // 2
+            skipped[child_level] -= through // 2
+        if child == bdd.true or child == bdd.false:
+            return
+        key = (int(~child if child.negated else child), child.negated)
+        if key not in above:
+            above[key] = [0, child]
+            heapq.heappush(heap, (child_level, key))
+        above[key][0] += count
+
+    follow(1, -1, root)
+    # By increasing level, every edge into a node is followed before it is visited
+    while heap:
+        level, key = heapq.heappop(heap)
+        count, node = above.pop(key)
+        _, low, high = bdd.succ(node)
+        if node.negated:
+            low, high = ~low, ~high
+        selected[level] += count * _count(bdd, high, counts, nvars) * 2 ** (_level(bdd, high, nvars) - level - 1)
+        follow(count, level, low)
+        follow(count, level, high)
+
+    free = 0
+    for level in range(nvars):
+        free += skipped[level]
+        selected[level] += free
+    return FeatureCounts(
+        configurations=_count(bdd, root, counts, nvars) * 2 ** _level(bdd, root, nvars),
+        features={name: selected[bdd.level_of_var(name)] for name in bdd_model.variables},
+    )
+
+
+# Processes compiling the BDDs, apart from the conversions so that stopping a
+# compilation past its time never takes the conversions of a download with it
+compile_pool = ConversionPool()
+
+
+def _compile_in_pool(source: str, checksum: str, path: str, max_seconds: float, max_nodes: int):
+    # A BDD cannot be pickled back, it is written to path instead
+    bdd_model = compile_bdd(process_models().load(source, checksum), max_seconds, max_nodes)
+    bdd_model.bdd.dump(path, [bdd_model.root], filetype="json")
+
+
+class BDDCache(BaseDiskCache):
+    """
+    Feature models compiled to BDDs, so each UVL file is compiled once per
+    checksum and every analysis is answered from its BDD.
+
+    The BDDs are kept as JSON in the cache folder, shared by the workers and
+    evicted least recently used first, along with the stored failures, above
+    BDD_CACHE_MAX_BYTES. The counts the analyses derive from them are kept in
+    memory for the most recent BDD_MEMORY_CACHE_SIZE files.
+
+    Compiling runs in compile_pool, and stops past BDD_COMPILE_TIMEOUT seconds
+    or BDD_MAX_NODES nodes. The failure is stored with the budget it had, so
+    that the model is only compiled again once the budget is raised or the
+    file is edited.
+    """
+
+    folder = "bdds"
+    max_bytes_setting = "BDD_CACHE_MAX_BYTES"
+    suffixes = (".json", ".failed")
+
+    def __init__(self, directory=None, max_bytes=None):
+        super().__init__(directory, max_bytes)
+        self._counts = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(checksum: str) -> str:
+        return f"{slug(checksum)}_{slug(BDD_VERSION)}"
+
+    def path(self, checksum: str) -> str:
+        return os.path.join(self.directory, f"{self.make_key(checksum)}.json")
+
+    def failure_path(self, checksum: str) -> str:
+        return os.path.join(self.directory, f"{self.make_key(checksum)}.failed")
+
+    def counts(self, source: str, checksum: str) -> FeatureCounts:
+        """Configuration counts of the UVL file at source, from its BDD, compiled first unless cached."""
+        key = self.make_key(checksum)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is not None:
+                self._counts.move_to_end(key)
+                return counts
+
+        counts = feature_counts(self.load(source, checksum))
+        with self._lock:
+            self._counts[key] = counts
+            while len(self._counts) > current_app.config["BDD_MEMORY_CACHE_SIZE"]:
+                self._counts.popitem(last=False)
+        return counts
+
+    def load(self, source: str, checksum: str) -> BDDModel:
+        path = self.path(checksum)
+        try:
+            bdd_model = BDDModel()
+            bdd_model.root = bdd_model.bdd.load(path)[0]
+            # The modification time doubles as the last use for the LRU eviction
+            os.utime(path)
+            return bdd_model
+        except FileNotFoundError:
+            pass
+        except Exception:
+            logger.warning("Could not load the cached BDD of %s, compiling it again", checksum)
+
+        max_seconds = current_app.config["BDD_COMPILE_TIMEOUT"]
+        max_nodes = current_app.config["BDD_MAX_NODES"]
+        self._raise_stored_failure(checksum, max_seconds, max_nodes)
+        try:
+            self._write(path, lambda partial: self._compile(source, checksum, partial, max_seconds, max_nodes))
+        except BDDBudgetExceeded as e:
+            failure = {"error": str(e), "max_seconds": max_seconds, "max_nodes": max_nodes}
+            self._write(self.failure_path(checksum), lambda partial: self._dump_json(partial, failure))
+            raise
+
+        bdd_model = BDDModel()
+        bdd_model.root = bdd_model.bdd.load(path)[0]
+        return bdd_model
+
+    def invalidate(self, checksum: str):
+        key = self.make_key(checksum)
+        with self._lock:
+            self._counts.pop(key, None)
+        for path in glob.glob(os.path.join(self.directory, f"{glob.escape(slug(checksum))}_*")):
+            self._remove(path)
+
+    @staticmethod
+    def _compile(source: str, checksum: str, path: str, max_seconds: float, max_nodes: int):
+        """
+        Compiles the UVL file at source to a BDD written to path, killed past
+        max_seconds. Only then is it over budget: waiting for a free process,
+        or a process killed by another compilation, is left to the caller.
+        """
+        try:
+            compile_pool.run(
+                _compile_in_pool, os.path.abspath(source), checksum, path, max_seconds, max_nodes, timeout=max_seconds
+            )
+        except TimeoutError:
+            raise BDDBudgetExceeded(f"Compiling the BDD took more than {max_seconds:g} seconds") from None
+
+    def _raise_stored_failure(self, checksum: str, max_seconds: float, max_nodes: int):
+        try:
+            with open(self.failure_path(checksum), "r", encoding="utf8") as file:
+                failure = json.load(file)
+                # Evicted like the BDDs, least recently used first
+                os.utime(file.fileno())
+        except (OSError, ValueError):
+            return
+        # A larger budget than the one that failed gets its own attempt
+        if max_seconds <= failure["max_seconds"] and max_nodes <= failure["max_nodes"]:
+            raise BDDBudgetExceeded(failure["error"])
+
+    @staticmethod
+    def _dump_json(path: str, data: dict):
+        with open(path, "w", encoding="utf8") as file:
+            json.dump(data, file)
+
+
+bdd_cache = BDDCache()
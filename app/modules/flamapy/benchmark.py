@@ -0,0 +1,98 @@
+import glob
+import os
+import random
+import time
+from typing import NamedTuple
+
+from antlr4 import InputStream
+
+from app.modules.flamapy.validation import validate_uvl_ll, validate_uvl_stream
+
+UVL_EXAMPLES = os.path.join(os.path.dirname(os.path.dirname(__file__)), "dataset", "uvl_examples")
+
+
+class BenchmarkResult(NamedTuple):
+    name: str
+    lines: int
+    valid: bool
+    ll_seconds: float
+    two_stage_seconds: float
+
+    @property
+    def speedup(self) -> float:
+        return self.ll_seconds / self.two_stage_seconds if self.two_stage_seconds else 0.0
+
+
+def synthetic_uvl(features: int, constraints: int = 0, seed: int = 0, broken: bool = False) -> str:
+    """
+    A feature model with about the given number of features, nested in
+    mandatory, optional, or and alternative groups, followed by random
+    constraints between them. A broken model has a syntax error near its end.
+    """
+    generator = random.Random(seed)
+    lines = ["features", "    F0"]
+    names = ["F0"]
+
+    def add_children(depth: int, budget: int):
+        # Depth-first, the lines of a subtree must follow its root
+        while budget > 0:
+            group = generator.choice(["mandatory", "optional", "or", "alternative"])
+            lines.append("    " * (depth + 1) + group)
+            children = min(generator.randint(2, 5), budget)
+            budget -= children
+            for child in range(children):
+                name = f"F{len(names)}"
+                names.append(name)
+                lines.append("    " * (depth + 2) + name)
+                subtree = generator.randint(0, budget // (children - child)) if depth < 12 else 0
+                add_children(depth + 2, subtree)
+                budget -= subtree
+
+    add_children(1, features - 1)
+
+    if constraints:
+        lines.append("")
+        lines.append("constraints")
+        operators = ["=>", "&", "|", "<=>"]
+        for _ in range(constraints):
+            left, right = generator.sample(names, 2)
+            lines.append(f"    {left} {generator.choice(operators)} {right}")
+
+    if broken:
+        lines.insert(len(lines) - 1, "    ) broken (")
+    return "\n".join(lines) + "\n"
+
+
+def _time(validate, text: str, repeat: int) -> tuple[float, list[str]]:
+    best, errors = float("inf"), []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        errors = validate(InputStream(text))
+        best = min(best, time.perf_counter() - start)
+    return best, errors
+
+
+def benchmark_validation(features=(1000, 5000), repeat: int = 3) -> list[BenchmarkResult]:
+    """
+    Times the two-stage validation against a single full LL parse, the best
+    of repeat runs each, over the UVL examples and synthetic models of the
+    given sizes, valid and broken. Both must report errors at the same positions.
+    """
+    samples = []
+    for path in sorted(glob.glob(os.path.join(UVL_EXAMPLES, "*.uvl"))):
+        with open(path, "r", encoding="utf-8") as file:
+            samples.append((os.path.basename(path), file.read()))
+    for size in features:
+        for broken in (False, True):
+            text = synthetic_uvl(size, constraints=size // 10, seed=size, broken=broken)
+            samples.append((f"synthetic_{size}{'_broken' if broken else ''}", text))
+
+    results = []
+    for name, text in samples:
+        ll_seconds, ll_errors = _time(validate_uvl_ll, text, repeat)
+        two_stage_seconds, errors = _time(validate_uvl_stream, text, repeat)
+        # Only the positions, the expected tokens ANTLR lists can differ between a cold and a warm parser
+        if [error.split(" - ")[0] for error in errors] != [error.split(" - ")[0] for error in ll_errors]:
+            raise AssertionError(f"The two-stage validation of {name} reported different errors")
+        results.append(BenchmarkResult(name, text.count("\n"), not errors, ll_seconds, two_stage_seconds))
+    return results
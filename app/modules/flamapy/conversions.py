@@ -0,0 +1,286 @@
+import glob
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Iterator, NamedTuple, Optional
+
+from flamapy.metamodels.fm_metamodel.models import FeatureModel
+from flamapy.metamodels.fm_metamodel.transformations import GlencoeWriter, SPLOTWriter
+from flamapy.metamodels.pysat_metamodel.transformations import DimacsWriter, FmToPysat
+from flask import current_app
+
+from app.modules.flamapy.parsing import FLAMAPY_VERSION, FeatureModelCache, feature_model_cache, slug
+from core.caches.BaseDiskCache import BaseDiskCache
+
+logger = logging.getLogger(__name__)
+
+
+def serialize_glencoe(model: FeatureModel) -> str:
+    # Without a path the writers only return what they would have written
+    return GlencoeWriter(None, model).transform()
+
+
+def serialize_dimacs(model: FeatureModel) -> str:
+    return DimacsWriter(None, FmToPysat(model).transform()).transform()
+
+
+def serialize_splot(model: FeatureModel) -> str:
+    return SPLOTWriter(None, model).transform()
+
+
+class ConversionFormat(NamedTuple):
+    extension: str
+    serialize: Callable[[FeatureModel], str]
+
+
+FORMATS = {
+    "glencoe": ConversionFormat(".json", serialize_glencoe),
+    "dimacs": ConversionFormat(".cnf", serialize_dimacs),
+    "splot": ConversionFormat(".splx", serialize_splot),
+}
+
+
+class ConversionCache(BaseDiskCache):
+    """
+    UVL files converted to the other formats, kept on disk in the cache folder
+    so that the workers share them and a file is only written once. The
+    writers start from the parsed model of feature_model_cache.
+
+    Entries are named after the checksum of the UVL file, the format and the
+    flamapy version, so an edited file or an upgraded flamapy simply misses.
+    The least recently used entries are evicted once the folder exceeds
+    CONVERSION_CACHE_MAX_BYTES.
+    """
+
+    folder = "conversions"
+    max_bytes_setting = "CONVERSION_CACHE_MAX_BYTES"
+    suffixes = tuple(conversion.extension for conversion in FORMATS.values())
+
+    def __init__(self, directory=None, max_bytes=None, models=None):
+        super().__init__(directory, max_bytes)
+        self.models = models or feature_model_cache
+
+    @staticmethod
+    def make_key(checksum: str, format: str) -> str:
+        return f"{slug(checksum)}_{format}_{slug(FLAMAPY_VERSION)}"
+
+    def path(self, checksum: str, format: str) -> str:
+        return os.path.join(self.directory, f"{self.make_key(checksum, format)}{FORMATS[format].extension}")
+
+    def lookup(self, checksum: str, format: str) -> Optional[str]:
+        return self._touch(self.path(checksum, format))
+
+    def convert(self, source: str, checksum: str, format: str) -> str:
+        """Path of the conversion of the UVL file at source, converted first unless cached."""
+        path = self.lookup(checksum, format)
+        if path is not None:
+            return path
+        return self._store(checksum, format, self.serialize(source, checksum, format))
+
+    def read(self, source: str, checksum: str, format: str) -> str:
+        """Content of the conversion of the UVL file at source, converted in memory unless cached."""
+        path = self.lookup(checksum, format)
+        if path is not None:
+            with open(path, "r", encoding="utf8") as file:
+                return file.read()
+
+        content = self.serialize(source, checksum, format)
+        try:
+            self._store(checksum, format, content)
+        except OSError:
+            logger.exception("Could not cache the %s conversion of %s", format, checksum)
+        return content
+
+    def serialize(self, source: str, checksum: str, format: str) -> str:
+        return FORMATS[format].serialize(self.models.load(source, checksum))
+
+    def settings(self) -> dict:
+        """Everything a pool process needs to rebuild this cache outside of the app."""
+        return {
+            "directory": self.directory,
+            "max_bytes": self.max_bytes,
+            "models_directory": self.models.directory,
+            "models_max_bytes": self.models.max_bytes,
+            "models_disk_max_bytes": self.models.disk_max_bytes,
+        }
+
+    def _store(self, checksum: str, format: str, content: str) -> str:
+        path = self.path(checksum, format)
+        self._write(path, lambda partial: self._write_text(partial, content))
+        return path
+
+    @staticmethod
+    def _write_text(path: str, content: str):
+        with open(path, "w", encoding="utf8") as file:
+            file.write(content)
+
+    def invalidate(self, checksum: str):
+        for path in glob.glob(os.path.join(self.directory, f"{glob.escape(slug(checksum))}_*")):
+            self._remove(path)
+
+
+conversion_cache = ConversionCache()
+
+
+# Cache of a pool process, built from the settings of the worker that started it
+_process_cache = None
+
+
+def _start_pool_process(settings: dict):
+    global _process_cache
+    models = FeatureModelCache(
+        settings["models_directory"], settings["models_max_bytes"], settings["models_disk_max_bytes"]
+    )
+    _process_cache = ConversionCache(settings["directory"], settings["max_bytes"], models)
+
+
+def _convert_in_pool(source: str, checksum: str, format: str) -> str:
+    return _process_cache.convert(source, checksum, format)
+
+
+def process_models() -> FeatureModelCache:
+    """Parsed models of the pool process it is called from."""
+    return _process_cache.models
+
+
+class PoolBusyError(RuntimeError):
+    """The call was still waiting for a pool process when it timed out."""
+
+
+class ConversionPool:
+    """
+    Process pool running the conversions of dataset-wide downloads, so that
+    parsing and writing the files uses every core instead of holding the GIL
+    of the request thread. It is shared by all the requests of a worker and
+    bounded to CONVERSION_POOL_SIZE processes, started on first use.
+
+    The processes are forked from the worker: spawning them would import the
+    whole app again in each one. Other CPU-bound work that must be stopped
+    past a deadline goes through run() on a pool of its own.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._slots = None
+        self._slots_pid = None
+
+    def convert(self, files: list[tuple[str, str]], format: str, timeout=None) -> Iterator[tuple]:
+        """
+        Converts the (source, checksum) files and yields (index, path, error)
+        for each one as soon as it is done, those already cached first. Files
+        still converting CONVERSION_TIMEOUT seconds after the call are given
+        up with a timeout error, their conversion lands in the cache anyway.
+        """
+        timeout = current_app.config["CONVERSION_TIMEOUT"] if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+
+        cached, pending = [], {}
+        for index, (source, checksum) in enumerate(files):
+            path = conversion_cache.lookup(checksum, format)
+            if path is not None:
+                cached.append((index, path, None))
+            else:
+                pending[self._submit(os.path.abspath(source), checksum, format)] = index
+        return self._results(cached, pending, deadline)
+
+    def run(self, function: Callable, *args, timeout: float):
+        """
+        Runs function(*args) in a pool process and returns its result. The call
+        waits up to timeout seconds for a free process, PoolBusyError past that,
+        and its timeout only starts once it has one. A call still running after
+        timeout seconds cannot be cancelled: the pool processes are killed,
+        along with whatever else they were running, and TimeoutError is raised.
+
+        Only the calls made through run() take a process, a pool also used by
+        convert() could still queue them.
+        """
+        slots = self._slots_for_process()
+        if not slots.acquire(timeout=timeout):
+            raise PoolBusyError(f"No process was free within {timeout:g} seconds")
+        try:
+            future = self._submit_call(function, *args)
+            try:
+                return future.result(timeout=timeout)
+            except TimeoutError:
+                self.kill()
+                raise
+            except BrokenProcessPool:
+                self.shutdown()
+                raise
+        finally:
+            slots.release()
+
+    def kill(self):
+        """Kills the pool processes, the next call starts a new pool."""
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                # The executor has no public way of stopping a running call
+                for process in list(self._executor._processes.values()):
+                    process.kill()
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = self._pid = None
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = self._pid = None
+
+    def _slots_for_process(self) -> threading.Semaphore:
+        # Outlives a killed pool, the calls that were running release theirs
+        with self._lock:
+            if self._slots is None or self._slots_pid != os.getpid():
+                self._slots = threading.Semaphore(current_app.config["CONVERSION_POOL_SIZE"])
+                self._slots_pid = os.getpid()
+            return self._slots
+
+    def _submit(self, source, checksum, format):
+        return self._submit_call(_convert_in_pool, source, checksum, format)
+
+    def _submit_call(self, function, *args):
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(
+                    max_workers=current_app.config["CONVERSION_POOL_SIZE"],
+                    mp_context=multiprocessing.get_context("fork"),
+                    initializer=_start_pool_process,
+                    initargs=(conversion_cache.settings(),),
+                )
+                self._pid = os.getpid()
+            executor = self._executor
+        try:
+            return executor.submit(function, *args)
+        except BrokenProcessPool:
+            # A pool process died, the next submission starts a new pool
+            self.shutdown()
+            return self._submit_call(function, *args)
+
+    def _results(self, cached, pending, deadline):
+        yield from cached
+        try:
+            for future in as_completed(pending, timeout=max(deadline - time.monotonic(), 0)):
+                index = pending.pop(future)
+                try:
+                    yield index, future.result(), None
+                except BrokenProcessPool as e:
+                    self.shutdown()
+                    yield index, None, f"conversion process died ({e})"
+                except Exception as e:
+                    logger.warning("Could not convert file %d of a download: %s", index, e)
+                    yield index, None, str(e)
+        except TimeoutError:
+            pass
+        finally:
+            for future in pending:
+                future.cancel()
+        for index in pending.values():
+            yield index, None, "conversion timed out"
+
+
+conversion_pool = ConversionPool()
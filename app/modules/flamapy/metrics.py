@@ -0,0 +1,117 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import NamedTuple
+
+from flamapy.metamodels.fm_metamodel.models import FeatureModel
+from flask import current_app
+
+from app import db
+
+logger = logging.getLogger(__name__)
+
+
+class ModelMetrics(NamedTuple):
+    features: int
+    constraints: int
+    # Levels below the root, 0 for a model with a single feature
+    depth: int
+    # Share of the features that appear in a cross-tree constraint
+    ctc_ratio: float
+
+
+def compute_metrics(model: FeatureModel) -> ModelMetrics:
+    names = set()
+    depth = 0
+    # Iterative, deep models would exceed the recursion limit
+    stack = [(model.root, 0)] if model.root is not None else []
+    while stack:
+        feature, level = stack.pop()
+        names.add(feature.name)
+        depth = max(depth, level)
+        stack.extend((child, level + 1) for child in feature.get_children())
+
+    constraints = model.get_constraints()
+    constrained = set()
+    for constraint in constraints:
+        constrained.update(name for name in constraint.get_features() if name in names)
+
+    return ModelMetrics(
+        features=len(names),
+        constraints=len(constraints),
+        depth=depth,
+        ctc_ratio=round(len(constrained) / len(names), 4) if names else 0.0,
+    )
+
+
+class MetricsQueue:
+    """
+    Datasets waiting for the metrics of their feature models.
+
+    Uploads only enqueue the dataset and a background thread of each worker
+    parses its UVL files and stores the metrics, so the request does not
+    wait for ANTLR. With METRICS_BACKGROUND disabled they are computed within
+    the request. Datasets still pending when a worker exits are found and
+    computed by `rosemary metrics:compute`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        # Ordered set, a dataset enqueued twice is computed once
+        self._pending = OrderedDict()
+        self._app = None
+        self._thread = None
+        self._pid = None
+
+    def enqueue(self, dataset_id: int):
+        if not current_app.config["METRICS_BACKGROUND"]:
+            self._compute(dataset_id)
+            return
+
+        with self._lock:
+            self._start(current_app._get_current_object())
+            self._pending[dataset_id] = None
+            self._wakeup.notify()
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def _start(self, app):
+        # Called with the lock held. A forked worker starts its own thread and
+        # drops what the parent had pending, the parent computes it
+        if self._pid != os.getpid():
+            self._pending = OrderedDict()
+            self._pid = os.getpid()
+        elif self._thread is not None and self._thread.is_alive():
+            return
+        self._app = app
+        self._thread = threading.Thread(target=self._run, name="metrics-queue", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._pending:
+                    self._wakeup.wait()
+                dataset_id, _ = self._pending.popitem(last=False)
+            with self._app.app_context():
+                self._compute(dataset_id)
+
+    @staticmethod
+    def _compute(dataset_id: int):
+        from app.modules.dataset.models import DataSet
+        from app.modules.flamapy.services import FlamapyService
+
+        try:
+            dataset = db.session.get(DataSet, dataset_id)
+            if dataset is not None:
+                FlamapyService().compute_dataset_metrics(dataset)
+        except Exception:
+            db.session.rollback()
+            logger.exception("Could not compute the metrics of dataset %s", dataset_id)
+
+
+metrics_queue = MetricsQueue()
@@ -0,0 +1,18 @@
+from datetime import datetime, timezone
+
+from app import db
+
+
+class UVLValidation(db.Model):
+    """Result of the syntax check of a UVL content, by checksum and version of the grammar."""
+
+    __tablename__ = "uvl_validation"
+
+    checksum = db.Column(db.String(120), primary_key=True)
+    grammar_version = db.Column(db.String(32), primary_key=True)
+    valid = db.Column(db.Boolean, nullable=False)
+    errors = db.Column(db.JSON, nullable=False, default=list)
+    validated_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+
+    def __repr__(self):
+        return f"UVLValidation<{self.checksum}, {self.grammar_version}>"
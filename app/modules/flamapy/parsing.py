@@ -0,0 +1,183 @@
+import glob
+import logging
+import os
+import pickle
+import re
+import threading
+from collections import OrderedDict
+from importlib import metadata
+from typing import Optional
+
+from flamapy.metamodels.fm_metamodel.models import FeatureModel
+from flamapy.metamodels.fm_metamodel.transformations import UVLReader
+from flask import current_app
+
+from core.caches.BaseDiskCache import BaseDiskCache
+
+logger = logging.getLogger(__name__)
+
+
+def _flamapy_version() -> str:
+    try:
+        return metadata.version("flamapy-fm")
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+# Part of every key, upgrading flamapy discards what the previous version produced
+FLAMAPY_VERSION = _flamapy_version()
+
+
+def slug(value: str) -> str:
+    return re.sub(r"[^\w.-]", "_", value)
+
+
+class FeatureModelCache(BaseDiskCache):
+    """
+    Feature models parsed from UVL files, so the ANTLR parse of a file runs
+    once per checksum instead of once per conversion or analysis.
+
+    A bounded in-process LRU holds the most recently used models, weighted by
+    the size of their pickle (an approximation of their footprint) up to
+    FEATURE_MODEL_CACHE_MAX_BYTES. Behind it, the pickles are kept in the
+    cache folder so the other workers, and this one after an eviction, load
+    them instead of parsing again. That tier is evicted least recently used
+    first above FEATURE_MODEL_CACHE_DISK_MAX_BYTES.
+
+    The models are shared by every caller, which must not modify them.
+    """
+
+    folder = "feature_models"
+    # Bounds the models in memory, disk_max_bytes the pickles
+    max_bytes_setting = "FEATURE_MODEL_CACHE_MAX_BYTES"
+    suffixes = (".pickle",)
+
+    def __init__(self, directory=None, max_bytes=None, disk_max_bytes=None):
+        super().__init__(directory, max_bytes)
+        self._disk_max_bytes = disk_max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def disk_max_bytes(self) -> int:
+        if self._disk_max_bytes is not None:
+            return self._disk_max_bytes
+        return current_app.config["FEATURE_MODEL_CACHE_DISK_MAX_BYTES"]
+
+    @staticmethod
+    def make_key(checksum: str) -> str:
+        return f"{slug(checksum)}_{slug(FLAMAPY_VERSION)}"
+
+    def path(self, checksum: str) -> str:
+        return os.path.join(self.directory, f"{self.make_key(checksum)}.pickle")
+
+    def load(self, source: str, checksum: str) -> FeatureModel:
+        """Feature model of the UVL file at source, whose content has the given checksum."""
+        key = self.make_key(checksum)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+        model = None
+        data = self._read(checksum)
+        if data is not None:
+            try:
+                model = pickle.loads(data)
+            except Exception:
+                # Truncated, or written by an incompatible version of a dependency
+                logger.warning("Could not load the cached feature model %s, parsing it again", checksum)
+
+        if model is not None:
+            with self._lock:
+                self.disk_hits += 1
+        else:
+            model = UVLReader(source).transform()
+            data = self._store(checksum, model)
+            with self._lock:
+                self.misses += 1
+
+        self._remember(key, model, len(data) if data is not None else os.path.getsize(source))
+        return model
+
+    def invalidate(self, checksum: str):
+        prefix = f"{slug(checksum)}_"
+        with self._lock:
+            for key in [key for key in self._entries if key.startswith(prefix)]:
+                self._size -= self._entries.pop(key)[0]
+
+        for path in glob.glob(os.path.join(self.directory, f"{glob.escape(prefix)}*.pickle")):
+            self._remove(path)
+
+    def evict(self, disk_max_bytes=None):
+        super().evict(self.disk_max_bytes if disk_max_bytes is None else disk_max_bytes)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            self.hits = self.disk_hits = self.misses = self.evictions = 0
+
+    def _remember(self, key: str, model: FeatureModel, size: int):
+        max_bytes = self.max_bytes
+        if size > max_bytes:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= previous[0]
+            self._entries[key] = (size, model)
+            self._size += size
+            while self._size > max_bytes:
+                self._size -= self._entries.popitem(last=False)[1][0]
+                self.evictions += 1
+
+    def _read(self, checksum: str) -> Optional[bytes]:
+        path = self.path(checksum)
+        try:
+            with open(path, "rb") as file:
+                data = file.read()
+        except OSError:
+            return None
+        self._touch(path)
+        return data
+
+    def _store(self, checksum: str, model: FeatureModel) -> Optional[bytes]:
+        try:
+            data = pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, RecursionError):
+            logger.warning("Could not serialize the feature model %s", checksum)
+            return None
+
+        self._write(self.path(checksum), lambda partial: self._write_bytes(partial, data))
+        return data
+
+    @staticmethod
+    def _write_bytes(path: str, data: bytes):
+        with open(path, "wb") as file:
+            file.write(data)
+
+
+feature_model_cache = FeatureModelCache()
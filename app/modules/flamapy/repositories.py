@@ -1,7 +1,29 @@
-from app.modules.flamapy.models import Flamapy
+from sqlalchemy import insert
+
+from app.modules.flamapy.models import UVLValidation
+from app.modules.hubfile.models import Hubfile
 from core.repositories.BaseRepository import BaseRepository
 
 
 class FlamapyRepository(BaseRepository):
     def __init__(self):
-        super().__init__(Flamapy)
+        super().__init__(Hubfile)
+
+
+class UVLValidationRepository(BaseRepository):
+    def __init__(self):
+        super().__init__(UVLValidation)
+
+    def get_results(self, checksums, grammar_version: str) -> dict[str, UVLValidation]:
+        if not checksums:
+            return {}
+        results = self.model.query.filter(
+            self.model.checksum.in_(set(checksums)),
+            self.model.grammar_version == grammar_version,
+        )
+        return {result.checksum: result for result in results}
+
+    def add_results(self, rows: list[dict]):
+        """Inserts the results of new validations in a single statement, without committing."""
+        if rows:
+            self.session.execute(insert(self.model), rows)
@@ -1,7 +1,237 @@
-from app.modules.flamapy.repositories import FlamapyRepository
+import os
+from datetime import datetime, timezone
+from typing import Iterator, Optional
+
+from sqlalchemy.exc import IntegrityError
+
+from app.modules.dataset.models import DataSet, DSMetrics
+from app.modules.dataset.repositories import DataSetRepository, DSMetricsRepository
+from app.modules.explore.cache import explore_cache
+from app.modules.featuremodel.models import FMMetrics
+from app.modules.featuremodel.repositories import FeatureModelRepository, FMMetricsRepository
+from app.modules.flamapy.bdd import BDD_VERSION, bdd_cache
+from app.modules.flamapy.conversions import FORMATS, conversion_cache, conversion_pool
+from app.modules.flamapy.metrics import compute_metrics
+from app.modules.flamapy.parsing import feature_model_cache
+from app.modules.flamapy.repositories import FlamapyRepository, UVLValidationRepository
+from app.modules.flamapy.validation import GRAMMAR_VERSION, validate_uvl
+from app.modules.hubfile.models import Hubfile
 from core.services.BaseService import BaseService
 
+# Report added to a dataset download when some of its files could not be converted
+CONVERSION_ERRORS_NAME = "conversion_errors.txt"
+
+ANALYSES = ("configurations", "core_features", "dead_features", "commonality")
+
 
 class FlamapyService(BaseService):
     def __init__(self):
         super().__init__(FlamapyRepository())
+        self.validation_repository = UVLValidationRepository()
+        self.feature_model_repository = FeatureModelRepository()
+        self.fm_metrics_repository = FMMetricsRepository()
+        self.ds_metrics_repository = DSMetricsRepository()
+
+    def validate_dataset(self, dataset: DataSet) -> dict[int, dict]:
+        return self.validate_hubfiles(dataset.files())
+
+    def validate_hubfiles(self, hubfiles: list[Hubfile]) -> dict[int, dict]:
+        """
+        Syntax check of the given files, as {file_id: {"valid", "errors"}}.
+
+        Each content is only validated once per grammar version: the stored
+        results are looked up in a single query and only the new ones are
+        parsed. Nothing is written unless a new result is stored or the
+        uvl_valid flag of a feature model actually changes.
+        """
+        stored = self.validation_repository.get_results([hubfile.checksum for hubfile in hubfiles], GRAMMAR_VERSION)
+        results, new_results = {}, []
+        reports = {}
+        for hubfile in hubfiles:
+            result = results.get(hubfile.checksum)
+            if result is None and hubfile.checksum in stored:
+                result = {"valid": stored[hubfile.checksum].valid, "errors": stored[hubfile.checksum].errors}
+            if result is None:
+                try:
+                    errors = validate_uvl(hubfile.get_path())
+                except OSError as e:
+                    # Neither stored nor reflected on the feature model, the file may come back
+                    reports[hubfile.id] = {"valid": False, "errors": [f"The UVL file could not be read: {e}"]}
+                    continue
+                result = {"valid": not errors, "errors": errors}
+                new_results.append(
+                    {
+                        "checksum": hubfile.checksum,
+                        "grammar_version": GRAMMAR_VERSION,
+                        "validated_at": datetime.now(timezone.utc),
+                        **result,
+                    }
+                )
+            results[hubfile.checksum] = reports[hubfile.id] = result
+
+        # A feature model is valid when all its checked files are
+        feature_models = {}
+        for hubfile in hubfiles:
+            if hubfile.checksum in results:
+                valid = results[hubfile.checksum]["valid"]
+                feature_models[hubfile.feature_model] = feature_models.get(hubfile.feature_model, True) and valid
+        changed = {
+            feature_model.id: valid
+            for feature_model, valid in feature_models.items()
+            if feature_model.uvl_valid is not valid
+        }
+
+        if new_results or changed:
+            self.validation_repository.add_results(new_results)
+            self.feature_model_repository.set_uvl_valid(changed)
+            try:
+                self.repository.session.commit()
+            except IntegrityError:
+                # Another worker stored the same results meanwhile, they are identical
+                self.repository.session.rollback()
+                self.feature_model_repository.set_uvl_valid(changed)
+                self.repository.session.commit()
+            if changed:
+                # Searches filtering on valid models may have cached the previous flags
+                explore_cache.invalidate()
+        return reports
+
+    def compute_missing_metrics(self, force: bool = False) -> int:
+        """Computes the metrics of the datasets missing them, or of every dataset when forced."""
+        dataset_repository = DataSetRepository()
+        if force:
+            query = dataset_repository.model.query.with_entities(DataSet.id).order_by(DataSet.id)
+            dataset_ids = [dataset_id for (dataset_id,) in query]
+        else:
+            dataset_ids = dataset_repository.get_ids_without_metrics()
+        for dataset_id in dataset_ids:
+            self.compute_dataset_metrics(self.repository.session.get(DataSet, dataset_id), force=force)
+        return len(dataset_ids)
+
+    def compute_dataset_metrics(self, dataset: DataSet, force: bool = False) -> DSMetrics:
+        """
+        Stores the metrics of every feature model of the dataset in FMMetrics,
+        and their totals in DSMetrics, so that pages and explore read them
+        instead of parsing. Each UVL file is parsed once, through the feature
+        model cache, and only when its checksum differs from the one the
+        stored metrics were computed from.
+        """
+        now = datetime.now(timezone.utc)
+        computed = []
+        for feature_model in dataset.feature_models:
+            fm_meta_data = feature_model.fm_meta_data
+            hubfile = next((file for file in feature_model.files if file.name.endswith(".uvl")), None)
+            if fm_meta_data is None or hubfile is None:
+                continue
+
+            fm_metrics = fm_meta_data.fm_metrics
+            if fm_metrics is None:
+                fm_metrics = fm_meta_data.fm_metrics = self.fm_metrics_repository.create(commit=False)
+            if force or fm_metrics.checksum != hubfile.checksum or fm_metrics.computed_at is None:
+                self._set_fm_metrics(fm_metrics, hubfile)
+                fm_metrics.computed_at = now
+            if fm_metrics.error is None:
+                computed.append(fm_metrics)
+
+        ds_meta_data = dataset.ds_meta_data
+        ds_metrics = ds_meta_data.ds_metrics
+        if ds_metrics is None:
+            ds_metrics = ds_meta_data.ds_metrics = self.ds_metrics_repository.create(commit=False)
+        ds_metrics.number_of_models = len(computed)
+        ds_metrics.number_of_features = sum(metrics.number_of_features for metrics in computed)
+        ds_metrics.number_of_constraints = sum(metrics.number_of_constraints for metrics in computed)
+        ds_metrics.max_tree_depth = max((metrics.tree_depth for metrics in computed), default=0)
+        ds_metrics.computed_at = now
+
+        self.repository.session.commit()
+        # Searches filtering on the number of features may have cached the previous totals
+        explore_cache.invalidate()
+        return ds_metrics
+
+    @staticmethod
+    def _set_fm_metrics(fm_metrics: FMMetrics, hubfile: Hubfile):
+        fm_metrics.checksum = hubfile.checksum
+        try:
+            metrics = compute_metrics(feature_model_cache.load(hubfile.get_path(), hubfile.checksum))
+        except Exception as e:
+            # Stored, so the file is not parsed again until its content changes
+            fm_metrics.number_of_features = fm_metrics.number_of_constraints = None
+            fm_metrics.tree_depth = fm_metrics.ctc_ratio = None
+            fm_metrics.error = str(e) or type(e).__name__
+            return
+
+        fm_metrics.number_of_features = metrics.features
+        fm_metrics.number_of_constraints = metrics.constraints
+        fm_metrics.tree_depth = metrics.depth
+        fm_metrics.ctc_ratio = metrics.ctc_ratio
+        fm_metrics.error = None
+
+    def get_analysis_etag(self, hubfile: Hubfile, analysis: str, feature: Optional[str] = None) -> str:
+        return "_".join(filter(None, [bdd_cache.make_key(hubfile.checksum), analysis, feature]))
+
+    def analyze_hubfile(self, hubfile: Hubfile, analysis: str, feature: Optional[str] = None) -> dict:
+        """
+        Result of one of the ANALYSES over the BDD of the file, compiled once
+        per checksum. Counts are exact, as integers. The commonality is the
+        share of the configurations each feature is selected in, of a single
+        feature when given.
+        """
+        counts = bdd_cache.counts(hubfile.get_path(), hubfile.checksum)
+        result = {"file_id": hubfile.id, "analysis": analysis, "bdd_version": BDD_VERSION}
+        if analysis == "configurations":
+            result["configurations"] = counts.configurations
+        elif analysis == "core_features":
+            result["core_features"] = counts.core_features()
+        elif analysis == "dead_features":
+            result["dead_features"] = counts.dead_features()
+        elif analysis == "commonality":
+            commonality = counts.commonality()
+            if feature is not None:
+                if feature not in commonality:
+                    raise KeyError(feature)
+                commonality = {feature: commonality[feature]}
+            result["commonality"] = commonality
+        else:
+            raise ValueError(f"Unknown analysis {analysis}")
+        return result
+
+    def get_conversion_etag(self, hubfile: Hubfile, format: str) -> str:
+        return conversion_cache.make_key(hubfile.checksum, format)
+
+    def convert_hubfile(self, hubfile: Hubfile, format: str) -> str:
+        return conversion_cache.convert(hubfile.get_path(), hubfile.checksum, format)
+
+    def read_conversion(self, hubfile: Hubfile, format: str) -> str:
+        return conversion_cache.read(hubfile.get_path(), hubfile.checksum, format)
+
+    def stream_conversion_entries(self, dataset: DataSet, format: str, folder_name: str) -> Iterator[tuple[str, str]]:
+        """
+        (path, arcname) of the conversion of every UVL file of a dataset, placed
+        under folder_name, in the order the conversion pool completes them.
+        Files that could not be converted are listed in a report entry instead.
+        """
+        directory = os.path.join("uploads", f"user_{dataset.user_id}", f"dataset_{dataset.id}")
+        files = []
+        for hubfile in sorted(dataset.files(), key=lambda hubfile: hubfile.name):
+            path = os.path.join(directory, hubfile.name)
+            if hubfile.name.endswith(".uvl") and os.path.isfile(path):
+                files.append((path, hubfile.checksum))
+
+        # Submitted now, within the request, and collected while the archive streams
+        results = conversion_pool.convert(files, format)
+        return self._conversion_entries(files, results, format, folder_name)
+
+    @staticmethod
+    def _conversion_entries(files, results, format, folder_name):
+        failures = []
+        for index, path, error in results:
+            name = os.path.basename(files[index][0])
+            if error is not None:
+                failures.append(f"{name}: {error}")
+                continue
+            arcname = f"{name[:-len('.uvl')]}_{format}{FORMATS[format].extension}"
+            yield path, os.path.join(folder_name, arcname)
+
+        if failures:
+            report = "\n".join(["The following files could not be converted:", *sorted(failures)]) + "\n"
+            yield report.encode(), os.path.join(folder_name, CONVERSION_ERRORS_NAME)
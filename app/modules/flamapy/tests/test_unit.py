@@ -1,5 +1,17 @@
+import io
+import os
+import shutil
+import threading
+import time
+import zipfile
+
 import pytest
 
+from app import db
+from app.modules.dataset.models import DataSet, DSMetaData, PublicationType
+from app.modules.featuremodel.models import FeatureModel, FMMetaData
+from app.modules.hubfile.models import Hubfile
+
 
 @pytest.fixture(scope="module")
 def test_client(test_client):
@@ -9,7 +21,25 @@ def test_client(test_client):
     with test_client.application.app_context():
         # Add HERE new elements to the database that you want to exist in the test context.
         # DO NOT FORGET to use db.session.add(<element>) and db.session.commit() to save the data.
-        pass
+        dsmetadata = DSMetaData(
+            id=500,
+            title="Conversions",
+            description="Dataset converted to other formats",
+            publication_type=PublicationType.JOURNAL_ARTICLE,
+        )
+        db.session.add(dsmetadata)
+        db.session.add(DataSet(id=500, user_id=1, ds_meta_data_id=500))
+        db.session.add(FeatureModel(id=500, data_set_id=500))
+
+        directory = os.path.join("uploads", "user_1", "dataset_500")
+        os.makedirs(directory, exist_ok=True)
+        # uvl_test.uvl has a constraint on an undeclared feature, it cannot be written as DIMACS
+        for id, name in ((500, "file1.uvl"), (501, "uvl_test.uvl")):
+            shutil.copy(os.path.join("app", "modules", "dataset", "uvl_examples", name), directory)
+            db.session.add(
+                Hubfile(id=id, name=name, checksum=f"conversions{id}", size=1, feature_model_id=500)
+            )
+        db.session.commit()
 
     yield test_client
 
@@ -24,3 +54,419 @@ def test_sample_assertion(test_client):
     assert (
         greeting == "Hello, World!"
     ), "The greeting does not coincide with 'Hello, World!'"
+
+
+def test_conversion_cache_converts_each_file_once(tmp_path, monkeypatch):
+    from app.modules.flamapy import conversions
+    from app.modules.flamapy.conversions import ConversionCache
+
+    source = tmp_path / "model.uvl"
+    shutil.copy(os.path.join("app", "modules", "dataset", "uvl_examples", "file1.uvl"), source)
+    cache = ConversionCache(directory=str(tmp_path / "conversions"), max_bytes=1024**2)
+
+    path = cache.convert(str(source), "abc", "glencoe")
+    assert path.endswith(".json") and "abc_glencoe_" in path
+    assert cache.convert(str(source), "abc", "glencoe") == path
+    assert os.stat(path).st_ino == os.stat(cache.convert(str(source), "abc", "glencoe")).st_ino
+    assert "p cnf" in cache.read(str(source), "abc", "dimacs")
+
+    # Another flamapy version does not reuse the conversions of the previous one
+    monkeypatch.setattr(conversions, "FLAMAPY_VERSION", "0.0.0")
+    assert cache.convert(str(source), "abc", "glencoe") != path
+
+    cache.invalidate("abc")
+    assert os.listdir(cache.directory) == []
+
+
+def test_conversion_cache_evicts_the_least_recently_used(tmp_path):
+    from app.modules.flamapy.conversions import ConversionCache
+
+    source = tmp_path / "model.uvl"
+    shutil.copy(os.path.join("app", "modules", "dataset", "uvl_examples", "file1.uvl"), source)
+    cache = ConversionCache(directory=str(tmp_path / "conversions"), max_bytes=1024**2)
+
+    first = cache.convert(str(source), "first", "splot")
+    second = cache.convert(str(source), "second", "splot")
+    os.utime(first, (0, 0))
+
+    cache.evict(max_bytes=os.path.getsize(second))
+    assert not os.path.exists(first)
+    assert os.path.exists(second)
+
+
+def test_feature_model_cache_parses_each_checksum_once(tmp_path, monkeypatch):
+    from app.modules.flamapy import parsing
+    from app.modules.flamapy.parsing import FeatureModelCache
+
+    source = tmp_path / "model.uvl"
+    shutil.copy(os.path.join("app", "modules", "dataset", "uvl_examples", "file1.uvl"), source)
+    cache = FeatureModelCache(directory=str(tmp_path / "models"), max_bytes=1024**2, disk_max_bytes=1024**2)
+
+    model = cache.load(str(source), "abc")
+    assert cache.load(str(source), "abc") is model
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    def fail(path):
+        raise AssertionError("parsed again")
+
+    # Another worker loads the pickle instead of parsing the file
+    monkeypatch.setattr(parsing, "UVLReader", fail)
+    other_worker = FeatureModelCache(directory=cache.directory, max_bytes=1024**2, disk_max_bytes=1024**2)
+    loaded = other_worker.load(str(source), "abc")
+    assert other_worker.disk_hits == 1
+    assert loaded.root.name == model.root.name
+    assert len(loaded.get_features()) == len(model.get_features())
+
+    cache.invalidate("abc")
+    assert not os.path.exists(cache.path("abc"))
+    with pytest.raises(AssertionError):
+        cache.load(str(source), "abc")
+
+
+def test_feature_model_cache_is_bounded_by_size(tmp_path):
+    from app.modules.flamapy.parsing import FeatureModelCache
+
+    source = tmp_path / "model.uvl"
+    shutil.copy(os.path.join("app", "modules", "dataset", "uvl_examples", "file1.uvl"), source)
+    probe = FeatureModelCache(directory=str(tmp_path / "probe"), max_bytes=1024**2, disk_max_bytes=1024**2)
+    probe.load(str(source), "probe")
+    model_bytes = probe.stats()["bytes"]
+
+    cache = FeatureModelCache(directory=str(tmp_path / "models"), max_bytes=2 * model_bytes, disk_max_bytes=1024**2)
+    for checksum in ("first", "second", "third"):
+        cache.load(str(source), checksum)
+    assert cache.stats()["size"] == 2
+    assert cache.evictions == 1
+
+    # An evicted model comes back from the disk tier, a broken pickle is parsed again
+    cache.load(str(source), "first")
+    assert cache.disk_hits == 1
+    with open(cache.path("second"), "wb") as file:
+        file.write(b"broken")
+    cache.clear()
+    cache.load(str(source), "second")
+    assert cache.misses == 1
+
+
+def test_dataset_conversions_run_in_the_pool_and_report_failures(test_client, monkeypatch):
+    from app.modules.flamapy.conversions import conversion_pool
+
+    response = test_client.get("/flamapy/download/DIMACS/500")
+    assert response.status_code == 200
+
+    with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+        assert sorted(archive.namelist()) == [
+            "Conversions_dimacs/conversion_errors.txt",
+            "Conversions_dimacs/file1_dimacs.cnf",
+        ]
+        assert "p cnf" in archive.read("Conversions_dimacs/file1_dimacs.cnf").decode()
+        assert "uvl_test.uvl" in archive.read("Conversions_dimacs/conversion_errors.txt").decode()
+
+    # The converted file is reused, only the failing one goes back to the pool
+    submitted = []
+    submit = conversion_pool._submit
+    monkeypatch.setattr(
+        conversion_pool, "_submit", lambda source, *args: submitted.append(source) or submit(source, *args)
+    )
+    response = test_client.get("/flamapy/download/DIMACS/500")
+    assert response.status_code == 200
+    assert [os.path.basename(source) for source in submitted] == ["uvl_test.uvl"]
+
+    response = test_client.get("/flamapy/download/GLENCOE/500")
+    with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+        assert sorted(archive.namelist()) == [
+            "Conversions_glencoe/file1_glencoe.json",
+            "Conversions_glencoe/uvl_test_glencoe.json",
+        ]
+
+
+def test_serializers_match_the_flamapy_writers(tmp_path):
+    from flamapy.metamodels.fm_metamodel.transformations import GlencoeWriter, SPLOTWriter, UVLReader
+    from flamapy.metamodels.pysat_metamodel.transformations import DimacsWriter, FmToPysat
+
+    from app.modules.flamapy.conversions import FORMATS, ConversionCache
+
+    source = os.path.join("app", "modules", "dataset", "uvl_examples", "file1.uvl")
+    model = UVLReader(source).transform()
+    GlencoeWriter(str(tmp_path / "glencoe"), model).transform()
+    DimacsWriter(str(tmp_path / "dimacs"), FmToPysat(model).transform()).transform()
+    SPLOTWriter(str(tmp_path / "splot"), model).transform()
+
+    cache = ConversionCache(directory=str(tmp_path / "conversions"), max_bytes=1024**2)
+    for format, conversion in FORMATS.items():
+        written = (tmp_path / format).read_text(encoding="utf8")
+        assert conversion.serialize(model) == written
+        # Read from memory on a miss, from the cache entry afterwards
+        assert cache.read(source, "abc", format) == written
+        assert cache.read(source, "abc", format) == written
+        assert (tmp_path / "conversions" / os.path.basename(cache.path("abc", format))).read_text() == written
+
+
+def test_dataset_validation_is_stored_by_checksum(test_client, monkeypatch):
+    from app.modules.flamapy import services
+    from app.modules.flamapy.models import UVLValidation
+
+    dsmetadata = DSMetaData(
+        id=501,
+        title="Validation",
+        description="Dataset checked in a single request",
+        publication_type=PublicationType.JOURNAL_ARTICLE,
+    )
+    db.session.add(dsmetadata)
+    db.session.add(DataSet(id=501, user_id=1, ds_meta_data_id=501))
+    db.session.add(FeatureModel(id=501, data_set_id=501, uvl_valid=False))
+    db.session.add(FeatureModel(id=502, data_set_id=501, uvl_valid=False))
+    directory = os.path.join("uploads", "user_1", "dataset_501")
+    os.makedirs(directory, exist_ok=True)
+    shutil.copy(os.path.join("app", "modules", "dataset", "uvl_examples", "file1.uvl"), directory)
+    with open(os.path.join(directory, "broken.uvl"), "w") as file:
+        file.write("features\n    Root\n        mandatory\n            A B\n")
+    db.session.add(Hubfile(id=502, name="file1.uvl", checksum="validation502", size=1, feature_model_id=501))
+    db.session.add(Hubfile(id=503, name="broken.uvl", checksum="validation503", size=1, feature_model_id=502))
+    db.session.commit()
+
+    validated = []
+    validate_uvl = services.validate_uvl
+    monkeypatch.setattr(services, "validate_uvl", lambda path: validated.append(path) or validate_uvl(path))
+
+    response = test_client.get("/flamapy/check_uvl/dataset/501")
+    assert response.status_code == 200
+    data = response.get_json()
+    assert not data["valid"]
+    assert data["files"]["502"] == {"valid": True, "errors": []}
+    assert not data["files"]["503"]["valid"]
+    assert "Line 4:14" in data["files"]["503"]["errors"][0]
+    assert len(validated) == 2
+    assert db.session.get(FeatureModel, 501).uvl_valid
+    assert UVLValidation.query.filter(UVLValidation.checksum.in_(["validation502", "validation503"])).count() == 2
+
+    # Stored results are reused, and nothing is written when no flag changes
+    commits = []
+    monkeypatch.setattr(db.session, "commit", lambda: commits.append(True))
+    assert test_client.get("/flamapy/check_uvl/dataset/501").get_json() == data
+    assert test_client.get("/flamapy/check_uvl/503").status_code == 400
+    assert len(validated) == 2
+    assert commits == []
+
+
+def test_two_stage_validation_reports_the_errors_of_a_full_parse(monkeypatch):
+    from antlr4 import InputStream
+
+    from app.modules.flamapy import validation
+    from app.modules.flamapy.benchmark import synthetic_uvl
+
+    with open(os.path.join("app", "modules", "dataset", "uvl_examples", "file1.uvl")) as file:
+        valid = [file.read(), synthetic_uvl(300, constraints=30)]
+    broken = [
+        "features\n    Root\n        mandatory\n            A B C\n  )(\n",
+        "garbage {",
+        synthetic_uvl(300, constraints=30, broken=True),
+    ]
+
+    fallbacks = []
+    default_strategy = validation.DefaultErrorStrategy
+    monkeypatch.setattr(
+        validation, "DefaultErrorStrategy", lambda: fallbacks.append(True) or default_strategy()
+    )
+    for text in valid:
+        assert validation.validate_uvl_text(text) == validation.validate_uvl_ll(InputStream(text)) == []
+    # Valid files never get past the SLL stage
+    assert fallbacks == []
+
+    def locations(errors):
+        # ANTLR may list more expected tokens once its caches are warm, the positions do not change
+        return [error.split(" - ")[0] for error in errors]
+
+    for text in broken:
+        errors = validation.validate_uvl_text(text)
+        assert errors and locations(errors) == locations(validation.validate_uvl_ll(InputStream(text)))
+    assert len(fallbacks) == len(broken)
+    assert "Line 4:14" in validation.validate_uvl_text(broken[0])[0]
+
+
+def test_feature_model_metrics():
+    from flamapy.metamodels.fm_metamodel.transformations import UVLReader
+
+    from app.modules.flamapy.metrics import ModelMetrics, compute_metrics
+
+    model = UVLReader(os.path.join("app", "modules", "dataset", "uvl_examples", "file1.uvl")).transform()
+    # Server, "Data Storage", Video, Audio and "Media Player" appear in the constraints
+    assert compute_metrics(model) == ModelMetrics(features=10, constraints=2, depth=2, ctc_ratio=0.5)
+
+
+def test_dataset_metrics_are_stored_and_filtered_on(test_client, monkeypatch):
+    from app.modules.dataset.repositories import DataSetRepository
+    from app.modules.flamapy import services
+    from app.modules.flamapy.metrics import metrics_queue
+
+    db.session.add(
+        DSMetaData(
+            id=502,
+            title="Metrics",
+            description="Dataset whose metrics are computed",
+            publication_type=PublicationType.JOURNAL_ARTICLE,
+            dataset_doi="10.1234/metrics",
+        )
+    )
+    db.session.add(DataSet(id=502, user_id=1, ds_meta_data_id=502))
+    directory = os.path.join("uploads", "user_1", "dataset_502")
+    os.makedirs(directory, exist_ok=True)
+    shutil.copy(os.path.join("app", "modules", "dataset", "uvl_examples", "file1.uvl"), directory)
+    with open(os.path.join(directory, "broken.uvl"), "w") as file:
+        file.write("features\n    Root\n        mandatory\n            A B\n")
+    for id, name in ((503, "file1.uvl"), (504, "broken.uvl")):
+        db.session.add(
+            FMMetaData(
+                id=id,
+                uvl_filename=name,
+                title=name,
+                description="Feature model",
+                publication_type=PublicationType.JOURNAL_ARTICLE,
+            )
+        )
+        db.session.add(FeatureModel(id=id, data_set_id=502, fm_meta_data_id=id))
+        db.session.add(Hubfile(id=id + 1, name=name, checksum=f"metrics{id}", size=1, feature_model_id=id))
+    db.session.commit()
+    assert 502 in DataSetRepository().get_ids_without_metrics()
+
+    loaded = []
+    load = services.feature_model_cache.load
+    monkeypatch.setattr(
+        services.feature_model_cache, "load", lambda source, checksum: loaded.append(checksum) or load(source, checksum)
+    )
+    # Computed within the request in the tests
+    metrics_queue.enqueue(502)
+
+    dataset = db.session.get(DataSet, 502)
+    fm_metrics = db.session.get(FMMetaData, 503).fm_metrics
+    assert (fm_metrics.number_of_features, fm_metrics.tree_depth, fm_metrics.checksum) == (10, 2, "metrics503")
+    broken = db.session.get(FMMetaData, 504).fm_metrics
+    assert broken.error and broken.number_of_features is None
+    # The file that could not be parsed is left out of the totals
+    assert dataset.ds_meta_data.ds_metrics.to_dict() == {
+        "number_of_models": 1,
+        "number_of_features": 10,
+        "number_of_constraints": 2,
+        "max_tree_depth": 2,
+    }
+
+    # Unchanged files are not parsed again
+    metrics_queue.enqueue(502)
+    assert loaded == ["metrics503", "metrics504"]
+    assert 502 not in DataSetRepository().get_ids_without_metrics()
+
+    def explore(**criteria):
+        response = test_client.post("/explore", json={"title": "", "sorting": "newest", **criteria})
+        return [dataset["id"] for dataset in response.get_json()["datasets"]]
+
+    assert 502 in explore(min_features="10", max_features="10")
+    assert 502 not in explore(min_features="11")
+    assert 502 not in explore(max_features=9)
+    assert 502 in explore(min_features="not a number")
+
+
+def test_bdd_analyses_compile_each_file_once(test_client, monkeypatch):
+    from app.modules.flamapy import bdd
+    from app.modules.flamapy.bdd import bdd_cache
+
+    # Chat, Connection and Messages are mandatory; 3 connections with storage times 8 message types with player
+    response = test_client.get("/flamapy/analysis/configurations/500")
+    assert response.status_code == 200
+    assert response.json["configurations"] == 24
+    etag = response.headers["ETag"]
+    assert test_client.get("/flamapy/analysis/configurations/500", headers={"If-None-Match": etag}).status_code == 304
+
+    def fail(*args, **kwargs):
+        raise AssertionError("compiled again")
+
+    # The other analyses load the stored BDD
+    monkeypatch.setattr(bdd.compile_pool, "run", fail)
+    with test_client.application.app_context():
+        bdd_cache._counts.clear()
+    core_features = test_client.get("/flamapy/analysis/core_features/500").json["core_features"]
+    assert core_features == ["Chat", "Connection", "Messages"]
+    assert test_client.get("/flamapy/analysis/dead_features/500").json["dead_features"] == []
+    commonality = test_client.get("/flamapy/analysis/commonality/500?feature=Server").json["commonality"]
+    assert commonality == {"Server": pytest.approx(1 / 3)}
+    assert test_client.get("/flamapy/analysis/commonality/500?feature=Missing").status_code == 404
+    assert test_client.get("/flamapy/analysis/unknown/500").status_code == 404
+    monkeypatch.undo()
+
+    # uvl_test.uvl has a constraint on an undeclared feature
+    assert test_client.get("/flamapy/analysis/configurations/501").status_code == 422
+
+    # Past the budget the failure is stored, and only tried again with a larger budget
+    with test_client.application.app_context():
+        bdd_cache.invalidate("conversions500")
+        assert not os.path.exists(bdd_cache.path("conversions500"))
+    monkeypatch.setitem(test_client.application.config, "BDD_MAX_NODES", 5)
+    response = test_client.get("/flamapy/analysis/dead_features/500")
+    assert response.status_code == 422
+    assert "5 nodes" in response.json["error"]
+    monkeypatch.setattr(bdd.compile_pool, "run", fail)
+    assert test_client.get("/flamapy/analysis/dead_features/500").status_code == 422
+    monkeypatch.undo()
+    assert test_client.get("/flamapy/analysis/dead_features/500").status_code == 200
+
+
+def test_bdd_compilations_past_the_timeout_are_killed(test_client, monkeypatch):
+    from app.modules.flamapy.conversions import ConversionPool, PoolBusyError
+
+    monkeypatch.setitem(test_client.application.config, "CONVERSION_POOL_SIZE", 1)
+    pool = ConversionPool()
+    with test_client.application.app_context():
+        assert pool.run(abs, -3, timeout=10) == 3
+        process = next(iter(pool._executor._processes.values()))
+        with pytest.raises(TimeoutError):
+            pool.run(time.sleep, 60, timeout=0.5)
+        process.join(5)
+        assert not process.is_alive()
+        # The next call starts a new pool
+        assert pool.run(abs, -4, timeout=10) == 4
+
+        # A call waiting for the only process is dropped, the running one is left alone
+        results = []
+        slow = threading.Thread(target=lambda: results.append(pool.run(time.sleep, 2, timeout=10)))
+        slow.start()
+        time.sleep(0.5)
+        with pytest.raises(PoolBusyError):
+            pool.run(abs, -5, timeout=0.5)
+        slow.join()
+        assert results == [None]
+        pool.shutdown()
+
+
+def test_busy_bdd_compilations_are_retried_later(test_client, monkeypatch):
+    from app.modules.flamapy import bdd
+    from app.modules.flamapy.bdd import bdd_cache
+    from app.modules.flamapy.conversions import PoolBusyError
+
+    def busy(*args, **kwargs):
+        raise PoolBusyError("No process was free within 10 seconds")
+
+    with test_client.application.app_context():
+        bdd_cache.invalidate("conversions500")
+    monkeypatch.setattr(bdd.compile_pool, "run", busy)
+    response = test_client.get("/flamapy/analysis/configurations/500")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"]
+    with test_client.application.app_context():
+        assert not os.path.exists(bdd_cache.failure_path("conversions500"))
+
+    monkeypatch.undo()
+    assert test_client.get("/flamapy/analysis/configurations/500").status_code == 200
+
+
+def test_bdd_cache_evicts_the_stored_failures(tmp_path):
+    from app.modules.flamapy.bdd import BDDCache
+
+    cache = BDDCache(directory=str(tmp_path / "bdds"), max_bytes=1024**2)
+    os.makedirs(cache.directory)
+    for checksum in ("first", "second"):
+        with open(cache.failure_path(checksum), "w") as file:
+            file.write('{"error": "too large", "max_seconds": 1, "max_nodes": 1}')
+    os.utime(cache.failure_path("first"), (0, 0))
+
+    cache.evict(max_bytes=os.path.getsize(cache.failure_path("second")))
+    assert not os.path.exists(cache.failure_path("first"))
+    assert os.path.exists(cache.failure_path("second"))
@@ -0,0 +1,126 @@
+from importlib import metadata
+
+from antlr4 import CommonTokenStream, FileStream, InputStream
+from antlr4.atn.LexerATNSimulator import LexerATNSimulator
+from antlr4.atn.PredictionMode import PredictionMode
+from antlr4.PredictionContext import PredictionContextCache
+from antlr4.error.ErrorListener import ErrorListener
+from antlr4.error.ErrorStrategy import BailErrorStrategy, DefaultErrorStrategy
+from antlr4.error.Errors import ParseCancellationException
+from uvl.UVLCustomLexer import UVLCustomLexer
+from uvl.UVLPythonParser import UVLPythonParser
+
+
+def _grammar_version() -> str:
+    try:
+        return metadata.version("uvlparser")
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+# Part of every stored result, a new grammar validates every file again
+GRAMMAR_VERSION = _grammar_version()
+
+
+class UVLErrorListener(ErrorListener):
+    def __init__(self):
+        self.errors = []
+
+    def syntaxError(self, recognizer, offendingSymbol, line, column, msg, e):
+        if "\\t" in msg:
+            self.errors.append(
+                f"The UVL has the following warning that prevents reading it: Line {line}:{column} - {msg}"
+            )
+        else:
+            self.errors.append(
+                f"The UVL has the following error that prevents reading it: Line {line}:{column} - {msg}"
+            )
+
+
+class _StartStateCachingSimulator(LexerATNSimulator):
+    """
+    The NEWLINE rule of the UVL lexer starts with an atStartOfInput()
+    predicate, so ANTLR never caches the start state of the lexer DFA and
+    computes its whole closure again for every token, most of the time spent
+    validating a file. The predicate only depends on the position being the
+    start of the input, so the start state is kept for each outcome.
+    """
+
+    def __init__(self, recog, atn, decisionToDFA, sharedContextCache):
+        super().__init__(recog, atn, decisionToDFA, sharedContextCache)
+        self._start_states = {}
+
+    def matchATN(self, input):
+        key = (self.mode, self.recog.atStartOfInput())
+        start_state = self._start_states.get(key)
+        if start_state is None:
+            closure = self.computeStartState(input, self.atn.modeToStartState[self.mode])
+            closure.hasSemanticContext = False
+            start_state = self._start_states[key] = self.addDFAState(closure)
+        return self.execATN(input, start_state)
+
+
+class UVLValidationLexer(UVLCustomLexer):
+    def __init__(self, input_stream):
+        super().__init__(input_stream)
+        self._interp = _StartStateCachingSimulator(self, self.atn, self.decisionsToDFA, PredictionContextCache())
+
+
+def validate_uvl(path: str) -> list[str]:
+    """Syntax errors of the UVL file at path, none when it is valid."""
+    return validate_uvl_stream(FileStream(path, encoding="utf-8"))
+
+
+def validate_uvl_text(text: str) -> list[str]:
+    return validate_uvl_stream(InputStream(text))
+
+
+def validate_uvl_stream(input_stream) -> list[str]:
+    """
+    Parses in two stages. The first one uses SLL prediction, much cheaper
+    than full LL, and gives up at the first syntax error instead of
+    recovering. Valid files, nearly all of them, stop there. Only a file
+    that failed is parsed again with full LL and the default recovery, so
+    that every error is reported with its line and column; SLL can reject
+    a valid input, LL then accepts it.
+    """
+    error_listener = UVLErrorListener()
+
+    lexer = UVLValidationLexer(input_stream)
+    lexer.removeErrorListeners()
+    lexer.addErrorListener(error_listener)
+    # Filled by the first stage and replayed by the second, the input is only lexed once
+    tokens = CommonTokenStream(lexer)
+
+    parser = UVLPythonParser(tokens)
+    parser.removeErrorListeners()
+    parser._interp.predictionMode = PredictionMode.SLL
+    parser._errHandler = BailErrorStrategy()
+    try:
+        parser.featureModel()
+        return error_listener.errors
+    except ParseCancellationException:
+        pass
+
+    tokens.seek(0)
+    parser.reset()
+    parser.addErrorListener(error_listener)
+    parser._interp.predictionMode = PredictionMode.LL
+    parser._errHandler = DefaultErrorStrategy()
+    parser.featureModel()
+    return error_listener.errors
+
+
+def validate_uvl_ll(input_stream) -> list[str]:
+    """Single full LL parse with error recovery, the previous validation, kept for comparison."""
+    error_listener = UVLErrorListener()
+
+    lexer = UVLCustomLexer(input_stream)
+    lexer.removeErrorListeners()
+    lexer.addErrorListener(error_listener)
+
+    parser = UVLPythonParser(CommonTokenStream(lexer))
+    parser.removeErrorListeners()
+    parser.addErrorListener(error_listener)
+    parser.featureModel()
+    return error_listener.errors
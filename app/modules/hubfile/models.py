@@ -56,6 +56,8 @@ class HubfileViewRecord(db.Model):
     file_id = db.Column(db.Integer, db.ForeignKey("file.id"), nullable=False)
     view_date = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     view_cookie = db.Column(db.String(36))
+    # Hash of the (user, file, cookie) tracked, one record each whichever host writes it
+    record_key = db.Column(db.String(64), unique=True)
 
     def __repr__(self):
         return "<FileViewRecord {}>".format(self.id)
@@ -70,6 +72,8 @@ class HubfileDownloadRecord(db.Model):
         db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc)
     )
     download_cookie = db.Column(db.String(36), nullable=False)
+    # Hash of the (user, file, cookie) tracked, one record each whichever host writes it
+    record_key = db.Column(db.String(64), unique=True)
 
     def __repr__(self):
         return (
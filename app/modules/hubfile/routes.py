@@ -1,21 +1,19 @@
-from datetime import datetime, timezone
 import os
 import uuid
-from flask import current_app, jsonify, make_response, request, send_from_directory
+from flask import abort, current_app, jsonify, make_response, request
 from flask_login import current_user
+from app.modules.dataset.archives import archive_cache
+from app.modules.flamapy.bdd import bdd_cache
+from app.modules.flamapy.conversions import conversion_cache
+from app.modules.flamapy.metrics import metrics_queue
+from app.modules.flamapy.parsing import feature_model_cache
+from app.modules.flamapy.services import FlamapyService
 from app.modules.hubfile import hubfile_bp
-from app.modules.hubfile.models import HubfileDownloadRecord, HubfileViewRecord
 from app.modules.hubfile.services import HubfileDownloadRecordService, HubfileService
-from flamapy.metamodels.fm_metamodel.transformations import (
-    UVLReader,
-    GlencoeWriter,
-    SPLOTWriter,
-)
-from flamapy.metamodels.pysat_metamodel.transformations import FmToPysat, DimacsWriter
-import tempfile
+from werkzeug.security import safe_join
 
 
-from app import db
+from core.helpers.http import not_modified, revalidate, send_download
 
 
 @hubfile_bp.route("/file/download/<int:file_id>", methods=["GET"])
@@ -23,6 +21,11 @@ def download_file(file_id):
     file = HubfileService().get_or_404(file_id)
     filename = file.name
 
+    # The checksum identifies the content, a client holding it already has the file
+    unchanged = not_modified(file.checksum)
+    if unchanged:
+        return unchanged
+
     directory_path = f"uploads/user_{file.feature_model.data_set.user_id}/dataset_{file.feature_model.data_set_id}/"
     parent_directory_path = os.path.dirname(current_app.root_path)
     file_path = os.path.join(parent_directory_path, directory_path)
@@ -32,26 +35,20 @@ def download_file(file_id):
     if not user_cookie:
         user_cookie = str(uuid.uuid4())
 
-    # Check if the download record already exists for this cookie
-    existing_record = HubfileDownloadRecord.query.filter_by(
-        user_id=current_user.id if current_user.is_authenticated else None,
-        file_id=file_id,
-        download_cookie=user_cookie,
-    ).first()
-
-    if not existing_record:
-        # Record the download in your database
-        HubfileDownloadRecordService().create(
-            user_id=current_user.id if current_user.is_authenticated else None,
-            file_id=file_id,
-            download_date=datetime.now(timezone.utc),
-            download_cookie=user_cookie,
-        )
+    # Record the download, a download already recorded for this cookie is skipped
+    HubfileDownloadRecordService().record_download(
+        file_id,
+        current_user.id if current_user.is_authenticated else None,
+        user_cookie,
+    )
 
+    # Range and If-Range requests are answered against the same ETag
+    file_path = safe_join(file_path, filename)
+    if file_path is None:
+        abort(404)
+    resp = send_download(file_path, filename, etag=file.checksum)
     # Save the cookie to the user's browser
-    resp = make_response(
-        send_from_directory(directory=file_path, path=filename, as_attachment=True)
-    )
+    resp.cache_control.no_cache = True
     resp.set_cookie("file_download_cookie", user_cookie)
 
     return resp
@@ -62,6 +59,10 @@ def view_file(file_id):
     file = HubfileService().get_or_404(file_id)
     filename = file.name
 
+    unchanged = not_modified(file.checksum)
+    if unchanged:
+        return unchanged
+
     directory_path = f"uploads/user_{file.feature_model.data_set.user_id}/dataset_{file.feature_model.data_set_id}/"
     parent_directory_path = os.path.dirname(current_app.root_path)
     file_path = os.path.join(parent_directory_path, directory_path, filename)
@@ -75,23 +76,12 @@ def view_file(file_id):
             if not user_cookie:
                 user_cookie = str(uuid.uuid4())
 
-            # Check if the view record already exists for this cookie
-            existing_record = HubfileViewRecord.query.filter_by(
-                user_id=current_user.id if current_user.is_authenticated else None,
-                file_id=file_id,
-                view_cookie=user_cookie,
-            ).first()
-
-            if not existing_record:
-                # Register file view
-                new_view_record = HubfileViewRecord(
-                    user_id=current_user.id if current_user.is_authenticated else None,
-                    file_id=file_id,
-                    view_date=datetime.now(),
-                    view_cookie=user_cookie,
-                )
-                db.session.add(new_view_record)
-                db.session.commit()
+            # Record the view, a view already recorded for this cookie is skipped
+            HubfileService().record_view(
+                file_id,
+                current_user.id if current_user.is_authenticated else None,
+                user_cookie,
+            )
 
             # Prepare response
             response = jsonify({"success": True, "content": content})
@@ -101,7 +91,7 @@ def view_file(file_id):
                     "view_cookie", user_cookie, max_age=60 * 60 * 24 * 365 * 2
                 )
 
-            return response
+            return revalidate(response, file.checksum)
         else:
             return jsonify({"success": False, "error": "File not found"}), 404
     except Exception as e:
@@ -128,39 +118,19 @@ def view_file_other_formats(file_id, format):
     # Tratar de abrir y leer el archivo del formato adecuado
     try:
         if os.path.exists(file_path):
-            # Leer archivo UVL
-            with open(file_path, "r") as f:
-                content = f.read()
-
-            # Llamar a la función de conversión dependiendo del formato solicitado
-            if format == "glencoe":
-                content = convert_to_glencoe(content, file)
-            elif format == "cnf":
-                content = convert_to_dimacs(content, file)
-            elif format == "splot":
-                content = convert_to_splot(content, file)
+            # Convertido una sola vez por checksum, las siguientes vistas se leen de la caché
+            content = FlamapyService().read_conversion(file, "dimacs" if format == "cnf" else format)
 
             user_cookie = request.cookies.get("view_cookie")
             if not user_cookie:
                 user_cookie = str(uuid.uuid4())
 
-            # Verificar si ya existe un registro de vista para este archivo y cookie
-            existing_record = HubfileViewRecord.query.filter_by(
-                user_id=current_user.id if current_user.is_authenticated else None,
-                file_id=file_id,
-                view_cookie=user_cookie,
-            ).first()
-
-            if not existing_record:
-                # Registrar la visualización del archivo
-                new_view_record = HubfileViewRecord(
-                    user_id=current_user.id if current_user.is_authenticated else None,
-                    file_id=file_id,
-                    view_date=datetime.now(),
-                    view_cookie=user_cookie,
-                )
-                db.session.add(new_view_record)
-                db.session.commit()
+            # Record the view, a view already recorded for this cookie is skipped
+            HubfileService().record_view(
+                file_id,
+                current_user.id if current_user.is_authenticated else None,
+                user_cookie,
+            )
 
             # Preparar la respuesta con el contenido transformado
             response = jsonify({"success": True, "content": content})
@@ -188,27 +158,24 @@ def edit_file(file_id):
     content = request.json.get("content")
     try:
         if os.path.exists(file_path):
+            previous_checksum = file.checksum
             with open(file_path, "w") as f:
                 f.write(content)
+            HubfileService().update_content_info(file, file_path)
+            archive_cache.invalidate(file.feature_model.data_set_id)
+            conversion_cache.invalidate(previous_checksum)
+            feature_model_cache.invalidate(previous_checksum)
+            bdd_cache.invalidate(previous_checksum)
+            metrics_queue.enqueue(file.feature_model.data_set_id)
             user_cookie = request.cookies.get("view_cookie")
             if not user_cookie:
                 user_cookie = str(uuid.uuid4())
-            # Check if the view record already exists for this cookie
-            existing_record = HubfileViewRecord.query.filter_by(
-                user_id=current_user.id if current_user.is_authenticated else None,
-                file_id=file_id,
-                view_cookie=user_cookie,
-            ).first()
-            if not existing_record:
-                # Register file view
-                new_view_record = HubfileViewRecord(
-                    user_id=current_user.id if current_user.is_authenticated else None,
-                    file_id=file_id,
-                    view_date=datetime.now(),
-                    view_cookie=user_cookie,
-                )
-                db.session.add(new_view_record)
-                db.session.commit()
+            # Record the view, a view already recorded for this cookie is skipped
+            HubfileService().record_view(
+                file_id,
+                current_user.id if current_user.is_authenticated else None,
+                user_cookie,
+            )
             # Prepare response
             response = jsonify({"success": True, "content": content})
             if not request.cookies.get("view_cookie"):
@@ -221,37 +188,3 @@ def edit_file(file_id):
             return jsonify({"success": False, "error": "File not found"}), 404
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
-
-
-def convert_to_glencoe(content, file):
-    # Implementación para convertir el contenido a formato Glencoe
-    temp_file = tempfile.NamedTemporaryFile(suffix=".json", delete=False)
-    fm = UVLReader(file.get_path()).transform()
-    GlencoeWriter(temp_file.name, fm).transform()
-    with open(temp_file.name, "r") as f:
-        glencoe_content = f.read()
-    os.remove(temp_file.name)
-    return glencoe_content
-
-
-def convert_to_dimacs(content, file):
-    # Implementación para convertir el contenido a formato Dimacs
-    temp_file = tempfile.NamedTemporaryFile(suffix=".cnf", delete=False)
-    fm = UVLReader(file.get_path()).transform()
-    sat = FmToPysat(fm).transform()
-    DimacsWriter(temp_file.name, sat).transform()
-    with open(temp_file.name, "r") as f:
-        dimacs_content = f.read()
-    os.remove(temp_file.name)
-    return dimacs_content
-
-
-def convert_to_splot(content, file):
-    # Implementación para convertir el contenido a formato SPLOT
-    temp_file = tempfile.NamedTemporaryFile(suffix=".splx", delete=False)
-    fm = UVLReader(file.get_path()).transform()
-    SPLOTWriter(temp_file.name, fm).transform()
-    with open(temp_file.name, "r") as f:
-        splot_content = f.read()
-    os.remove(temp_file.name)
-    return splot_content
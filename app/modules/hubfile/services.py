@@ -1,6 +1,7 @@
 import os
 from app.modules.auth.models import User
 from app.modules.dataset.models import DataSet
+from app.modules.dataset.tracking import tracking_buffer
 from app.modules.hubfile.models import Hubfile
 from app.modules.hubfile.repositories import (
     HubfileDownloadRecordRepository,
@@ -26,7 +27,7 @@ class HubfileService(BaseService):
 
         hubfile_user = self.get_owner_user_by_hubfile(hubfile)
         hubfile_dataset = self.get_dataset_by_hubfile(hubfile)
-        working_dir = os.getenv("WORKING_DIR")
+        working_dir = os.getenv("WORKING_DIR", "")
 
         path = os.path.join(
             working_dir,
@@ -38,6 +39,15 @@ class HubfileService(BaseService):
 
         return path
 
+    def update_content_info(self, hubfile: Hubfile, path: str) -> Hubfile:
+        from app.modules.dataset.services import calculate_checksum_and_size
+
+        checksum, size = calculate_checksum_and_size(path)
+        return self.repository.update(hubfile.id, checksum=checksum, size=size)
+
+    def record_view(self, file_id: int, user_id, view_cookie: str):
+        tracking_buffer.track("file_view", file_id, user_id, view_cookie)
+
     def total_hubfile_views(self) -> int:
         return self.hubfile_view_record_repository.total_hubfile_views()
 
@@ -49,3 +59,6 @@ class HubfileService(BaseService):
 class HubfileDownloadRecordService(BaseService):
     def __init__(self):
         super().__init__(HubfileDownloadRecordRepository())
+
+    def record_download(self, file_id: int, user_id, download_cookie: str):
+        tracking_buffer.track("file_download", file_id, user_id, download_cookie)
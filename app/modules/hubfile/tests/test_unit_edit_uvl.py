@@ -2,8 +2,11 @@ import pytest
 import os
 import shutil
 from app import db
+from app.modules.dataset.archives import archive_cache
 from app.modules.dataset.models import DataSet, DSMetaData, PublicationType
 from app.modules.featuremodel.models import FeatureModel, FMMetaData
+from app.modules.flamapy.conversions import conversion_cache
+from app.modules.flamapy.parsing import feature_model_cache
 from app.modules.hubfile.models import Hubfile
 from dotenv import load_dotenv
 
@@ -111,3 +114,72 @@ def test_edit_file_success(test_client):
     assert (
         b"EDITADO" in response.data
     ), "El contenido del archivo no fue actualizado correctamente."
+
+
+def test_edit_file_refreshes_checksum_and_drops_cached_archives(test_client):
+    os.makedirs(archive_cache.directory, exist_ok=True)
+    cached_archive = os.path.join(archive_cache.directory, "dataset_99_stale.zip")
+    with open(cached_archive, "wb") as f:
+        f.write(b"stale")
+
+    response = test_client.post("/file/edit/99", json={"content": "features\n    Root\n"})
+    assert response.status_code == 200
+
+    hubfile = db.session.get(Hubfile, 99)
+    db.session.refresh(hubfile)
+    assert hubfile.checksum != "1234567890abcdeg"
+    assert hubfile.size == len("features\n    Root\n")
+    assert not os.path.exists(cached_archive)
+
+
+def test_download_file_is_conditional_on_the_checksum(test_client):
+    checksum = db.session.get(Hubfile, 99).checksum
+
+    response = test_client.get("/file/download/99")
+    assert response.status_code == 200
+    assert response.headers["ETag"] == f'"{checksum}"'
+
+    response = test_client.get("/file/download/99", headers={"If-None-Match": f'"{checksum}"'})
+    assert response.status_code == 304
+    assert response.data == b""
+
+    response = test_client.get("/file/download/99", headers={"Range": "bytes=0-7"})
+    assert response.status_code == 206
+    assert response.data == b"features"
+
+    response = test_client.get("/file/view/99", headers={"If-None-Match": f'"{checksum}"'})
+    assert response.status_code == 304
+
+
+def test_download_file_hands_the_file_over_to_nginx(test_client, monkeypatch):
+    monkeypatch.setitem(test_client.application.config, "X_ACCEL_REDIRECT", True)
+    hubfile = db.session.get(Hubfile, 99)
+
+    response = test_client.get("/file/download/99")
+    assert response.status_code == 200
+    assert response.headers["X-Accel-Redirect"] == f"/internal/uploads/user_1/dataset_99/{hubfile.name}"
+    assert "file_download_cookie" in response.headers["Set-Cookie"]
+    assert response.data == b""
+
+
+def test_conversions_are_cached_until_the_file_is_edited(test_client):
+    checksum = db.session.get(Hubfile, 99).checksum
+
+    response = test_client.get("/flamapy/to_glencoe/99")
+    assert response.status_code == 200
+    etag = response.headers["ETag"].strip('"')
+    assert etag == conversion_cache.make_key(checksum, "glencoe")
+    assert os.path.exists(conversion_cache.path(checksum, "glencoe"))
+    assert os.path.exists(feature_model_cache.path(checksum))
+
+    response = test_client.get("/flamapy/to_glencoe/99", headers={"If-None-Match": f'"{etag}"'})
+    assert response.status_code == 304
+
+    response = test_client.get("/file/view_other/99/glencoe")
+    assert response.get_json()["success"]
+
+    response = test_client.post("/file/edit/99", json={"content": "features\n    Edited\n"})
+    assert response.status_code == 200
+    assert not os.path.exists(conversion_cache.path(checksum, "glencoe"))
+    assert not os.path.exists(feature_model_cache.path(checksum))
+    assert b"Edited" in test_client.get("/file/view_other/99/glencoe").data
@@ -2,40 +2,31 @@ import logging
 
 from flask import render_template
 
-from app.modules.featuremodel.services import FeatureModelService
 from app.modules.public import public_bp
 from app.modules.dataset.services import DataSetService
+from app.modules.stats.services import SiteStatsService
 
 logger = logging.getLogger(__name__)
 
+dataset_service = DataSetService()
+site_stats_service = SiteStatsService()
+
 
 @public_bp.route("/")
 def index():
     logger.info("Access index")
-    dataset_service = DataSetService()
-    feature_model_service = FeatureModelService()
-
-    # Statistics: total datasets and feature models
-    datasets_counter = dataset_service.count_synchronized_datasets()
-    feature_models_counter = feature_model_service.count_feature_models()
-
-    # Statistics: total downloads
-    total_dataset_downloads = dataset_service.total_dataset_downloads()
-    total_feature_model_downloads = (
-        feature_model_service.total_feature_model_downloads()
-    )
 
-    # Statistics: total views
-    total_dataset_views = dataset_service.total_dataset_views()
-    total_feature_model_views = feature_model_service.total_feature_model_views()
+    # Statistics and latest datasets, shared by the workers for a short while
+    stats = site_stats_service.homepage()
+    counters = stats["counters"]
 
     return render_template(
         "public/index.html",
-        datasets=dataset_service.latest_synchronized(),
-        datasets_counter=datasets_counter,
-        feature_models_counter=feature_models_counter,
-        total_dataset_downloads=total_dataset_downloads,
-        total_feature_model_downloads=total_feature_model_downloads,
-        total_dataset_views=total_dataset_views,
-        total_feature_model_views=total_feature_model_views,
+        datasets=dataset_service.get_by_ids(stats["latest_dataset_ids"]),
+        datasets_counter=counters["datasets"],
+        feature_models_counter=counters["feature_models"],
+        total_dataset_downloads=counters["dataset_downloads"],
+        total_feature_model_downloads=counters["file_downloads"],
+        total_dataset_views=counters["dataset_views"],
+        total_feature_model_views=counters["file_views"],
     )
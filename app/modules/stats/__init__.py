@@ -0,0 +1,5 @@
+from core.blueprints.base_blueprint import BaseBlueprint
+
+stats_bp = BaseBlueprint("stats", __name__)
+
+from app.modules.stats import listeners  # noqa: E402,F401
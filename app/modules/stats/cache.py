@@ -0,0 +1,44 @@
+import json
+import os
+import time
+import uuid
+from typing import Optional
+
+from core.configuration.configuration import cache_folder_path
+
+
+class SharedCache:
+    """
+    A JSON value shared by every worker through a file in the cache folder,
+    fresh for ttl seconds after it was written.
+    """
+
+    def __init__(self, name: str, directory=None):
+        self.name = name
+        self._directory = directory
+
+    @property
+    def path(self) -> str:
+        return os.path.abspath(os.path.join(self._directory or cache_folder_path("shared"), f"{self.name}.json"))
+
+    def get(self, ttl: float) -> Optional[dict]:
+        try:
+            if time.time() - os.stat(self.path).st_mtime >= ttl:
+                return None
+            with open(self.path) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def set(self, value: dict):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        partial = f"{self.path}.{uuid.uuid4().hex}.partial"
+        with open(partial, "w") as file:
+            json.dump(value, file)
+        os.replace(partial, self.path)
+
+    def invalidate(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,101 @@
+from collections import Counter
+
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.base import NO_VALUE
+
+from app.modules.dataset.models import DSMetaData, DataSet
+from app.modules.stats.repositories import COUNTED_MODELS, SiteCounterRepository
+
+COUNTER_NAMES = {model: name for name, model in COUNTED_MODELS.items()}
+
+HOMEPAGE_CHANGED = "site_stats_homepage_changed"
+
+
+def _dataset_doi(connection, dataset):
+    ds_meta_data = inspect(dataset).attrs.ds_meta_data.loaded_value
+    if ds_meta_data is not NO_VALUE and ds_meta_data is not None:
+        return ds_meta_data.dataset_doi
+    return connection.execute(
+        select(DSMetaData.dataset_doi).where(DSMetaData.id == dataset.ds_meta_data_id)
+    ).scalar()
+
+
+def _has_dataset(connection, ds_meta_data) -> bool:
+    return connection.execute(
+        select(DataSet.id).where(DataSet.ds_meta_data_id == ds_meta_data.id)
+    ).first() is not None
+
+
+@event.listens_for(Session, "after_flush")
+def count_flushed_changes(session, flush_context):
+    """
+    Keeps the site counters in step with the rows the flush created and
+    deleted, within the same transaction. A dataset counts once it has a
+    DOI, so publishing one counts as well.
+    """
+    connection = session.connection()
+    deltas = Counter()
+
+    for instance in session.new:
+        if type(instance) in COUNTER_NAMES:
+            deltas[COUNTER_NAMES[type(instance)]] += 1
+        elif isinstance(instance, DataSet) and _dataset_doi(connection, instance):
+            deltas["datasets"] += 1
+
+    for instance in session.deleted:
+        if type(instance) in COUNTER_NAMES:
+            deltas[COUNTER_NAMES[type(instance)]] -= 1
+        elif isinstance(instance, DataSet) and _dataset_doi(connection, instance):
+            deltas["datasets"] -= 1
+
+    for instance in session.dirty:
+        if not isinstance(instance, DSMetaData):
+            continue
+        history = inspect(instance).attrs.dataset_doi.history
+        if not history.added or not history.deleted:
+            continue
+        published, unpublished = history.added[0] is not None, history.deleted[0] is not None
+        if published != unpublished and _has_dataset(connection, instance):
+            deltas["datasets"] += 1 if published else -1
+
+    if deltas:
+        SiteCounterRepository().increment(deltas, connection)
+    if deltas["datasets"]:
+        session.info[HOMEPAGE_CHANGED] = True
+
+
+@event.listens_for(Session, "do_orm_execute")
+def count_bulk_changes(orm_execute_state):
+    """Counts the rows of bulk inserts and deletes, which the flush never sees."""
+    if not (orm_execute_state.is_insert or orm_execute_state.is_delete):
+        return None
+    mapper = orm_execute_state.bind_mapper
+    name = COUNTER_NAMES.get(mapper.class_) if mapper is not None else None
+    if name is None:
+        return None
+
+    result = orm_execute_state.invoke_statement()
+    if orm_execute_state.is_insert:
+        parameters = orm_execute_state.parameters
+        rows = len(parameters) if isinstance(parameters, list) else 1
+    else:
+        rows = result.rowcount
+    SiteCounterRepository().increment(
+        {name: rows if orm_execute_state.is_insert else -rows},
+        orm_execute_state.session.connection(),
+    )
+    return result
+
+
+@event.listens_for(Session, "after_commit")
+def invalidate_homepage_stats(session):
+    from app.modules.stats.services import homepage_cache
+
+    if session.info.pop(HOMEPAGE_CHANGED, False):
+        homepage_cache.invalidate()
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_homepage_change(session):
+    session.info.pop(HOMEPAGE_CHANGED, None)
@@ -0,0 +1,63 @@
+from app import db
+
+
+class DatasetDailyStats(db.Model):
+    __tablename__ = "dataset_daily_stats"
+
+    dataset_id = db.Column(
+        db.Integer,
+        db.ForeignKey("data_set.id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    day = db.Column(db.Date, primary_key=True, index=True)
+    views = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    downloads = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+
+    def __repr__(self):
+        return f"DatasetDailyStats<{self.dataset_id}, {self.day}>"
+
+
+class HubfileDailyStats(db.Model):
+    __tablename__ = "file_daily_stats"
+
+    file_id = db.Column(
+        db.Integer,
+        db.ForeignKey("file.id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    day = db.Column(db.Date, primary_key=True, index=True)
+    views = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    downloads = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+
+    def __repr__(self):
+        return f"HubfileDailyStats<{self.file_id}, {self.day}>"
+
+
+class RollupWatermark(db.Model):
+    """
+    Id of the last record of a source table already added to the daily stats,
+    and the largest id seen by a previous rollup, with when it was seen.
+    """
+
+    __tablename__ = "rollup_watermark"
+
+    source = db.Column(db.String(64), primary_key=True)
+    last_id = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    seen_id = db.Column(db.Integer)
+    seen_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f"RollupWatermark<{self.source}, {self.last_id}>"
+
+
+class SiteCounter(db.Model):
+    """Exact site-wide count, kept up to date by listeners.py."""
+
+    __tablename__ = "site_counter"
+
+    name = db.Column(db.String(64), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+
+    def __repr__(self):
+        return f"SiteCounter<{self.name}={self.value}>"
@@ -0,0 +1,139 @@
+from datetime import date, datetime, timezone
+
+from sqlalchemy import func, update
+
+from app.modules.dataset.models import DSDownloadRecord, DSMetaData, DSViewRecord, DataSet
+from app.modules.featuremodel.models import FeatureModel
+from app.modules.hubfile.models import HubfileDownloadRecord, HubfileViewRecord
+from app.modules.stats.models import (
+    DatasetDailyStats,
+    HubfileDailyStats,
+    RollupWatermark,
+    SiteCounter,
+)
+from core.repositories.BaseRepository import BaseRepository
+
+# Site counters of every row of a table, "datasets" only counts the published ones
+COUNTED_MODELS = {
+    "feature_models": FeatureModel,
+    "dataset_views": DSViewRecord,
+    "dataset_downloads": DSDownloadRecord,
+    "file_views": HubfileViewRecord,
+    "file_downloads": HubfileDownloadRecord,
+}
+
+SITE_COUNTERS = ("datasets", *COUNTED_MODELS)
+
+
+class DailyStatsRepository(BaseRepository):
+    def __init__(self, model, key: str):
+        super().__init__(model)
+        self.key = key
+
+    def add_counts(self, column: str, counts: dict):
+        """Adds {(target_id, day): count} to the given column, creating the missing days."""
+        if not counts:
+            return
+        key = getattr(self.model, self.key)
+        existing = {
+            (getattr(row, self.key), row.day): row
+            for row in self.model.query.filter(
+                key.in_({target_id for target_id, _ in counts}),
+                self.model.day.in_({day for _, day in counts}),
+            )
+        }
+        for (target_id, day), count in counts.items():
+            row = existing.get((target_id, day))
+            if row is None:
+                row = self.create(commit=False, **{self.key: target_id, "day": day, "views": 0, "downloads": 0})
+            setattr(row, column, getattr(row, column) + count)
+
+    def series(self, target_id: int, start: date, end: date):
+        return (
+            self.model.query.filter(
+                getattr(self.model, self.key) == target_id,
+                self.model.day >= start,
+                self.model.day <= end,
+            )
+            .order_by(self.model.day)
+            .all()
+        )
+
+
+class DatasetDailyStatsRepository(DailyStatsRepository):
+    def __init__(self):
+        super().__init__(DatasetDailyStats, "dataset_id")
+
+
+class HubfileDailyStatsRepository(DailyStatsRepository):
+    def __init__(self):
+        super().__init__(HubfileDailyStats, "file_id")
+
+
+class RollupWatermarkRepository(BaseRepository):
+    def __init__(self):
+        super().__init__(RollupWatermark)
+
+    def lock(self, source: str) -> RollupWatermark:
+        """Watermark of a source, locked until the commit so two rollups never add the same records."""
+        query = self.model.query.filter_by(source=source).with_for_update()
+        watermark = query.first()
+        if watermark is None:
+            # Not created by the migration (e.g. a database built with create_all). Two
+            # first rollups may insert it at once, the second one ignores the duplicate
+            insert = (
+                self.model.__table__.insert()
+                .prefix_with("IGNORE", dialect="mysql")
+                .prefix_with("OR IGNORE", dialect="sqlite")
+            )
+            self.session.execute(insert, {"source": source, "last_id": 0})
+            watermark = query.first()
+        return watermark
+
+    def observe(self, watermark: RollupWatermark, seen_id: int, now: datetime):
+        watermark.seen_id = seen_id
+        watermark.seen_at = now
+
+    def advance(self, watermark: RollupWatermark, last_id: int):
+        watermark.last_id = last_id
+        watermark.updated_at = datetime.now(timezone.utc)
+
+
+class SiteCounterRepository(BaseRepository):
+    def __init__(self):
+        super().__init__(SiteCounter)
+
+    def values(self) -> dict:
+        return {counter.name: counter.value for counter in self.model.query.all()}
+
+    def increment(self, deltas: dict, connection=None):
+        """Applies {name: delta} within the current transaction, a counter not created yet is skipped."""
+        connection = connection or self.session.connection()
+        for name, delta in deltas.items():
+            if delta:
+                connection.execute(
+                    update(self.model)
+                    .where(self.model.name == name)
+                    .values(value=self.model.value + delta)
+                )
+
+    def count(self, name: str) -> int:
+        """Exact value of a counter, counted from its table."""
+        if name == "datasets":
+            return (
+                self.session.query(func.count(DataSet.id))
+                .join(DSMetaData, DataSet.ds_meta_data_id == DSMetaData.id)
+                .filter(DSMetaData.dataset_doi.isnot(None))
+                .scalar()
+            )
+        model = COUNTED_MODELS[name]
+        return self.session.query(func.count(model.id)).scalar()
+
+    def recount(self, names) -> dict:
+        """Sets the given counters to their exact value, creating them if needed."""
+        values = {}
+        for name in names:
+            values[name] = self.count(name)
+            self.session.merge(self.model(name=name, value=values[name]))
+        self.session.commit()
+        return values
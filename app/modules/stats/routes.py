@@ -0,0 +1,35 @@
+from flask import jsonify, request
+
+from app.modules.dataset.services import DataSetService
+from app.modules.hubfile.services import HubfileService
+from app.modules.stats import stats_bp
+from app.modules.stats.services import DEFAULT_SERIES_DAYS, MAX_SERIES_DAYS, StatsService
+
+stats_service = StatsService()
+
+
+def _series_days():
+    days = request.args.get("days", DEFAULT_SERIES_DAYS, type=int)
+    if days is None or not 1 <= days <= MAX_SERIES_DAYS:
+        return None
+    return days
+
+
+@stats_bp.route("/stats/dataset/<int:dataset_id>/series", methods=["GET"])
+def dataset_series(dataset_id):
+    DataSetService().get_or_404(dataset_id)
+    days = _series_days()
+    if days is None:
+        return jsonify({"error": f"days must be between 1 and {MAX_SERIES_DAYS}"}), 400
+
+    return jsonify(stats_service.dataset_series(dataset_id, days))
+
+
+@stats_bp.route("/stats/file/<int:file_id>/series", methods=["GET"])
+def file_series(file_id):
+    HubfileService().get_or_404(file_id)
+    days = _series_days()
+    if days is None:
+        return jsonify({"error": f"days must be between 1 and {MAX_SERIES_DAYS}"}), 400
+
+    return jsonify(stats_service.file_series(file_id, days))
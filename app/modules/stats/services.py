@@ -0,0 +1,205 @@
+import logging
+from datetime import date, datetime, timedelta, timezone
+from typing import NamedTuple
+
+from flask import current_app
+from sqlalchemy import func
+
+from app.modules.dataset.models import DSDownloadRecord, DSViewRecord
+from app.modules.dataset.repositories import DataSetRepository
+from app.modules.hubfile.models import HubfileDownloadRecord, HubfileViewRecord
+from app.modules.stats.cache import SharedCache
+from app.modules.stats.repositories import (
+    SITE_COUNTERS,
+    DailyStatsRepository,
+    DatasetDailyStatsRepository,
+    HubfileDailyStatsRepository,
+    RollupWatermarkRepository,
+    SiteCounterRepository,
+)
+from core.services.BaseService import BaseService
+
+logger = logging.getLogger(__name__)
+
+# Records added to the daily stats per transaction
+ROLLUP_BATCH_SIZE = 10000
+
+DEFAULT_SERIES_DAYS = 30
+
+MAX_SERIES_DAYS = 366
+
+# Homepage statistics shared by the workers, dropped when a dataset is published or deleted
+homepage_cache = SharedCache("homepage_stats")
+
+
+class RollupSource(NamedTuple):
+    record: type
+    target: str
+    date: str
+    stats: str
+    column: str
+
+
+ROLLUP_SOURCES = (
+    RollupSource(DSViewRecord, "dataset_id", "view_date", "dataset", "views"),
+    RollupSource(DSDownloadRecord, "dataset_id", "download_date", "dataset", "downloads"),
+    RollupSource(HubfileViewRecord, "file_id", "view_date", "file", "views"),
+    RollupSource(HubfileDownloadRecord, "file_id", "download_date", "file", "downloads"),
+)
+
+
+def _as_date(value) -> date:
+    # DATE() gives a string on SQLite
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+
+class StatsService(BaseService):
+    """
+    Daily view and download counts per dataset and per file, rolled up from
+    the record tables. Each source table has a watermark with the id of its
+    last record already counted, so a rollup only reads the records added
+    since the previous one, held back by STATS_ROLLUP_LAG.
+    """
+
+    def __init__(self):
+        super().__init__(DatasetDailyStatsRepository())
+        self.file_stats_repository = HubfileDailyStatsRepository()
+        self.watermark_repository = RollupWatermarkRepository()
+
+    def stats_repository(self, source: RollupSource) -> DailyStatsRepository:
+        return self.repository if source.stats == "dataset" else self.file_stats_repository
+
+    def rollup(self, batch_size=ROLLUP_BATCH_SIZE) -> dict:
+        """Adds the new records of every source, returning how many were read per table."""
+        processed = {}
+        for source in ROLLUP_SOURCES:
+            processed[source.record.__tablename__] = 0
+            up_to = self._rollup_limit(source)
+            while count := self._rollup_batch(source, batch_size, up_to):
+                processed[source.record.__tablename__] += count
+        return processed
+
+    def _rollup_limit(self, source: RollupSource) -> int:
+        """
+        Largest record id this rollup may count. Auto-increment ids are not
+        committed in order, a transaction holding a lower id can commit after
+        a higher one is visible and would be skipped once the watermark has
+        passed it. So a rollup only counts up to the largest id a previous one
+        saw at least STATS_ROLLUP_LAG seconds ago, by then every transaction
+        holding a lower id has committed.
+        """
+        session = self.repository.session
+        record = source.record
+        lag = timedelta(seconds=current_app.config["STATS_ROLLUP_LAG"])
+        watermark = self.watermark_repository.lock(record.__tablename__)
+        latest = session.query(func.max(record.id)).scalar() or 0
+
+        if not lag:
+            up_to = latest
+        else:
+            now = datetime.now(timezone.utc).replace(tzinfo=None)
+            ready = watermark.seen_at is not None and now - watermark.seen_at >= lag
+            up_to = watermark.seen_id if ready else watermark.last_id
+            # The first observation is kept until it is old enough
+            if ready or watermark.seen_at is None:
+                self.watermark_repository.observe(watermark, latest, now)
+        up_to = max(up_to or 0, watermark.last_id)
+        session.commit()
+        return up_to
+
+    def _rollup_batch(self, source: RollupSource, batch_size: int, up_to: int) -> int:
+        session = self.repository.session
+        record = source.record
+        watermark = self.watermark_repository.lock(record.__tablename__)
+
+        new_records = session.query(record.id).filter(record.id > watermark.last_id, record.id <= up_to)
+        last_id = (
+            new_records.order_by(record.id).offset(batch_size - 1).limit(1).scalar()
+            or new_records.with_entities(func.max(record.id)).scalar()
+        )
+        if last_id is None:
+            session.commit()
+            return 0
+
+        target = getattr(record, source.target)
+        day = func.date(getattr(record, source.date))
+        in_batch = (record.id > watermark.last_id, record.id <= last_id)
+        counts = {
+            (target_id, _as_date(record_day)): count
+            for target_id, record_day, count in session.query(target, day, func.count(record.id))
+            .filter(*in_batch, target.isnot(None))
+            .group_by(target, day)
+        }
+        read = session.query(func.count(record.id)).filter(*in_batch).scalar()
+
+        # The counts and the watermark are committed together, a failed batch is simply retried
+        self.stats_repository(source).add_counts(source.column, counts)
+        self.watermark_repository.advance(watermark, last_id)
+        session.commit()
+        return read
+
+    def dataset_series(self, dataset_id: int, days=DEFAULT_SERIES_DAYS) -> dict:
+        return self._series(self.repository, dataset_id, days)
+
+    def file_series(self, file_id: int, days=DEFAULT_SERIES_DAYS) -> dict:
+        return self._series(self.file_stats_repository, file_id, days)
+
+    @staticmethod
+    def _series(repository: DailyStatsRepository, target_id: int, days: int) -> dict:
+        end = datetime.now(timezone.utc).date()
+        start = end - timedelta(days=days - 1)
+        rows = {row.day: row for row in repository.series(target_id, start, end)}
+
+        series = []
+        for offset in range(days):
+            day = start + timedelta(days=offset)
+            row = rows.get(day)
+            series.append(
+                {
+                    "date": day.isoformat(),
+                    "views": row.views if row else 0,
+                    "downloads": row.downloads if row else 0,
+                }
+            )
+
+        return {
+            repository.key: target_id,
+            "from": start.isoformat(),
+            "to": end.isoformat(),
+            "total_views": sum(point["views"] for point in series),
+            "total_downloads": sum(point["downloads"] for point in series),
+            "series": series,
+        }
+
+
+class SiteStatsService(BaseService):
+    def __init__(self):
+        super().__init__(SiteCounterRepository())
+        self.dataset_repository = DataSetRepository()
+
+    def counters(self) -> dict:
+        values = self.repository.values()
+        missing = [name for name in SITE_COUNTERS if name not in values]
+        if missing:
+            # Not created by the migration (e.g. a database built with create_all)
+            values.update(self.repository.recount(missing))
+        return values
+
+    def homepage(self) -> dict:
+        """Site counters and ids of the latest published datasets, cached for HOMEPAGE_STATS_TTL seconds."""
+        stats = homepage_cache.get(current_app.config["HOMEPAGE_STATS_TTL"])
+        if stats is None:
+            stats = {
+                "counters": self.counters(),
+                "latest_dataset_ids": self.dataset_repository.latest_synchronized_ids(),
+            }
+            try:
+                homepage_cache.set(stats)
+            except OSError:
+                logger.exception("Could not share the homepage statistics")
+        return stats
+
+    def recount(self) -> dict:
+        values = self.repository.recount(SITE_COUNTERS)
+        homepage_cache.invalidate()
+        return values
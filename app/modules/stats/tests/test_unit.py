@@ -0,0 +1,155 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app import db
+from app.modules.dataset.models import DSDownloadRecord, DSMetaData, DSViewRecord, DataSet, PublicationType
+from app.modules.featuremodel.models import FeatureModel
+from app.modules.hubfile.models import Hubfile, HubfileViewRecord
+from app.modules.dataset.services import DSMetaDataService
+from app.modules.dataset.tracking import write_records
+from app.modules.stats.models import DatasetDailyStats
+from app.modules.stats.repositories import SITE_COUNTERS
+from app.modules.stats.services import SiteStatsService, StatsService, homepage_cache
+
+
+@pytest.fixture(scope="module")
+def test_client(test_client):
+    with test_client.application.app_context():
+        dsmetadata = DSMetaData(
+            id=1,
+            title="Stats dataset",
+            description="Stats description",
+            publication_type=PublicationType.JOURNAL_ARTICLE,
+        )
+        db.session.add(dsmetadata)
+        db.session.add(DataSet(id=1, user_id=1, ds_meta_data_id=1))
+        db.session.add(FeatureModel(id=1, data_set_id=1))
+        db.session.add(Hubfile(id=1, name="model.uvl", checksum="abc", size=10, feature_model_id=1))
+        db.session.commit()
+
+    yield test_client
+
+
+def _today():
+    return datetime.now(timezone.utc).replace(hour=12, tzinfo=None)
+
+
+def _add_records(view_days, download_days, cookie):
+    for days_ago in view_days:
+        db.session.add(
+            DSViewRecord(dataset_id=1, view_date=_today() - timedelta(days=days_ago), view_cookie=cookie)
+        )
+    for days_ago in download_days:
+        db.session.add(
+            DSDownloadRecord(dataset_id=1, download_date=_today() - timedelta(days=days_ago), download_cookie=cookie)
+        )
+    db.session.commit()
+
+
+def test_rollup_only_reads_new_records(test_client):
+    _add_records(view_days=[0, 0, 1], download_days=[1], cookie="first")
+    db.session.add(HubfileViewRecord(file_id=1, view_date=_today(), view_cookie="first"))
+    db.session.commit()
+
+    processed = StatsService().rollup(batch_size=2)
+    assert processed == {
+        "ds_view_record": 3,
+        "ds_download_record": 1,
+        "file_view_record": 1,
+        "file_download_record": 0,
+    }
+    assert StatsService().rollup()["ds_view_record"] == 0
+
+    _add_records(view_days=[0], download_days=[0], cookie="second")
+    assert StatsService().rollup()["ds_view_record"] == 1
+
+    today = DatasetDailyStats.query.filter_by(dataset_id=1, day=_today().date()).one()
+    yesterday = DatasetDailyStats.query.filter_by(dataset_id=1, day=_today().date() - timedelta(days=1)).one()
+    assert (today.views, today.downloads) == (3, 1)
+    assert (yesterday.views, yesterday.downloads) == (1, 1)
+
+
+def test_rollup_waits_for_the_ids_to_be_old_enough(test_client, monkeypatch):
+    from app.modules.stats.models import RollupWatermark
+
+    monkeypatch.setitem(test_client.application.config, "STATS_ROLLUP_LAG", 300)
+    _add_records(view_days=[], download_days=[5], cookie="late")
+
+    # Seen now, counted once no transaction holding a lower id can still commit
+    assert StatsService().rollup()["ds_download_record"] == 0
+    assert StatsService().rollup()["ds_download_record"] == 0
+    watermark = db.session.get(RollupWatermark, "ds_download_record")
+    watermark.seen_at -= timedelta(seconds=301)
+    db.session.commit()
+    assert StatsService().rollup()["ds_download_record"] == 1
+
+    day = _today().date() - timedelta(days=5)
+    assert DatasetDailyStats.query.filter_by(dataset_id=1, day=day).one().downloads == 1
+
+
+def test_dataset_series(test_client):
+    response = test_client.get("/stats/dataset/1/series?days=3")
+    assert response.status_code == 200
+
+    data = response.get_json()
+    assert [point["views"] for point in data["series"]] == [0, 1, 3]
+    assert [point["downloads"] for point in data["series"]] == [0, 1, 1]
+    assert data["to"] == _today().date().isoformat()
+    assert (data["total_views"], data["total_downloads"]) == (4, 2)
+
+    response = test_client.get("/stats/file/1/series?days=1")
+    assert response.get_json()["series"][0]["views"] == 1
+
+    assert test_client.get("/stats/dataset/1/series?days=0").status_code == 400
+    assert test_client.get("/stats/dataset/999/series").status_code == 404
+
+
+def test_site_counters_follow_the_writes(test_client):
+    service = SiteStatsService()
+    before = service.counters()
+
+    feature_model = FeatureModel(data_set_id=1)
+    db.session.add(feature_model)
+    db.session.commit()
+    assert service.counters()["feature_models"] == before["feature_models"] + 1
+
+    db.session.delete(feature_model)
+    db.session.commit()
+    assert service.counters()["feature_models"] == before["feature_models"]
+
+    write_records({"dataset_view": {(None, 1, "counted-a"): _today(), (None, 1, "counted-b"): _today()}})
+    assert service.counters()["dataset_views"] == before["dataset_views"] + 2
+
+    DSMetaDataService().update(1, dataset_doi="10.1234/stats")
+    assert service.counters()["datasets"] == before["datasets"] + 1
+    DSMetaDataService().update(1, dataset_doi=None)
+    assert service.counters()["datasets"] == before["datasets"]
+
+    assert service.counters() == service.repository.recount(SITE_COUNTERS)
+
+
+def test_homepage_stats_are_shared_until_a_dataset_is_published(test_client, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    service = SiteStatsService()
+
+    first = service.homepage()
+    assert first["latest_dataset_ids"] == []
+    assert test_client.get("/").status_code == 200
+
+    # Views alone do not invalidate, the page is served from the cache until it expires
+    write_records({"dataset_view": {(None, 1, "cached"): _today()}})
+    assert service.homepage() == first
+
+    DSMetaDataService().update(1, dataset_doi="10.1234/stats", tags="stats")
+    published = service.homepage()
+    assert published["latest_dataset_ids"] == [1]
+    assert published["counters"]["datasets"] == first["counters"]["datasets"] + 1
+    assert published["counters"]["dataset_views"] == first["counters"]["dataset_views"] + 1
+
+    response = test_client.get("/")
+    assert response.status_code == 200
+    assert b"Stats dataset" in response.data
+
+    DSMetaDataService().update(1, dataset_doi=None)
+    assert homepage_cache.get(60) is None
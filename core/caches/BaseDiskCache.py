@@ -0,0 +1,96 @@
+import os
+import time
+import uuid
+from typing import Callable, Optional
+
+from flask import current_app
+
+from core.configuration.configuration import cache_folder_path
+
+# Partial files left behind by a crashed worker are removed after this age
+STALE_PARTIAL_SECONDS = 60 * 60
+
+
+class BaseDiskCache:
+    """
+    Entries kept as files in a folder of the cache folder, shared by the
+    workers and evicted least recently used first once they exceed
+    max_bytes. The modification time of an entry doubles as its last use.
+
+    Subclasses name the folder, the setting bounding its size and the
+    suffixes of their entries. Entries are written to a partial file first
+    and moved in place once complete.
+    """
+
+    folder: str
+    max_bytes_setting: str
+    suffixes: tuple[str, ...]
+
+    def __init__(self, directory=None, max_bytes=None):
+        self._directory = directory
+        self._max_bytes = max_bytes
+
+    @property
+    def directory(self) -> str:
+        return os.path.abspath(self._directory or cache_folder_path(self.folder))
+
+    @property
+    def max_bytes(self) -> int:
+        if self._max_bytes is not None:
+            return self._max_bytes
+        return current_app.config[self.max_bytes_setting]
+
+    def evict(self, max_bytes=None):
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = []
+        now = time.time()
+        for entry in os.scandir(self.directory) if os.path.isdir(self.directory) else []:
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            if entry.name.endswith(".partial"):
+                if now - stat.st_mtime > STALE_PARTIAL_SECONDS:
+                    self._remove(entry.path)
+            elif entry.name.endswith(self.suffixes):
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    @staticmethod
+    def _touch(path: str) -> Optional[str]:
+        """Marks the entry as just used, returns its path unless it does not exist."""
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def _partial_path(self, path: str) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        return os.path.join(self.directory, f".{os.path.basename(path)}.{uuid.uuid4().hex}.partial")
+
+    def _write(self, path: str, write: Callable[[str], None]):
+        """Writes through write(partial) to a partial file, moves it to path and evicts."""
+        partial = self._partial_path(path)
+        try:
+            write(partial)
+            os.replace(partial, path)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+
+        self.evict()
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # Already evicted by another worker
+            pass
@@ -8,6 +8,15 @@ def uploads_folder_name():
     return os.getenv("UPLOADS_DIR", "uploads")
 
 
+def cache_folder_name():
+    return os.getenv("CACHE_DIR", "cache")
+
+
+def cache_folder_path(*paths):
+    """Absolute path inside the cache folder shared by all the app workers."""
+    return os.path.join(os.getenv("WORKING_DIR", ""), cache_folder_name(), *paths)
+
+
 def get_app_version():
     version_file_path = os.path.join(os.getenv("WORKING_DIR", ""), ".version")
     try:
@@ -0,0 +1,89 @@
+import mimetypes
+import os
+import unicodedata
+from typing import Optional
+from urllib.parse import quote
+
+from flask import Response, current_app, request, send_file
+from werkzeug.exceptions import NotFound
+
+from core.configuration.configuration import cache_folder_name, uploads_folder_name
+
+# Internal nginx locations (see docker/nginx) serving the folders below the working dir
+ACCEL_LOCATIONS = {
+    "/internal/uploads/": uploads_folder_name,
+    "/internal/cache/": cache_folder_name,
+}
+
+
+def not_modified(etag: str) -> Optional[Response]:
+    """
+    304 answer when the client already holds this version of the resource,
+    so a revalidation is answered before reading any file or writing any record.
+    """
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        response.cache_control.no_cache = True
+        return response
+    return None
+
+
+def revalidate(response: Response, etag: str) -> Response:
+    """Tags a response with a strong ETag that clients must revalidate before reuse."""
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response
+
+
+def attachment_options(filename: str) -> dict:
+    """Content-Disposition parameters of a download, encoded as send_file does."""
+    try:
+        filename.encode("ascii")
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize("NFKD", filename)
+        simple = simple.encode("ascii", "ignore").decode("ascii")
+        quoted = quote(filename, safe="!#$&+^`|~")
+        return {"filename": simple, "filename*": f"UTF-8''{quoted}"}
+    return {"filename": filename}
+
+
+def accel_location(path: str) -> Optional[str]:
+    """Internal nginx URI of a file, or None when nginx does not serve its folder."""
+    path = os.path.abspath(path)
+    for location, folder_name in ACCEL_LOCATIONS.items():
+        root = os.path.abspath(os.path.join(os.getenv("WORKING_DIR", ""), folder_name()))
+        if os.path.commonpath([root, path]) == root:
+            return location + quote(os.path.relpath(path, root))
+    return None
+
+
+def send_download(path: str, download_name: str, mimetype=None, etag=None) -> Response:
+    """
+    Sends a file as an attachment. With X_ACCEL_REDIRECT enabled, files under
+    the uploads and cache folders are handed over to nginx instead, which
+    sends them (ranges and conditional requests included) while the worker
+    is already free. Everything else of the response, cookies included, is
+    still set by Flask.
+    """
+    if not os.path.isfile(path):
+        raise NotFound()
+
+    location = accel_location(path) if current_app.config["X_ACCEL_REDIRECT"] else None
+    if location is None:
+        return send_file(
+            path,
+            mimetype=mimetype,
+            as_attachment=True,
+            download_name=download_name,
+            etag=etag if etag is not None else True,
+        )
+
+    response = Response(
+        mimetype=mimetype or mimetypes.guess_type(download_name)[0] or "application/octet-stream"
+    )
+    response.headers.set("Content-Disposition", "attachment", **attachment_options(download_name))
+    response.headers["X-Accel-Redirect"] = location
+    if etag is not None:
+        response.set_etag(etag)
+    return response
@@ -33,6 +33,30 @@ class Config:
     TIMEZONE = "Europe/Madrid"
     TEMPLATES_AUTO_RELOAD = True
     UPLOAD_FOLDER = "uploads"
+    EXPLORE_CACHE_TTL = int(os.getenv("EXPLORE_CACHE_TTL", 60))
+    EXPLORE_CACHE_SIZE = int(os.getenv("EXPLORE_CACHE_SIZE", 512))
+    ARCHIVE_CACHE_MAX_BYTES = int(os.getenv("ARCHIVE_CACHE_MAX_BYTES", 1024**3))
+    CONVERSION_CACHE_MAX_BYTES = int(os.getenv("CONVERSION_CACHE_MAX_BYTES", 256 * 1024**2))
+    FEATURE_MODEL_CACHE_MAX_BYTES = int(os.getenv("FEATURE_MODEL_CACHE_MAX_BYTES", 64 * 1024**2))
+    FEATURE_MODEL_CACHE_DISK_MAX_BYTES = int(os.getenv("FEATURE_MODEL_CACHE_DISK_MAX_BYTES", 512 * 1024**2))
+    BDD_CACHE_MAX_BYTES = int(os.getenv("BDD_CACHE_MAX_BYTES", 256 * 1024**2))
+    BDD_MEMORY_CACHE_SIZE = int(os.getenv("BDD_MEMORY_CACHE_SIZE", 64))
+    BDD_COMPILE_TIMEOUT = float(os.getenv("BDD_COMPILE_TIMEOUT", 10))
+    BDD_MAX_NODES = int(os.getenv("BDD_MAX_NODES", 2_000_000))
+    CONVERSION_POOL_SIZE = int(os.getenv("CONVERSION_POOL_SIZE", min(os.cpu_count() or 1, 4)))
+    CONVERSION_TIMEOUT = float(os.getenv("CONVERSION_TIMEOUT", 60))
+    BULK_DOWNLOAD_MAX_DATASETS = int(os.getenv("BULK_DOWNLOAD_MAX_DATASETS", 100))
+    BULK_DOWNLOAD_CONCURRENCY = int(os.getenv("BULK_DOWNLOAD_CONCURRENCY", 4))
+    DATASETS_SNAPSHOT = os.getenv("DATASETS_SNAPSHOT", "false").lower() == "true"
+    X_ACCEL_REDIRECT = os.getenv("X_ACCEL_REDIRECT", "false").lower() == "true"
+    TRACKING_WRITE_BEHIND = os.getenv("TRACKING_WRITE_BEHIND", "true").lower() == "true"
+    TRACKING_BATCH_SIZE = int(os.getenv("TRACKING_BATCH_SIZE", 500))
+    TRACKING_FLUSH_INTERVAL = float(os.getenv("TRACKING_FLUSH_INTERVAL", 5))
+    TRACKING_FILTER_CAPACITY = int(os.getenv("TRACKING_FILTER_CAPACITY", 1_000_000))
+    TRACKING_FILTER_ERROR_RATE = float(os.getenv("TRACKING_FILTER_ERROR_RATE", 0.01))
+    HOMEPAGE_STATS_TTL = int(os.getenv("HOMEPAGE_STATS_TTL", 60))
+    STATS_ROLLUP_LAG = int(os.getenv("STATS_ROLLUP_LAG", 300))
+    METRICS_BACKGROUND = os.getenv("METRICS_BACKGROUND", "true").lower() == "true"
 
 
 class DevelopmentConfig(Config):
@@ -49,6 +73,12 @@ class TestingConfig(Config):
         f"{os.getenv('MARIADB_TEST_DATABASE', 'default_db')}"
     )
     WTF_CSRF_ENABLED = False
+    # Records are written within the request, so tests can assert on them
+    TRACKING_WRITE_BEHIND = False
+    # Feature model metrics are computed within the request as well
+    METRICS_BACKGROUND = False
+    # Records are committed within the request, rollups count them right away
+    STATS_ROLLUP_LAG = 0
 
 
 class ProductionConfig(Config):
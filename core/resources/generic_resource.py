@@ -12,19 +12,24 @@ def convert_value(value):
 
 
 class GenericResource(Resource):
-    def __init__(self, model, serializer):
+    def __init__(self, model, serializer, query_options=None):
         self.model = model
         self.model_name = model.__name__
         self.serializer = serializer
+        # Callable returning loader options, evaluated lazily so mappers are configured by then
+        self.query_options = query_options
 
     def get(self, id=None):
+        query = self.model.query
+        if self.query_options:
+            query = query.options(*self.query_options())
         if id:
-            item = self.model.query.get(id)
+            item = query.get(id)
             if not item:
                 return {"message": f"{self.model_name} not found"}, 404
             return self.serializer.serialize(item), 200
         else:
-            items = self.model.query.all()
+            items = query.all()
             return {"items": [self.serializer.serialize(i) for i in items]}, 200
 
     def post(self):
@@ -69,9 +74,9 @@ class GenericResource(Resource):
         return {"message": f"{self.model_name} deleted successfully"}, 204
 
 
-def create_resource(model, serialization_fields=None):
+def create_resource(model, serialization_fields=None, query_options=None):
     class Resource(GenericResource):
         def __init__(self):
-            super().__init__(model, serialization_fields)
+            super().__init__(model, serialization_fields, query_options)
 
     return Resource
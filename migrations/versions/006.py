@@ -0,0 +1,110 @@
+"""Add search_index_entry table and index the existing datasets
+
+Revision ID: 006
+Revises: 2dd2188ad6d3
+Create Date: 2026-10-18 10:12:41.208315
+
+"""
+
+import re
+from collections import Counter
+
+from alembic import op
+import sqlalchemy as sa
+import unidecode
+
+
+# revision identifiers, used by Alembic.
+revision = "006"
+down_revision = "2dd2188ad6d3"
+branch_labels = None
+depends_on = None
+
+# Frozen copy of the tokenizer in app.modules.explore.search at this revision
+FIELD_WEIGHTS = {
+    "title": 5,
+    "tags": 3,
+    "author": 3,
+    "description": 1,
+}
+
+MAX_TERM_LENGTH = 64
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    normalized = unidecode.unidecode(text).lower() if text else ""
+    return [token[:MAX_TERM_LENGTH] for token in TOKEN_PATTERN.findall(normalized)]
+
+
+def build_postings(fields):
+    postings = []
+    for field, texts in fields.items():
+        counter = Counter()
+        for text in texts:
+            counter.update(tokenize(text))
+        for term, occurrences in counter.items():
+            postings.append({"term": term, "field": field, "weight": FIELD_WEIGHTS[field] * occurrences})
+    return postings
+
+
+def upgrade():
+    search_index_entry = op.create_table(
+        "search_index_entry",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("term", sa.String(length=64), nullable=False),
+        sa.Column("dataset_id", sa.Integer(), nullable=False),
+        sa.Column("field", sa.String(length=16), nullable=False),
+        sa.Column("weight", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(["dataset_id"], ["data_set.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    with op.batch_alter_table("search_index_entry", schema=None) as batch_op:
+        batch_op.create_index(
+            "ix_search_index_entry_dataset_id", ["dataset_id"], unique=False
+        )
+        batch_op.create_index(
+            "ix_search_index_entry_term", ["term", "dataset_id"], unique=False
+        )
+
+    # Index the datasets that already exist
+    connection = op.get_bind()
+    authors = {}
+    for ds_meta_data_id, name in connection.execute(
+        sa.text(
+            "SELECT ds_meta_data_id, name FROM author WHERE ds_meta_data_id IS NOT NULL"
+        )
+    ):
+        authors.setdefault(ds_meta_data_id, []).append(name)
+
+    entries = []
+    for dataset_id, ds_meta_data_id, title, description, tags in connection.execute(
+        sa.text(
+            "SELECT data_set.id, ds_meta_data.id, ds_meta_data.title, "
+            "ds_meta_data.description, ds_meta_data.tags "
+            "FROM data_set JOIN ds_meta_data ON data_set.ds_meta_data_id = ds_meta_data.id"
+        )
+    ):
+        postings = build_postings(
+            {
+                "title": [title],
+                "description": [description],
+                "tags": [tags or ""],
+                "author": authors.get(ds_meta_data_id, []),
+            }
+        )
+        for posting in postings:
+            posting["dataset_id"] = dataset_id
+        entries.extend(postings)
+
+    if entries:
+        op.bulk_insert(search_index_entry, entries)
+
+
+def downgrade():
+    with op.batch_alter_table("search_index_entry", schema=None) as batch_op:
+        batch_op.drop_index("ix_search_index_entry_term")
+        batch_op.drop_index("ix_search_index_entry_dataset_id")
+
+    op.drop_table("search_index_entry")
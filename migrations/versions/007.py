@@ -0,0 +1,51 @@
+"""Add view and download counters to data_set
+
+Revision ID: 007
+Revises: 006
+Create Date: 2026-10-18 11:02:17.553904
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "007"
+down_revision = "006"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("data_set", schema=None) as batch_op:
+        batch_op.add_column(
+            sa.Column("view_count", sa.Integer(), server_default="0", nullable=False)
+        )
+        batch_op.add_column(
+            sa.Column(
+                "download_count", sa.Integer(), server_default="0", nullable=False
+            )
+        )
+        batch_op.create_index(
+            "ix_data_set_view_count", ["view_count", "id"], unique=False
+        )
+        batch_op.create_index(
+            "ix_data_set_download_count", ["download_count", "id"], unique=False
+        )
+
+    op.execute(
+        "UPDATE data_set SET "
+        "view_count = (SELECT COUNT(*) FROM ds_view_record "
+        "WHERE ds_view_record.dataset_id = data_set.id), "
+        "download_count = (SELECT COUNT(*) FROM ds_download_record "
+        "WHERE ds_download_record.dataset_id = data_set.id)"
+    )
+
+
+def downgrade():
+    with op.batch_alter_table("data_set", schema=None) as batch_op:
+        batch_op.drop_index("ix_data_set_download_count")
+        batch_op.drop_index("ix_data_set_view_count")
+        batch_op.drop_column("download_count")
+        batch_op.drop_column("view_count")
@@ -0,0 +1,85 @@
+"""Add tag and dataset_tag tables and backfill them from ds_meta_data.tags
+
+Revision ID: 008
+Revises: 007
+Create Date: 2026-10-18 11:48:05.901226
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "008"
+down_revision = "007"
+branch_labels = None
+depends_on = None
+
+# Frozen copy of the tag parser in app.modules.explore.search at this revision
+MAX_TAG_LENGTH = 120
+
+
+def parse_tags(tags_str):
+    tags = []
+    for tag in (tags_str or "").split(","):
+        tag = " ".join(tag.lower().split())[:MAX_TAG_LENGTH]
+        if tag and tag not in tags:
+            tags.append(tag)
+    return tags
+
+
+def upgrade():
+    tag = op.create_table(
+        "tag",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("name", sa.String(length=120), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("name"),
+    )
+    dataset_tag = op.create_table(
+        "dataset_tag",
+        sa.Column("dataset_id", sa.Integer(), nullable=False),
+        sa.Column("tag_id", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(["dataset_id"], ["data_set.id"], ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["tag_id"], ["tag.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("dataset_id", "tag_id"),
+    )
+    with op.batch_alter_table("dataset_tag", schema=None) as batch_op:
+        batch_op.create_index("ix_dataset_tag_tag_id", ["tag_id"], unique=False)
+
+    # Backfill from the free-text tags of the existing datasets
+    connection = op.get_bind()
+    tags_by_dataset = {
+        dataset_id: parse_tags(tags)
+        for dataset_id, tags in connection.execute(
+            sa.text(
+                "SELECT data_set.id, ds_meta_data.tags FROM data_set "
+                "JOIN ds_meta_data ON data_set.ds_meta_data_id = ds_meta_data.id"
+            )
+        )
+    }
+
+    names = sorted({name for names in tags_by_dataset.values() for name in names})
+    if not names:
+        return
+
+    op.bulk_insert(tag, [{"name": name} for name in names])
+    tag_ids = dict(connection.execute(sa.text("SELECT name, id FROM tag")).fetchall())
+
+    op.bulk_insert(
+        dataset_tag,
+        [
+            {"dataset_id": dataset_id, "tag_id": tag_ids[name]}
+            for dataset_id, names in tags_by_dataset.items()
+            for name in names
+        ],
+    )
+
+
+def downgrade():
+    with op.batch_alter_table("dataset_tag", schema=None) as batch_op:
+        batch_op.drop_index("ix_dataset_tag_tag_id")
+
+    op.drop_table("dataset_tag")
+    op.drop_table("tag")
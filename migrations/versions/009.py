@@ -0,0 +1,39 @@
+"""Add author_count to ds_meta_data
+
+Revision ID: 009
+Revises: 008
+Create Date: 2026-10-18 16:41:08.274519
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "009"
+down_revision = "008"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("ds_meta_data", schema=None) as batch_op:
+        batch_op.add_column(
+            sa.Column("author_count", sa.Integer(), server_default="0", nullable=False)
+        )
+        batch_op.create_index(
+            batch_op.f("ix_ds_meta_data_author_count"), ["author_count"], unique=False
+        )
+
+    op.execute(
+        "UPDATE ds_meta_data SET "
+        "author_count = (SELECT COUNT(*) FROM author "
+        "WHERE author.ds_meta_data_id = ds_meta_data.id)"
+    )
+
+
+def downgrade():
+    with op.batch_alter_table("ds_meta_data", schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f("ix_ds_meta_data_author_count"))
+        batch_op.drop_column("author_count")
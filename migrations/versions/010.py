@@ -0,0 +1,61 @@
+"""Add daily view and download stats of datasets and files
+
+Revision ID: 010
+Revises: 009
+Create Date: 2026-10-18 21:12:44.610392
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "010"
+down_revision = "009"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "dataset_daily_stats",
+        sa.Column("dataset_id", sa.Integer(), nullable=False),
+        sa.Column("day", sa.Date(), nullable=False),
+        sa.Column("views", sa.Integer(), server_default="0", nullable=False),
+        sa.Column("downloads", sa.Integer(), server_default="0", nullable=False),
+        sa.ForeignKeyConstraint(["dataset_id"], ["data_set.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("dataset_id", "day"),
+    )
+    with op.batch_alter_table("dataset_daily_stats", schema=None) as batch_op:
+        batch_op.create_index(batch_op.f("ix_dataset_daily_stats_day"), ["day"], unique=False)
+
+    op.create_table(
+        "file_daily_stats",
+        sa.Column("file_id", sa.Integer(), nullable=False),
+        sa.Column("day", sa.Date(), nullable=False),
+        sa.Column("views", sa.Integer(), server_default="0", nullable=False),
+        sa.Column("downloads", sa.Integer(), server_default="0", nullable=False),
+        sa.ForeignKeyConstraint(["file_id"], ["file.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("file_id", "day"),
+    )
+    with op.batch_alter_table("file_daily_stats", schema=None) as batch_op:
+        batch_op.create_index(batch_op.f("ix_file_daily_stats_day"), ["day"], unique=False)
+
+    op.create_table(
+        "rollup_watermark",
+        sa.Column("source", sa.String(length=64), nullable=False),
+        sa.Column("last_id", sa.Integer(), server_default="0", nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("source"),
+    )
+
+
+def downgrade():
+    op.drop_table("rollup_watermark")
+    with op.batch_alter_table("file_daily_stats", schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f("ix_file_daily_stats_day"))
+    op.drop_table("file_daily_stats")
+    with op.batch_alter_table("dataset_daily_stats", schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f("ix_dataset_daily_stats_day"))
+    op.drop_table("dataset_daily_stats")
@@ -0,0 +1,49 @@
+"""Add site_counter with the exact site-wide counts
+
+Revision ID: 011
+Revises: 010
+Create Date: 2026-10-18 23:05:17.342871
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "011"
+down_revision = "010"
+branch_labels = None
+depends_on = None
+
+COUNTS = {
+    "datasets": (
+        "SELECT COUNT(*) FROM data_set "
+        "JOIN ds_meta_data ON data_set.ds_meta_data_id = ds_meta_data.id "
+        "WHERE ds_meta_data.dataset_doi IS NOT NULL"
+    ),
+    "feature_models": "SELECT COUNT(*) FROM feature_model",
+    "dataset_views": "SELECT COUNT(*) FROM ds_view_record",
+    "dataset_downloads": "SELECT COUNT(*) FROM ds_download_record",
+    "file_views": "SELECT COUNT(*) FROM file_view_record",
+    "file_downloads": "SELECT COUNT(*) FROM file_download_record",
+}
+
+
+def upgrade():
+    site_counter = op.create_table(
+        "site_counter",
+        sa.Column("name", sa.String(length=64), nullable=False),
+        sa.Column("value", sa.Integer(), server_default="0", nullable=False),
+        sa.PrimaryKeyConstraint("name"),
+    )
+
+    connection = op.get_bind()
+    op.bulk_insert(
+        site_counter,
+        [{"name": name, "value": connection.execute(sa.text(query)).scalar()} for name, query in COUNTS.items()],
+    )
+
+
+def downgrade():
+    op.drop_table("site_counter")
@@ -0,0 +1,33 @@
+"""Add uvl_validation with the syntax check results by checksum
+
+Revision ID: 012
+Revises: 011
+Create Date: 2026-10-19 10:24:51.118046
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "012"
+down_revision = "011"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "uvl_validation",
+        sa.Column("checksum", sa.String(length=120), nullable=False),
+        sa.Column("grammar_version", sa.String(length=32), nullable=False),
+        sa.Column("valid", sa.Boolean(), nullable=False),
+        sa.Column("errors", sa.JSON(), nullable=False),
+        sa.Column("validated_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("checksum", "grammar_version"),
+    )
+
+
+def downgrade():
+    op.drop_table("uvl_validation")
@@ -0,0 +1,68 @@
+"""Add the computed feature model metrics to fm_metrics and ds_metrics
+
+Revision ID: 013
+Revises: 012
+Create Date: 2026-10-19 18:42:09.530127
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "013"
+down_revision = "012"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("fm_metrics", schema=None) as batch_op:
+        batch_op.add_column(sa.Column("checksum", sa.String(length=120), nullable=True))
+        batch_op.add_column(sa.Column("number_of_features", sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column("number_of_constraints", sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column("tree_depth", sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column("ctc_ratio", sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column("error", sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column("computed_at", sa.DateTime(), nullable=True))
+
+    # The rows there are only hold the constants of the seeder, shared by several
+    # datasets; `rosemary metrics:compute` fills the real values in
+    op.execute("UPDATE ds_meta_data SET ds_metrics_id = NULL")
+    op.execute("DELETE FROM ds_metrics")
+
+    with op.batch_alter_table("ds_metrics", schema=None) as batch_op:
+        batch_op.alter_column(
+            "number_of_models", existing_type=sa.String(length=120), type_=sa.Integer(), existing_nullable=True
+        )
+        batch_op.alter_column(
+            "number_of_features", existing_type=sa.String(length=120), type_=sa.Integer(), existing_nullable=True
+        )
+        batch_op.add_column(sa.Column("number_of_constraints", sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column("max_tree_depth", sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column("computed_at", sa.DateTime(), nullable=True))
+        batch_op.create_index(batch_op.f("ix_ds_metrics_number_of_features"), ["number_of_features"], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table("ds_metrics", schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f("ix_ds_metrics_number_of_features"))
+        batch_op.drop_column("computed_at")
+        batch_op.drop_column("max_tree_depth")
+        batch_op.drop_column("number_of_constraints")
+        batch_op.alter_column(
+            "number_of_features", existing_type=sa.Integer(), type_=sa.String(length=120), existing_nullable=True
+        )
+        batch_op.alter_column(
+            "number_of_models", existing_type=sa.Integer(), type_=sa.String(length=120), existing_nullable=True
+        )
+
+    with op.batch_alter_table("fm_metrics", schema=None) as batch_op:
+        batch_op.drop_column("computed_at")
+        batch_op.drop_column("error")
+        batch_op.drop_column("ctc_ratio")
+        batch_op.drop_column("tree_depth")
+        batch_op.drop_column("number_of_constraints")
+        batch_op.drop_column("number_of_features")
+        batch_op.drop_column("checksum")
@@ -0,0 +1,38 @@
+"""Hold back the rollup watermark until the observed record ids are old enough
+
+Revision ID: 014
+Revises: 013
+Create Date: 2026-10-20 10:05:31.204718
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "014"
+down_revision = "013"
+branch_labels = None
+depends_on = None
+
+ROLLUP_SOURCES = ("ds_view_record", "ds_download_record", "file_view_record", "file_download_record")
+
+
+def upgrade():
+    with op.batch_alter_table("rollup_watermark", schema=None) as batch_op:
+        batch_op.add_column(sa.Column("seen_id", sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column("seen_at", sa.DateTime(), nullable=True))
+
+    # Created up front, so two concurrent first rollups never insert the same row
+    watermark = sa.table("rollup_watermark", sa.column("source", sa.String), sa.column("last_id", sa.Integer))
+    existing = {source for (source,) in op.get_bind().execute(sa.select(watermark.c.source))}
+    missing = [{"source": source, "last_id": 0} for source in ROLLUP_SOURCES if source not in existing]
+    if missing:
+        op.bulk_insert(watermark, missing)
+
+
+def downgrade():
+    with op.batch_alter_table("rollup_watermark", schema=None) as batch_op:
+        batch_op.drop_column("seen_at")
+        batch_op.drop_column("seen_id")
@@ -0,0 +1,99 @@
+"""Unique key of the view and download records
+
+Revision ID: 015
+Revises: 014
+Create Date: 2026-10-21 09:12:47.580316
+
+"""
+
+import hashlib
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "015"
+down_revision = "014"
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 10000
+
+# Table, kind, target and cookie, as in app.modules.dataset.tracking
+TRACKED_TABLES = (
+    ("ds_view_record", "dataset_view", "dataset_id", "view_cookie"),
+    ("ds_download_record", "dataset_download", "dataset_id", "download_cookie"),
+    ("file_view_record", "file_view", "file_id", "view_cookie"),
+    ("file_download_record", "file_download", "file_id", "download_cookie"),
+)
+
+# Site counters of the record tables, as seeded in 011
+SITE_COUNTERS = {
+    "dataset_views": "ds_view_record",
+    "dataset_downloads": "ds_download_record",
+    "file_views": "file_view_record",
+    "file_downloads": "file_download_record",
+}
+
+
+def record_key(kind, user_id, target_id, cookie):
+    return hashlib.sha256(f"{kind}\0{target_id}\0{user_id}\0{cookie}".encode()).hexdigest()
+
+
+def upgrade():
+    connection = op.get_bind()
+    for table_name, kind, target, cookie in TRACKED_TABLES:
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            batch_op.add_column(sa.Column("record_key", sa.String(length=64), nullable=True))
+
+        table = sa.table(
+            table_name,
+            sa.column("id", sa.Integer),
+            sa.column("user_id", sa.Integer),
+            sa.column(target, sa.Integer),
+            sa.column(cookie, sa.String),
+            sa.column("record_key", sa.String),
+        )
+        # The oldest record of each key keeps it, the duplicates are dropped
+        seen = set()
+        duplicates = []
+        keys = []
+        rows = connection.execute(
+            sa.select(table.c.id, table.c.user_id, table.c[target], table.c[cookie]).order_by(table.c.id)
+        ).fetchall()
+        for record_id, user_id, target_id, user_cookie in rows:
+            key = record_key(kind, user_id, target_id, user_cookie)
+            if key in seen:
+                duplicates.append(record_id)
+            else:
+                seen.add(key)
+                keys.append({"record_id": record_id, "key": key})
+
+        update = table.update().where(table.c.id == sa.bindparam("record_id")).values(record_key=sa.bindparam("key"))
+        for start in range(0, len(keys), BATCH_SIZE):
+            connection.execute(update, keys[start:start + BATCH_SIZE])
+        for start in range(0, len(duplicates), BATCH_SIZE):
+            connection.execute(table.delete().where(table.c.id.in_(duplicates[start:start + BATCH_SIZE])))
+
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            batch_op.create_unique_constraint(f"uq_{table_name}_record_key", ["record_key"])
+
+    # Counted once per record again
+    op.execute(
+        "UPDATE data_set SET "
+        "view_count = (SELECT COUNT(*) FROM ds_view_record "
+        "WHERE ds_view_record.dataset_id = data_set.id), "
+        "download_count = (SELECT COUNT(*) FROM ds_download_record "
+        "WHERE ds_download_record.dataset_id = data_set.id)"
+    )
+    # The duplicates were deleted without the ORM, the listeners never counted them out
+    for name, table_name in SITE_COUNTERS.items():
+        op.execute(f"UPDATE site_counter SET value = (SELECT COUNT(*) FROM {table_name}) WHERE name = '{name}'")
+
+
+def downgrade():
+    for table_name, _, _, _ in reversed(TRACKED_TABLES):
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            batch_op.drop_constraint(f"uq_{table_name}_record_key", type_="unique")
+            batch_op.drop_column("record_key")
@@ -19,6 +19,15 @@ from rosemary.commands.info import info, info2
 from rosemary.commands.make_module import make_module
 from rosemary.commands.env import env
 from rosemary.commands.test import test
+from rosemary.commands.search_reindex import search_reindex
+from rosemary.commands.counters_reconcile import counters_reconcile
+from rosemary.commands.authors_recount import authors_recount
+from rosemary.commands.datasets_snapshot import datasets_snapshot
+from rosemary.commands.stats_rollup import stats_rollup
+from rosemary.commands.stats_recount import stats_recount
+from rosemary.commands.tracking_rebuild_filter import tracking_rebuild_filter
+from rosemary.commands.flamapy_benchmark import flamapy_benchmark_validation
+from rosemary.commands.metrics_compute import metrics_compute
 
 
 class RosemaryCLI(click.Group):
@@ -58,6 +67,15 @@ cli.add_command(locust)
 cli.add_command(stop)
 cli.add_command(selenium)
 cli.add_command(module_list)
+cli.add_command(search_reindex)
+cli.add_command(counters_reconcile)
+cli.add_command(authors_recount)
+cli.add_command(datasets_snapshot)
+cli.add_command(stats_rollup)
+cli.add_command(stats_recount)
+cli.add_command(tracking_rebuild_filter)
+cli.add_command(flamapy_benchmark_validation)
+cli.add_command(metrics_compute)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,17 @@
+import click
+from flask.cli import with_appcontext
+
+
+@click.command(
+    "authors:recount",
+    help="Rebuilds the author count of every dataset from the author table.",
+)
+@with_appcontext
+def authors_recount():
+    from app.modules.dataset.repositories import DSMetaDataRepository
+
+    try:
+        updated = DSMetaDataRepository().recount_authors()
+        click.echo(click.style(f"Authors recounted for {updated} datasets.", fg="green"))
+    except Exception as e:
+        click.echo(click.style(f"Error recounting the authors: {e}", fg="red"))
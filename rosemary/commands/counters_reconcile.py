@@ -0,0 +1,17 @@
+import click
+from flask.cli import with_appcontext
+
+
+@click.command(
+    "counters:reconcile",
+    help="Rebuilds the dataset view and download counters from the record tables.",
+)
+@with_appcontext
+def counters_reconcile():
+    from app.modules.dataset.repositories import DataSetRepository
+
+    try:
+        updated = DataSetRepository().reconcile_counters()
+        click.echo(click.style(f"Counters reconciled for {updated} datasets.", fg="green"))
+    except Exception as e:
+        click.echo(click.style(f"Error reconciling the counters: {e}", fg="red"))
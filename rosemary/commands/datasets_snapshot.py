@@ -0,0 +1,21 @@
+import click
+from flask.cli import with_appcontext
+
+
+@click.command(
+    "datasets:snapshot",
+    help="Builds or refreshes the prebuilt archive served by /dataset/download/all.",
+)
+@with_appcontext
+def datasets_snapshot():
+    from flask import current_app
+    from app.modules.dataset.services import DataSetService
+
+    if not current_app.config["DATASETS_SNAPSHOT"]:
+        click.echo(click.style("DATASETS_SNAPSHOT is disabled, nothing to do.", fg="yellow"))
+        return
+
+    if DataSetService().refresh_all_datasets_snapshot():
+        click.echo(click.style("Datasets snapshot is up to date.", fg="green"))
+    else:
+        click.echo(click.style("Error refreshing the datasets snapshot, see app.log.", fg="red"))
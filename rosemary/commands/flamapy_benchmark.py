@@ -0,0 +1,35 @@
+import click
+
+
+@click.command(
+    "flamapy:benchmark-validation",
+    help="Compares the two-stage UVL validation with a single full LL parse.",
+)
+@click.option(
+    "--features", "-f", multiple=True, type=int, default=(1000, 5000), help="Size of the synthetic models."
+)
+@click.option("--repeat", "-r", default=3, show_default=True, help="Runs per file, the best one is kept.")
+def flamapy_benchmark_validation(features, repeat):
+    from app.modules.flamapy.benchmark import benchmark_validation
+
+    try:
+        results = benchmark_validation(features, repeat)
+    except Exception as e:
+        click.echo(click.style(f"Error benchmarking the UVL validation: {e}", fg="red"))
+        return
+
+    click.echo(f"{'file':<28}{'lines':>8}{'valid':>7}{'LL (ms)':>11}{'SLL/LL (ms)':>13}{'speedup':>9}")
+    for result in results:
+        click.echo(
+            f"{result.name:<28}{result.lines:>8}{'yes' if result.valid else 'no':>7}"
+            f"{result.ll_seconds * 1000:>11.2f}{result.two_stage_seconds * 1000:>13.2f}{result.speedup:>8.2f}x"
+        )
+    ll_total = sum(result.ll_seconds for result in results)
+    two_stage_total = sum(result.two_stage_seconds for result in results)
+    click.echo(
+        click.style(
+            f"Total: {ll_total * 1000:.2f} ms with LL, {two_stage_total * 1000:.2f} ms with SLL first "
+            f"({ll_total / two_stage_total:.2f}x).",
+            fg="green",
+        )
+    )
@@ -0,0 +1,18 @@
+import click
+from flask.cli import with_appcontext
+
+
+@click.command(
+    "metrics:compute",
+    help="Computes the feature model metrics of the datasets missing them.",
+)
+@click.option("--all", "force", is_flag=True, help="Computes them again for every dataset.")
+@with_appcontext
+def metrics_compute(force):
+    from app.modules.flamapy.services import FlamapyService
+
+    try:
+        count = FlamapyService().compute_missing_metrics(force=force)
+        click.echo(click.style(f"Metrics computed for {count} datasets.", fg="green"))
+    except Exception as e:
+        click.echo(click.style(f"Error computing the metrics: {e}", fg="red"))
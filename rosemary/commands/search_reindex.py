@@ -0,0 +1,19 @@
+import click
+from flask.cli import with_appcontext
+
+
+@click.command(
+    "search:reindex",
+    help="Rebuilds the explore full-text search index and tag tables from the datasets in the database.",
+)
+@with_appcontext
+def search_reindex():
+    from app.modules.explore.repositories import SearchIndexRepository, TagRepository
+
+    try:
+        indexed = SearchIndexRepository().rebuild()
+        click.echo(click.style(f"Search index rebuilt for {indexed} datasets.", fg="green"))
+        tagged = TagRepository().rebuild()
+        click.echo(click.style(f"Tags rebuilt for {tagged} datasets.", fg="green"))
+    except Exception as e:
+        click.echo(click.style(f"Error rebuilding the search index: {e}", fg="red"))
@@ -0,0 +1,18 @@
+import click
+from flask.cli import with_appcontext
+
+
+@click.command(
+    "stats:recount",
+    help="Sets the site counters shown on the homepage to their exact value.",
+)
+@with_appcontext
+def stats_recount():
+    from app.modules.stats.services import SiteStatsService
+
+    try:
+        for name, value in SiteStatsService().recount().items():
+            click.echo(f"{name}: {value}")
+        click.echo(click.style("Site counters recounted.", fg="green"))
+    except Exception as e:
+        click.echo(click.style(f"Error recounting the site counters: {e}", fg="red"))
@@ -0,0 +1,19 @@
+import click
+from flask.cli import with_appcontext
+
+
+@click.command(
+    "stats:rollup",
+    help="Adds the view and download records created since the last run to the daily stats. Meant for cron.",
+)
+@with_appcontext
+def stats_rollup():
+    from app.modules.stats.services import StatsService
+
+    try:
+        processed = StatsService().rollup()
+        for table, count in processed.items():
+            click.echo(f"{table}: {count} new records")
+        click.echo(click.style("Daily stats are up to date.", fg="green"))
+    except Exception as e:
+        click.echo(click.style(f"Error rolling up the daily stats: {e}", fg="red"))
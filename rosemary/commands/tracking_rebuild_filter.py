@@ -0,0 +1,17 @@
+import click
+from flask.cli import with_appcontext
+
+
+@click.command(
+    "tracking:rebuild-filter",
+    help="Rebuilds the Bloom filter of recorded views and downloads from the record tables.",
+)
+@with_appcontext
+def tracking_rebuild_filter():
+    from app.modules.dataset.tracking import rebuild_tracking_filter
+
+    try:
+        count = rebuild_tracking_filter()
+        click.echo(click.style(f"Tracking filter rebuilt with {count} records.", fg="green"))
+    except Exception as e:
+        click.echo(click.style(f"Error rebuilding the tracking filter: {e}", fg="red"))